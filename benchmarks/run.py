@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Time the labelling and I/O kernels on synthetic composites and compare them with a stored baseline, e.g.
+    python -m benchmarks.run                       # compare with benchmarks/baseline.json at 1280
+    python -m benchmarks.run --sizes 1280 2048 4096 --update   # record a new baseline
+"""
+
+from datetime import datetime
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+from solarannotator.io import ThematicMap
+from solarannotator.session import AnnotationSession
+from solarannotator.stretch import StretchCache, stretch_image, three_color_composite
+from solarannotator.template import create_mask, create_thmap_template
+
+from .synthetic import DATE_OBS, solar_radius, synthetic_image_set, synthetic_labels, lasso_vertices
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = (1280,)
+# a kernel regresses when it is this many times slower than the baseline, and by more than MIN_DIFFERENCE seconds
+DEFAULT_THRESHOLD = 1.3
+MIN_DIFFERENCE = 0.001
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """ register a benchmark: a function of the map size that prepares its inputs and returns the call to time """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+@benchmark
+def create_mask_disk(size):
+    return lambda: create_mask(solar_radius(size), (size, size))
+
+
+@benchmark
+def solar_radius_refined(size):
+    image_set = synthetic_image_set(size, ['304'])
+    return lambda: image_set.get_solar_radius()
+
+
+@benchmark
+def thmap_template(size):
+    image_set = synthetic_image_set(size, ['171', '304'])
+    return lambda: create_thmap_template(image_set)
+
+
+def _session(size):
+    # the edits go through the same session the annotator uses, with its history and operation log
+    return AnnotationSession(ThematicMap(synthetic_labels(size), {'DATE-OBS': DATE_OBS}, {}))
+
+
+@benchmark
+def lasso_fill(size):
+    session = _session(size)
+    verts = lasso_vertices(size)
+    themes = iter(np.resize([4, 5], 10 ** 6))
+    return lambda: session.lasso(verts, next(themes))
+
+
+@benchmark
+def rename_region(size):
+    # relabel the quiet sun, the largest region of a map, back and forth
+    session = _session(size)
+    x, y = size // 2 - int(0.6 * solar_radius(size)), size // 2
+    themes = iter(np.resize([3, 7], 10 ** 6))
+    return lambda: session.fill(x, y, next(themes))
+
+
+@benchmark
+def region_boundary(size):
+    session = _session(size)
+    x, y = size // 2 - int(0.6 * solar_radius(size)), size // 2
+    return lambda: session.boundary(x, y)
+
+
+@benchmark
+def stretch_single_color(size):
+    # a new composite is sorted for its percentiles first, as when a map is loaded
+    data = synthetic_image_set(size, ['171'])['171'].data
+    return lambda: stretch_image(data, 1, 99.5, 0.5)
+
+
+@benchmark
+def stretch_three_color(size):
+    # moving a slider: the sorted values are cached, the stretch itself is not
+    image_set = synthetic_image_set(size, ['94', '131', '171'])
+    channels = ['94', '131', '171']
+    images = [image_set[channel].data for channel in channels]
+    cache = StretchCache()
+    upper_percentiles = iter(99 + np.resize(np.arange(1000) / 1000, 10 ** 6))
+
+    def run():
+        upper = next(upper_percentiles)
+        return three_color_composite(channels, images, [1, 1, 1], [upper] * 3, [0.5] * 3, cache)
+    return run
+
+
+def _round_trip(size, compression):
+    thmap = ThematicMap(synthetic_labels(size), {'DATE-OBS': DATE_OBS, 'DIAM_SUN': 2 * solar_radius(size)},
+                        {1: 'outer_space', 4: 'filament', 6: 'coronal_hole', 7: 'quiet_sun', 8: 'limb'})
+    # removed once the benchmark is dropped, or at exit at the latest
+    directory = tempfile.TemporaryDirectory(prefix="solarannotator_benchmark_")
+
+    def run():
+        path = os.path.join(directory.name, "thmap.fits")
+        thmap.save(path, compression)
+        return ThematicMap.load(path)
+    return run
+
+
+@benchmark
+def save_load(size):
+    return _round_trip(size, None)
+
+
+@benchmark
+def save_load_compressed(size):
+    return _round_trip(size, "GZIP_2")
+
+
+def time_call(call, repeat=7, min_time=0.2):
+    """
+    :param call: function without arguments
+    :param repeat: number of timings, each of a loop of calls
+    :param min_time: a loop runs the call enough times to last at least this many seconds, so fast calls are not
+        measured at the resolution of the clock
+    :return: dictionary of the 'min' and 'median' seconds per call and the 'loops' per timing
+    """
+    call()  # warm up caches and imports
+    loops, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            call()
+        timings.append((time.perf_counter() - start) / loops)
+    return {'min': min(timings), 'median': float(np.median(timings)), 'loops': loops}
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, repeat=7, min_time=0.2, report=print):
+    """
+    :param sizes: sides of the synthetic maps in pixels
+    :param names: optional glob patterns of the benchmarks to run, defaults to all
+    :param repeat: number of timings of each benchmark
+    :param min_time: seconds every timing lasts at least
+    :param report: function called with a line for every result
+    :return: dictionary of 'name/size' to the timing, see time_call
+    """
+    results = {}
+    for size in sizes:
+        for name, setup in BENCHMARKS.items():
+            if names and not any(fnmatch.fnmatch(name, pattern) for pattern in names):
+                continue
+            key = "{}/{}".format(name, size)
+            results[key] = time_call(setup(size), repeat, min_time)
+            report("{:<32} {:>10.3f} ms".format(key, results[key]['min'] * 1000))
+    return results
+
+
+def compare(results, baseline, threshold=None, min_difference=MIN_DIFFERENCE):
+    """
+    :param results: timings from run_benchmarks
+    :param baseline: baseline file contents, with 'results' and a 'threshold'
+    :param threshold: ratio of the fastest timings that counts as a regression, defaults to the baseline's
+    :param min_difference: seconds a kernel has to slow down by at least to regress, the noise of fast kernels
+    :return: list of (key, baseline seconds, seconds, ratio) of the regressions
+    """
+    threshold = threshold or baseline.get('threshold', DEFAULT_THRESHOLD)
+    regressions = []
+    for key, timing in results.items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        ratio = timing['min'] / reference['min']
+        if ratio > threshold and timing['min'] - reference['min'] > min_difference:
+            regressions.append((key, reference['min'], timing['min'], ratio))
+    return regressions
+
+
+def machine():
+    return {'platform': platform.platform(), 'processor': platform.processor() or platform.machine(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'cpus': os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the labelling and I/O kernels on synthetic composites')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='sides of the synthetic maps, e.g. 1280 2048 4096')
+    parser.add_argument('--only', nargs='+', help='glob patterns of the benchmarks to run, e.g. "save*"')
+    parser.add_argument('--repeat', type=int, default=7, help='timings of each benchmark, the fastest counts')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON file')
+    parser.add_argument('--threshold', type=float,
+                        help='slowdown ratio that fails, defaults to the one stored in the baseline')
+    parser.add_argument('--update', action='store_true',
+                        help='store these timings in the baseline instead of comparing with it')
+    parser.add_argument('--output', help='also write these timings to a JSON file')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return
+    results = run_benchmarks(args.sizes, args.only, args.repeat)
+    run = {'date': datetime.now().isoformat(timespec='seconds'), 'machine': machine(), 'results': results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=1, sort_keys=True)
+
+    if args.update:
+        baseline = {'threshold': DEFAULT_THRESHOLD, 'results': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline['results'].update(results)
+        baseline.update(date=run['date'], machine=run['machine'],
+                        threshold=args.threshold or baseline.get('threshold', DEFAULT_THRESHOLD))
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("Baseline written to {}".format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, record one with --update".format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('machine', {}).get('processor') != run['machine']['processor']:
+        print("The baseline was recorded on {}, timings may not be comparable".format(
+            baseline.get('machine', {}).get('processor')))
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        # a slow timing is often a busy machine, a regression has to show again to count
+        print("Timing {} possible regressions again".format(len(regressions)))
+        for key, _, _, _ in regressions:
+            name, size = key.rsplit("/", 1)
+            again = time_call(BENCHMARKS[name](int(size)), args.repeat)
+            if again['min'] < results[key]['min']:
+                results[key] = again
+        regressions = compare(results, baseline, args.threshold)
+    for key, before, after, ratio in regressions:
+        print("REGRESSION {}: {:.3f} ms -> {:.3f} ms ({:.2f}x)".format(key, before * 1000, after * 1000, ratio))
+    print("{} benchmarks, {} regressions".format(len(results), len(regressions)))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import numpy as np
+
+from solarannotator.geometry import radial_distance, concentric_rings
+from solarannotator.io import Image, ImageSet, CHANNELS, LABEL_DTYPE
+
+# the sun covers about the same fraction of a SUVI composite at every size
+RADIUS_FRACTION = 0.3
+DATE_OBS = '2023-01-01T00:00:00'
+
+
+def solar_radius(size):
+    return RADIUS_FRACTION * size
+
+
+def limb_darkened_disk(size, limb_darkening=0.6, corona_scale=0.04, noise=0.02, seed=0):
+    """
+    A composite of the sun as the annotator sees it: a limb-darkened disk with a few active regions and a coronal
+    hole, a corona that falls off past the limb, and noise
+    :param size: side of the square image in pixels
+    :param limb_darkening: linear limb darkening coefficient, the limb is this much darker than the center
+    :param corona_scale: how fast the corona falls off, as a fraction of the solar radius
+    :param noise: standard deviation of the noise, relative to the center brightness
+    :param seed: seed of the noise and of where the features are
+    :return: float32 image
+    """
+    rng = np.random.default_rng(seed)
+    radius = solar_radius(size)
+    r = radial_distance((size, size)) / radius
+    mu = np.sqrt(np.clip(1 - r ** 2, 0, None))
+    image = np.where(r < 1, 1 - limb_darkening * (1 - mu), 0.2 * np.exp(-(r - 1) / corona_scale))
+
+    rows, columns = np.ogrid[:size, :size]
+    center = (size - 1) / 2
+    for brightness in (3.0, 2.0, 2.5, 0.2):  # the last one is a coronal hole
+        angle, distance = rng.uniform(0, 2 * np.pi), rng.uniform(0.1, 0.7) * radius
+        row, column = center + distance * np.sin(angle), center + distance * np.cos(angle)
+        width = rng.uniform(0.04, 0.1) * radius
+        blob = np.exp(-((rows - row) ** 2 + (columns - column) ** 2) / (2 * width ** 2))
+        image *= 1 + (brightness - 1) * blob
+    image += rng.normal(0, noise, image.shape)
+    return image.astype(np.float32)
+
+
+def synthetic_image_set(size, channels=CHANNELS):
+    """
+    :param size: side of the composites in pixels
+    :param channels: channels to include, each with its own features
+    :return: ImageSet whose headers carry the solar diameter and observation time, as SUVI composites do
+    """
+    header = {'DIAM_SUN': 2 * solar_radius(size), 'DATE-OBS': DATE_OBS}
+    return ImageSet({channel: Image(limb_darkened_disk(size, seed=seed), dict(header))
+                     for seed, channel in enumerate(channels)})
+
+
+def lasso_vertices(size, center=(0.5, 0.4), radius=0.08, count=200, seed=0):
+    """
+    A wobbly closed path like one drawn by hand with the lasso
+    :param size: side of the map in pixels
+    :param center: center of the path as fractions of the map
+    :param radius: mean radius of the path as a fraction of the map
+    :param count: number of vertices, the lasso reports one per mouse move
+    :param seed: seed of the wobble
+    :return: list of (x, y) vertices
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    radii = radius * size * (1 + 0.2 * np.sin(5 * angles) + rng.normal(0, 0.02, count))
+    x = center[1] * size + radii * np.cos(angles)
+    y = center[0] * size + radii * np.sin(angles)
+    return list(zip(x, y))
+
+
+def synthetic_labels(size):
+    """
+    A template with a few annotated regions, one of them with a hole, like a map midway through annotation
+    :param size: side of the map in pixels
+    :return: LABEL_DTYPE array
+    """
+    radius = solar_radius(size)
+    labels = concentric_rings((size, size), [radius - 5, radius + 5], [7, 8, 1], dtype=LABEL_DTYPE)
+    r = radial_distance((size, size))
+    offset = radial_distance((size, size), ((size - 1) / 2 + 0.4 * radius, (size - 1) / 2))
+    labels[offset < 0.25 * radius] = 6
+    labels[offset < 0.1 * radius] = 7
+    labels[(r < 0.5 * radius) & (np.abs(np.arange(size) - size / 2) < 0.02 * size)[None, :]] = 4
+    return labels
@@ -0,0 +1,2 @@
+# pytest puts the directory of this file on sys.path, so the tests can import the benchmarks package, which is not
+# installed with solarannotator
@@ -32,6 +32,10 @@ setup(
                       "zeep",
                       "drms"],
     data_files=[('solarannotator', ['cfg/default.json'])],
-    entry_points={"console_scripts": ["SolarAnnotator = solarannotator.main:main"]}
+    entry_points={"console_scripts": ["SolarAnnotator = solarannotator.main:main",
+                                    "SolarAnnotatorBatch = solarannotator.batch:main",
+                                    "SolarAnnotatorCatalog = solarannotator.catalog:main",
+                                    "SolarAnnotatorStats = solarannotator.stats:main",
+                                    "SolarAnnotatorReplay = solarannotator.session:main"]}
 
 )
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from dateutil.parser import parse as parse_date_str
+import argparse
+import json
+import os
+import sys
+
+from .cache import verify_checksums
+from .config import Config
+from .io import ImageSet, RetrievalError, THEMATIC_MAP_COMPRESSION
+from . import profiling
+from .template import create_thmap_template
+
+FILENAME_FORMAT = "thmap_%Y%m%dT%H%M%S.fits"
+
+# each worker process builds its configuration and caches once, see _initialize_worker
+_worker_state = {}
+
+
+def template_dates(start, end, cadence):
+    """
+    List the dates of a batch
+    :param start: first datetime
+    :param end: last datetime, included when it falls on the cadence
+    :param cadence: timedelta between templates
+    :return: list of datetimes
+    """
+    if cadence <= timedelta(0):
+        raise RuntimeError("The cadence must be positive")
+    dates = []
+    date = start
+    while date <= end:
+        dates.append(date)
+        date += cadence
+    return dates
+
+
+def output_path(directory, date):
+    """
+    Where the template of a date is written
+    :param directory: output directory of the batch
+    :param date: datetime of the template
+    :return: path of the FITS file
+    """
+    return os.path.join(directory, date.strftime(FILENAME_FORMAT))
+
+
+def is_complete(path):
+    """
+    Check whether an earlier run already wrote a template, so a batch can be resumed
+    :param path: path of the FITS file
+    :return: true if the file exists and passes its checksums
+    """
+    return os.path.exists(path) and verify_checksums(path)
+
+
+def read_failure_log(path):
+    """
+    Read the dates listed in a failure log
+    :param path: path of the JSON lines failure log
+    :return: set of the failed dates as ISO strings
+    """
+    failed = set()
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    failed.add(json.loads(line)['date'])
+                except (ValueError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return failed
+
+
+def append_failure(path, date, error, failures=None):
+    """
+    Record a date that could not be processed as one JSON line
+    :param path: path of the failure log
+    :param date: datetime that failed
+    :param error: description of the error
+    :param failures: optional dictionary of channel name to why that channel failed
+    """
+    entry = {'date': date.isoformat(), 'error': error, 'failures': failures or {},
+             'logged': datetime.now().isoformat(timespec='seconds')}
+    with open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def build_template(date, path, config, cache=None, reprojection_cache=None, compression=None, tile_shape=None):
+    """
+    Retrieve the composites of a date and write its thematic map template
+    :param date: datetime of the template
+    :param path: where to write the FITS file, it appears only once it is complete
+    :param config: Config with the retrieval settings
+    :param cache: optional CompositeCache
+    :param reprojection_cache: optional ReprojectionCache
+    :param compression: optional tile compression, see ThematicMap.save
+    :param tile_shape: optional compression tile shape, see ThematicMap.save
+    :return: the path written
+    """
+    composites = ImageSet.retrieve(date,
+                                   max_workers=config.retrieval_workers,
+                                   timeout=config.retrieval_timeout,
+                                   cache=cache,
+                                   reprojection_cache=reprojection_cache)
+    thmap = create_thmap_template(composites)
+    thmap.copy_195_metadata(composites)
+    thmap.metadata['DATE'] = str(datetime.today())
+
+    staging = path + ".partial"
+    try:
+        thmap.save(staging, compression, tile_shape)
+        os.replace(staging, path)
+    finally:
+        if os.path.exists(staging):
+            os.remove(staging)
+    return path
+
+
+def _initialize_worker(config_path, compression=None):
+    config = Config(config_path)
+    _worker_state['compression'] = config.output_compression if compression is None else compression
+    _worker_state['config'] = config
+    _worker_state['cache'] = config.create_cache()
+    _worker_state['reprojection_cache'] = config.create_reprojection_cache()
+
+
+def _process_date(date, path):
+    """
+    Build one template inside a worker, errors are returned instead of raised so one date cannot stop the batch
+    :return: tuple of date, path or None, error description or None, and per channel failures
+    """
+    try:
+        build_template(date, path, _worker_state['config'], _worker_state['cache'],
+                       _worker_state['reprojection_cache'], _worker_state['compression'],
+                       _worker_state['config'].output_tile_shape)
+    except RetrievalError as e:
+        return date, None, str(e), e.failures
+    except Exception as e:
+        return date, None, "{}: {}".format(type(e).__name__, e), {}
+    return date, path, None, {}
+
+
+def run_batch(dates, output_directory, config_path, processes=4, failure_log=None, skip_failed=False,
+              overwrite=False, compression=None, report=print):
+    """
+    Write thematic map templates for many dates with a pool of worker processes.
+    Dates whose template already exists are skipped, so an interrupted batch picks up where it stopped.
+    :param dates: datetimes to process
+    :param output_directory: where the FITS files are written
+    :param config_path: configuration file, each worker loads it and builds its own caches
+    :param processes: number of worker processes, 1 processes the dates in this process
+    :param failure_log: JSON lines file that failed dates are appended to, defaults to failures.jsonl
+        in the output directory
+    :param skip_failed: if True, dates already in the failure log are not retried
+    :param overwrite: if True, existing templates are rebuilt
+    :param compression: tile compression of the written files, defaults to the one in the configuration
+    :param report: function called with a line of progress for every date
+    :return: dictionary with the lists of 'written', 'skipped', and 'failed' dates
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    if failure_log is None:
+        failure_log = os.path.join(output_directory, "failures.jsonl")
+    previously_failed = read_failure_log(failure_log) if skip_failed else set()
+
+    summary = {'written': [], 'skipped': [], 'failed': []}
+    pending = []
+    for date in dates:
+        path = output_path(output_directory, date)
+        if date.isoformat() in previously_failed or (not overwrite and is_complete(path)):
+            summary['skipped'].append(date)
+        else:
+            pending.append((date, path))
+    report("{} dates: {} to process, {} skipped".format(len(dates), len(pending), len(summary['skipped'])))
+
+    def record(result, done):
+        date, path, error, failures = result
+        if error is None:
+            summary['written'].append(date)
+            report("[{}/{}] {} -> {}".format(done, len(pending), date.isoformat(), path))
+        else:
+            summary['failed'].append(date)
+            append_failure(failure_log, date, error, failures)
+            report("[{}/{}] {} failed: {}".format(done, len(pending), date.isoformat(), error))
+
+    if processes <= 1:
+        _initialize_worker(config_path, compression)
+        for done, (date, path) in enumerate(pending, start=1):
+            record(_process_date(date, path), done)
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_initialize_worker,
+                                 initargs=(config_path, compression)) as executor:
+            futures = [executor.submit(_process_date, date, path) for date, path in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                record(future.result(), done)
+    return summary
+
+
+def parse_cadence(text):
+    """
+    Read a cadence such as "90s", "15m", "6h", or "1d", a bare number is in minutes
+    :param text: the cadence as given on the command line
+    :return: timedelta
+    """
+    units = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}
+    text = text.strip().lower()
+    try:
+        if text[-1:] in units:
+            return timedelta(**{units[text[-1]]: float(text[:-1])})
+        return timedelta(minutes=float(text))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid cadence {}".format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create thematic map templates for a range of dates')
+    parser.add_argument('start', type=parse_date_str, help='first date, e.g. 2023-01-01T00:00')
+    parser.add_argument('end', type=parse_date_str, help='last date, included when it falls on the cadence')
+    parser.add_argument('--cadence', type=parse_cadence, default=timedelta(hours=1),
+                        help='time between templates, e.g. 15m, 6h, or 1d (default 1h)')
+    parser.add_argument('--output', default='.', help='directory the templates are written to')
+    parser.add_argument('--config', help='a configuration file to load',
+                        default=os.path.join(sys.prefix, 'solarannotator/default.json'))
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    parser.add_argument('--failure-log', help='JSON lines file of failed dates, defaults to failures.jsonl '
+                                              'in the output directory')
+    parser.add_argument('--skip-failed', action='store_true', help='do not retry dates in the failure log')
+    parser.add_argument('--overwrite', action='store_true', help='rebuild templates that already exist')
+    parser.add_argument('--compression', choices=THEMATIC_MAP_COMPRESSION,
+                        help='write tile-compressed files, defaults to the compression in the configuration')
+    args = parser.parse_args()
+    profiling.enable_from_environment()
+
+    dates = template_dates(args.start, args.end, args.cadence)
+    summary = run_batch(dates, args.output, args.config, processes=args.processes,
+                        failure_log=args.failure_log, skip_failed=args.skip_failed, overwrite=args.overwrite,
+                        compression=args.compression)
+    print("{} written, {} skipped, {} failed".format(len(summary['written']), len(summary['skipped']),
+                                                     len(summary['failed'])))
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+from astropy.io import fits
+from datetime import datetime, timedelta
+import threading
+import shutil
+import glob
+import os
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".solarannotator", "cache")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class CompositeCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES,
+                 tolerance=timedelta(minutes=2)):
+        """
+        A size-bounded, least recently used cache of downloaded FITS files, e.g. SUVI composites and GONG images.
+        Entries are keyed by source (satellite or observatory), product, and observation time, and the file names
+        carry the key so the directory itself is the index and can be shared by several processes.
+        :param directory: where the cached files live
+        :param max_bytes: size budget of the cache, the least recently used files are removed beyond it
+        :param tolerance: a cached observation this close to a requested date is treated as the nearest one
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, source, product, obs_time, extension):
+        name = "{}.{}.{}{}".format(source, product, obs_time.strftime(TIME_FORMAT), extension)
+        return os.path.join(self.directory, name)
+
+    def _entries(self, source, product):
+        """
+        List the cached files of a source and product
+        :return: list of (observation time, path)
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "{}.{}.*".format(source, product))):
+            if path.endswith(".partial"):
+                continue
+            try:
+                obs_time = datetime.strptime(os.path.basename(path).split(".")[2], TIME_FORMAT)
+            except (IndexError, ValueError):
+                continue
+            entries.append((obs_time, path))
+        return entries
+
+    def get(self, source, product, obs_time):
+        """
+        Find the cached file for an exact observation time
+        :param source: satellite or observatory name, e.g. "GOES16"
+        :param product: product name, e.g. "suvi_l2_ci195"
+        :param obs_time: datetime of the observation
+        :return: path to a verified cached file or None on a miss
+        """
+        obs_time = obs_time.replace(microsecond=0)
+        for entry_time, path in self._entries(source, product):
+            if entry_time == obs_time:
+                return self._hit(path)
+        return None
+
+    def lookup(self, source, product, date):
+        """
+        Find the cached observation nearest to a requested date, without going to the network
+        :param source: satellite or observatory name, e.g. "GOES16"
+        :param product: product name, e.g. "suvi_l2_ci195"
+        :param date: the requested datetime
+        :return: path to a verified cached file or None if nothing is cached within the tolerance
+        """
+        entries = [(abs(entry_time - date), path) for entry_time, path in self._entries(source, product)]
+        entries = [(distance, path) for distance, path in entries if distance <= self.tolerance]
+        if not entries:
+            return None
+        return self._hit(min(entries)[1])
+
+    def _hit(self, path):
+        if not verify_checksums(path):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)  # the modification time doubles as the last access time for eviction
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, source, product, obs_time, path):
+        """
+        Move a downloaded file into the cache
+        :param source: satellite or observatory name, e.g. "GOES16"
+        :param product: product name, e.g. "suvi_l2_ci195"
+        :param obs_time: datetime of the observation
+        :param path: the downloaded file, it is moved and no longer exists afterward
+        :return: path of the file inside the cache
+        """
+        basename = os.path.basename(path)
+        extension = basename[basename.index("."):] if "." in basename else ""
+        destination = self._path(source, product, obs_time.replace(microsecond=0), extension)
+        staging = destination + ".partial"
+        shutil.move(path, staging)
+        if not verify_checksums(staging):
+            self._remove(staging)
+            raise RuntimeError("Downloaded file {} failed its FITS checksum".format(basename))
+        os.replace(staging, destination)
+        os.utime(destination)
+        self.evict(keep=destination)
+        return destination
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used files until the cache fits in its byte budget
+        :param keep: a path that is never removed, e.g. the file that was just stored
+        """
+        with self._lock:
+            evict_least_recently_used(self.directory, self.max_bytes, keep)
+
+    def size(self):
+        """
+        :return: total bytes used by the cache
+        """
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, "*")))
+
+    def clear(self):
+        """ Remove every cached file """
+        for path in glob.glob(os.path.join(self.directory, "*")):
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        _remove(path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False  # e.g. still memory-mapped on Windows, it is tried again on the next eviction
+    return True
+
+
+def evict_least_recently_used(directory, max_bytes, keep=None):
+    """
+    Remove the least recently modified files of a directory until it fits in a byte budget
+    :param directory: the directory to trim, files still being written (ending in .partial) are ignored
+    :param max_bytes: size budget of the directory
+    :param keep: a path that is never removed
+    """
+    entries = []
+    for path in glob.glob(os.path.join(directory, "*")):
+        if path.endswith(".partial"):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        if _remove(path):
+            total -= size
+
+
+def verify_checksums(path):
+    """
+    Check the CHECKSUM and DATASUM keywords of every HDU in a FITS file, HDUs without them pass
+    :param path: path to the FITS file
+    :return: true if the file opens and no checksum disagrees with its contents
+    """
+    try:
+        with fits.open(path, disable_image_compression=True) as hdul:
+            for hdu in hdul:
+                if 'CHECKSUM' in hdu.header and hdu.verify_checksum() == 0:
+                    return False
+                if 'DATASUM' in hdu.header and hdu.verify_datasum() == 0:
+                    return False
+    except (OSError, ValueError):
+        return False
+    return True
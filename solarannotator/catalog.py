@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+from astropy.io import fits
+from dateutil.parser import parse as parse_date_str
+import argparse
+import fnmatch
+import glob
+import numpy as np
+import os
+import sqlite3
+import sys
+
+from .io import thematic_map_hdus, read_theme_mapping
+from .reprojection import observation_time
+
+DEFAULT_CATALOG_FILENAME = "catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS maps (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,
+                                 date_obs TEXT, date TEXT, rows INTEGER, columns INTEGER);
+CREATE TABLE IF NOT EXISTS themes (path TEXT, value INTEGER, name TEXT, PRIMARY KEY (path, value));
+CREATE TABLE IF NOT EXISTS counts (path TEXT, value INTEGER, pixels INTEGER, PRIMARY KEY (path, value));
+CREATE INDEX IF NOT EXISTS maps_date_obs ON maps (date_obs);
+CREATE INDEX IF NOT EXISTS maps_date ON maps (date);
+CREATE INDEX IF NOT EXISTS themes_name ON themes (name, value);
+CREATE INDEX IF NOT EXISTS counts_value ON counts (value, pixels);
+"""
+
+
+def _iso(value):
+    # dates are stored as ISO strings so that comparing them as text orders them in time
+    if value is None:
+        return None
+    try:
+        return parse_date_str(str(value)).replace(tzinfo=None).isoformat()
+    except (ValueError, OverflowError):
+        return None
+
+
+def read_catalog_entry(path):
+    """
+    Open a thematic map once and gather what the catalog stores about it
+    :param path: path to the FITS file
+    :return: dictionary with 'date_obs', 'date', 'shape', 'theme_mapping', and 'counts', the number of pixels
+        of every label present in the map
+    """
+    with fits.open(path) as hdulist:
+        image_hdu, table_hdu = thematic_map_hdus(hdulist)
+        header = image_hdu.header
+        date_obs = observation_time(header)
+        counts = np.bincount(np.ravel(image_hdu.data))
+        return {'date_obs': date_obs.isoformat() if date_obs is not None else None,
+                'date': _iso(header.get('DATE')),
+                'shape': (header['NAXIS2'], header['NAXIS1']),
+                'theme_mapping': read_theme_mapping(table_hdu),
+                'counts': {value: int(pixels) for value, pixels in enumerate(counts) if pixels}}
+
+
+class Catalog:
+    def __init__(self, path):
+        """
+        An SQLite index of thematic maps, so they can be found by date or content without opening them
+        :param path: the SQLite file, created if it does not exist
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM maps").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory, pattern="*.fits", report=None):
+        """
+        Bring the catalog up to date with a directory of thematic maps. Files whose modification time and size
+        have not changed are not opened again, and files that were deleted are dropped.
+        :param directory: directory of thematic map FITS files
+        :param pattern: glob pattern of the files to include
+        :param report: optional function called with a line for every file that could not be read
+        :return: dictionary with the lists of 'added', 'updated', 'unchanged', 'removed', and 'failed' paths
+        """
+        summary = {'added': [], 'updated': [], 'unchanged': [], 'removed': [], 'failed': []}
+        directory = os.path.abspath(directory)
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                 self.connection.execute("SELECT path, mtime_ns, size FROM maps WHERE path LIKE ? ESCAPE '\\'",
+                                         (_like_prefix(directory),))}
+        found = set()
+        with self.connection:
+            for path in sorted(glob.glob(os.path.join(directory, pattern))):
+                found.add(path)
+                stat = os.stat(path)
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    summary['unchanged'].append(path)
+                    continue
+                try:
+                    entry = read_catalog_entry(path)
+                except (OSError, RuntimeError, KeyError, ValueError) as e:
+                    summary['failed'].append(path)
+                    if report is not None:
+                        report("{} could not be read: {}".format(path, e))
+                    continue
+                self._delete(path)
+                self._insert(path, stat, entry)
+                summary['updated' if path in known else 'added'].append(path)
+
+            for path in known:
+                if path not in found and os.path.dirname(path) == directory \
+                        and fnmatch.fnmatch(os.path.basename(path), pattern):
+                    self._delete(path)
+                    summary['removed'].append(path)
+        return summary
+
+    def _insert(self, path, stat, entry):
+        rows, columns = entry['shape']
+        self.connection.execute("INSERT INTO maps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (path, stat.st_mtime_ns, stat.st_size, entry['date_obs'], entry['date'],
+                                 rows, columns))
+        self.connection.executemany("INSERT INTO themes VALUES (?, ?, ?)",
+                                    [(path, value, name) for value, name in entry['theme_mapping'].items()])
+        self.connection.executemany("INSERT INTO counts VALUES (?, ?, ?)",
+                                    [(path, value, pixels) for value, pixels in entry['counts'].items()])
+
+    def _delete(self, path):
+        for table in ("maps", "themes", "counts"):
+            self.connection.execute("DELETE FROM {} WHERE path = ?".format(table), (path,))
+
+    def find(self, start=None, end=None, saved_after=None, saved_before=None, containing=None, min_pixels=1):
+        """
+        Find thematic maps by observation time, save time, and content
+        :param start: earliest observation time, included
+        :param end: latest observation time, included
+        :param saved_after: earliest save time (the DATE keyword), included
+        :param saved_before: latest save time, included
+        :param containing: optional theme name, e.g. 'flare', or theme index the map must contain
+        :param min_pixels: how many pixels of that theme the map must have at least
+        :return: list of paths ordered by observation time
+        """
+        conditions, parameters = [], []
+        if containing is None:
+            query = "SELECT maps.path FROM maps"
+        else:
+            # start from the few maps with enough pixels of the theme instead of checking the counts of every map
+            query = "SELECT maps.path FROM counts"
+            if isinstance(containing, str):
+                query += " CROSS JOIN themes ON themes.path = counts.path AND themes.value = counts.value"
+                conditions += ["counts.value IN (SELECT value FROM themes WHERE name = ?)", "themes.name = ?"]
+                parameters += [containing, containing]
+            else:
+                conditions.append("counts.value = ?")
+                parameters.append(containing)
+            query += " CROSS JOIN maps ON maps.path = counts.path"
+            conditions.append("counts.pixels >= ?")
+            parameters.append(min_pixels)
+        for column, operator, value in (("date_obs", ">=", start), ("date_obs", "<=", end),
+                                        ("date", ">=", saved_after), ("date", "<=", saved_before)):
+            if value is not None:
+                conditions.append("maps.{} {} ?".format(column, operator))
+                parameters.append(_iso(value))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY maps.date_obs, maps.path"
+        return [path for path, in self.connection.execute(query, parameters)]
+
+    def pixel_counts(self, path):
+        """
+        :param path: a cataloged thematic map
+        :return: dictionary of theme name (or index when the map does not name it) to its number of pixels
+        """
+        rows = self.connection.execute("SELECT counts.value, themes.name, counts.pixels FROM counts "
+                                       "LEFT JOIN themes ON themes.path = counts.path AND themes.value = counts.value "
+                                       "WHERE counts.path = ? ORDER BY counts.value", (os.path.abspath(path),))
+        return {value if name is None else name: pixels for value, name, pixels in rows}
+
+
+def _like_prefix(directory):
+    escaped = directory.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + os.sep + "%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Index thematic maps and search them by date or content')
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG_FILENAME,
+                        help='SQLite file of the catalog (default {})'.format(DEFAULT_CATALOG_FILENAME))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    update = commands.add_parser('update', help='add new or changed maps of a directory to the catalog')
+    update.add_argument('directory', help='directory of thematic map FITS files')
+    update.add_argument('--pattern', default='*.fits', help='glob pattern of the files to include')
+
+    find = commands.add_parser('find', help='list the maps that match every condition given')
+    find.add_argument('--start', type=parse_date_str, help='earliest observation time')
+    find.add_argument('--end', type=parse_date_str, help='latest observation time')
+    find.add_argument('--saved-after', type=parse_date_str, help='earliest save time')
+    find.add_argument('--saved-before', type=parse_date_str, help='latest save time')
+    find.add_argument('--containing', help='theme name the map must contain, e.g. flare')
+    find.add_argument('--min-pixels', type=int, default=1, help='pixels of that theme the map must have')
+    find.add_argument('--counts', action='store_true', help='print the pixels of every theme of each map')
+    args = parser.parse_args()
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == 'update':
+            summary = catalog.update(args.directory, args.pattern, report=print)
+            print("{} added, {} updated, {} unchanged, {} removed, {} failed".format(
+                *(len(summary[key]) for key in ('added', 'updated', 'unchanged', 'removed', 'failed'))))
+            sys.exit(1 if summary['failed'] else 0)
+        else:
+            for path in catalog.find(args.start, args.end, args.saved_after, args.saved_before,
+                                     args.containing, args.min_pixels):
+                if args.counts:
+                    counts = ", ".join("{}={}".format(name, pixels)
+                                       for name, pixels in catalog.pixel_counts(path).items())
+                    print("{}\t{}".format(path, counts))
+                else:
+                    print(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 import json
+import os
+from datetime import timedelta
 import matplotlib
 
+from .cache import CompositeCache, DEFAULT_CACHE_DIRECTORY, DEFAULT_MAX_BYTES
+from .reprojection import ReprojectionCache, DEFAULT_REPROJECTION_DIRECTORY, \
+    DEFAULT_MAX_BYTES as DEFAULT_REPROJECTION_MAX_BYTES
+
 
 class Config:
     def __init__(self, config_file_path):
@@ -23,6 +29,49 @@ class Config:
         self.solar_cmap = matplotlib.colors.ListedColormap(self.color_table)
         self.max_index = max(list(self.solar_class_name.keys()))
 
+        retrieval = config.get('retrieval', {})
+        self.retrieval_workers = int(retrieval.get('max_workers', 7))
+        self.retrieval_timeout = retrieval.get('timeout', None)
+
+        history = config.get('history', {})
+        self.history_max_bytes = int(history.get('max_bytes', 256 * 1024 ** 2))
+        self.history_coalesce_pixels = int(history.get('coalesce_pixels', 16))
+        self.history_coalesce_seconds = float(history.get('coalesce_seconds', 0.5))
+
+        navigation = config.get('navigation', {})
+        self.navigation_cadence = timedelta(hours=float(navigation.get('cadence_hours', 6)))
+        self.prefetch_steps = int(navigation.get('prefetch_steps', 1))
+        self.prefetch_max_sets = navigation.get('prefetch_max_sets', None)
+
+        output = config.get('output', {})
+        self.output_compression = output.get('compression', None)
+        self.output_tile_shape = output.get('tile_shape', None)
+
+        cache = config.get('cache', {})
+        self.cache_enabled = bool(cache.get('enabled', True))
+        self.cache_directory = cache.get('directory') or DEFAULT_CACHE_DIRECTORY
+        self.cache_max_bytes = int(cache.get('max_bytes', DEFAULT_MAX_BYTES))
+        self.reprojection_directory = cache.get('reprojection_directory') or DEFAULT_REPROJECTION_DIRECTORY
+        self.reprojection_max_bytes = int(cache.get('reprojection_max_bytes', DEFAULT_REPROJECTION_MAX_BYTES))
+
+    def create_cache(self):
+        """
+        Build the composite cache described by the configuration
+        :return: a CompositeCache or None when caching is disabled
+        """
+        if not self.cache_enabled:
+            return None
+        return CompositeCache(os.path.expanduser(self.cache_directory), self.cache_max_bytes)
+
+    def create_reprojection_cache(self):
+        """
+        Build the GONG reprojection cache described by the configuration
+        :return: a ReprojectionCache or None when caching is disabled
+        """
+        if not self.cache_enabled:
+            return None
+        return ReprojectionCache(os.path.expanduser(self.reprojection_directory), self.reprojection_max_bytes)
+
     def is_valid(self):
         """
         Check that the configuration file is valid
@@ -0,0 +1,194 @@
+from astropy.io import fits
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from dateutil.parser import parse as parse_date_str
+import glob
+import json
+import numpy as np
+import os
+
+from .io import ThematicMap, thematic_map_hdus, read_theme_mapping, theme_mappings_match, as_labels, LABEL_DTYPE
+from .reprojection import observation_time
+
+LABELS_FILENAME = "labels.npy"
+INDEX_FILENAME = "index.json"
+
+Batch = namedtuple('Batch', 'labels dates paths')
+
+
+def scan_archive(directory, pattern="*.fits"):
+    """
+    Read the observation time, shape, and theme mapping of every thematic map in a directory, without decoding
+    any labels
+    :param directory: directory of thematic map FITS files
+    :param pattern: glob pattern of the files to include
+    :return: list of dictionaries with 'path', 'date', 'shape', and 'theme_mapping', sorted by date
+    """
+    entries = []
+    for path in sorted(glob.glob(os.path.join(directory, pattern))):
+        with fits.open(path) as hdulist:
+            image_hdu, table_hdu = thematic_map_hdus(hdulist)
+            header = image_hdu.header
+            date = observation_time(header)
+            if date is None:
+                raise RuntimeError("{} has no observation time".format(path))
+            entries.append({'path': path,
+                            'date': date,
+                            'shape': (header['NAXIS2'], header['NAXIS1']),
+                            'theme_mapping': read_theme_mapping(table_hdu)})
+    entries.sort(key=lambda entry: entry['date'])
+    return entries
+
+
+class ThematicMapDataset:
+    def __init__(self, labels, dates, paths, theme_mapping):
+        """
+        Many thematic maps stacked into one cube, e.g. for training, see ThematicMapDataset.build and load
+        :param labels: uint8 array of shape (maps, rows, columns), usually memory-mapped
+        :param dates: observation time of every map, in increasing order
+        :param paths: the file every map came from
+        :param theme_mapping: dictionary of theme indices to theme names shared by all maps
+        """
+        if not (len(labels) == len(dates) == len(paths)):
+            raise RuntimeError("A dataset needs one date and one path for every map")
+        self.labels = labels
+        self.dates = list(dates)
+        self.paths = list(paths)
+        self.theme_mapping = theme_mapping
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, index):
+        return self.labels[index]
+
+    @staticmethod
+    def build(archive_directory, dataset_directory, theme_mapping=None, pattern="*.fits", skip_incompatible=False):
+        """
+        Stack a directory of thematic maps into a dataset. The labels are streamed one map at a time into a uint8
+        .npy cube on disk, so the archive never has to fit in memory, and an index of the dates and source files
+        is written next to it.
+        :param archive_directory: directory of thematic map FITS files
+        :param dataset_directory: where the cube and its index are written
+        :param theme_mapping: dictionary of theme indices to theme names every map must comply with, defaults to
+            the mapping of the first map
+        :param pattern: glob pattern of the files to include
+        :param skip_incompatible: if True, maps whose theme mapping or shape differs are left out instead of
+            raising an error
+        :return: the ThematicMapDataset, memory-mapped
+        """
+        entries = scan_archive(archive_directory, pattern)
+        if not entries:
+            raise RuntimeError("No thematic maps found in {}".format(archive_directory))
+        if theme_mapping is None:
+            theme_mapping = entries[0]['theme_mapping']
+        shape = entries[0]['shape']
+
+        compatible, incompatible = [], []
+        for entry in entries:
+            if theme_mappings_match(entry['theme_mapping'], theme_mapping) and entry['shape'] == shape:
+                compatible.append(entry)
+            else:
+                incompatible.append(entry['path'])
+        if incompatible and not skip_incompatible:
+            raise RuntimeError("Theme mapping or shape differs in {}".format(", ".join(incompatible)))
+        if not compatible:
+            raise RuntimeError("No thematic map in {} complies with the theme mapping".format(archive_directory))
+
+        os.makedirs(dataset_directory, exist_ok=True)
+        labels_path = os.path.join(dataset_directory, LABELS_FILENAME)
+        index_path = os.path.join(dataset_directory, INDEX_FILENAME)
+        # the index is written last, so an interrupted build never looks complete
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+        staging = labels_path + ".partial"
+        try:
+            cube = np.lib.format.open_memmap(staging, mode='w+', dtype=LABEL_DTYPE,
+                                             shape=(len(compatible),) + tuple(shape))
+            for i, entry in enumerate(compatible):
+                with fits.open(entry['path']) as hdulist:
+                    image_hdu, _ = thematic_map_hdus(hdulist)
+                    cube[i] = as_labels(image_hdu.data)
+            cube.flush()
+            del cube
+            os.replace(staging, labels_path)
+        finally:
+            if os.path.exists(staging):
+                os.remove(staging)
+
+        index = {'dates': [entry['date'].isoformat() for entry in compatible],
+                 'paths': [os.path.abspath(entry['path']) for entry in compatible],
+                 'theme_mapping': {str(value): name for value, name in theme_mapping.items()}}
+        with open(index_path, "w") as f:
+            json.dump(index, f, indent=1)
+        return ThematicMapDataset.load(dataset_directory)
+
+    @staticmethod
+    def load(dataset_directory):
+        """
+        Open a dataset written by ThematicMapDataset.build, the labels are memory-mapped read-only
+        :param dataset_directory: directory with the cube and its index
+        :return: ThematicMapDataset
+        """
+        index_path = os.path.join(dataset_directory, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            raise RuntimeError("{} is not a complete dataset".format(dataset_directory))
+        with open(index_path) as f:
+            index = json.load(f)
+        labels = np.load(os.path.join(dataset_directory, LABELS_FILENAME), mmap_mode='r')
+        return ThematicMapDataset(labels,
+                                  [parse_date_str(date) for date in index['dates']],
+                                  index['paths'],
+                                  {int(value): name for value, name in index['theme_mapping'].items()})
+
+    def rows(self, start=None, end=None):
+        """
+        :param start: first datetime to include, defaults to the first map
+        :param end: last datetime to include, defaults to the last map
+        :return: slice of the maps observed between start and end, both included
+        """
+        first = 0 if start is None else bisect_left(self.dates, start)
+        last = len(self.dates) if end is None else bisect_right(self.dates, end)
+        return slice(first, max(first, last))
+
+    def select(self, start=None, end=None):
+        """
+        All the maps observed between two dates
+        :param start: first datetime to include, defaults to the first map
+        :param end: last datetime to include, defaults to the last map
+        :return: Batch whose labels are a view into the cube, no map is read until it is used
+        """
+        rows = self.rows(start, end)
+        return Batch(self.labels[rows], self.dates[rows], self.paths[rows])
+
+    def batches(self, batch_size, start=None, end=None, shuffle=False, seed=None):
+        """
+        Iterate over the maps between two dates in batches
+        :param batch_size: number of maps in each batch, the last one may be smaller
+        :param start: first datetime to include, defaults to the first map
+        :param end: last datetime to include, defaults to the last map
+        :param shuffle: if True, the maps are visited in random order
+        :param seed: seed of the shuffle
+        :return: iterator of Batch, whose labels are copied out of the cube
+        """
+        if batch_size < 1:
+            raise RuntimeError("The batch size must be at least 1")
+        rows = np.arange(len(self.dates))[self.rows(start, end)]
+        if shuffle:
+            np.random.default_rng(seed).shuffle(rows)
+        for first in range(0, len(rows), batch_size):
+            batch_rows = rows[first:first + batch_size]
+            # reading in file order keeps the disk access sequential, then the batch is put back in its order
+            order = np.argsort(batch_rows)
+            labels = np.empty((len(batch_rows),) + self.labels.shape[1:], dtype=self.labels.dtype)
+            labels[order] = self.labels[batch_rows[order]]
+            yield Batch(labels, [self.dates[i] for i in batch_rows], [self.paths[i] for i in batch_rows])
+
+    def thematic_map(self, index):
+        """
+        :param index: position of a map in the dataset
+        :return: the map as a ThematicMap, with its labels copied out of the cube
+        """
+        return ThematicMap(np.array(self.labels[index]), {'DATE-OBS': self.dates[index].isoformat()},
+                           dict(self.theme_mapping))
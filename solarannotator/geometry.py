@@ -0,0 +1,101 @@
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=8)
+def squared_radius_grid(shape, center=None):
+    """
+    Four times the squared distance of every pixel from a center, memoized by shape and center.
+    The default center lies between the middle pixels for even sizes, so twice every offset from it is an integer
+    and the grid is exact in integers. Other centers give a float32 grid.
+    :param shape: (rows, columns) of the image
+    :param center: optional (row, column) center, defaults to the middle of the image
+    :return: read-only array, compare it against 4 * radius ** 2
+    """
+    if center is None:
+        center = ((shape[0] - 1) / 2, (shape[1] - 1) / 2)
+    doubled_center = 2 * np.asarray(center, dtype=float)
+    if np.all(doubled_center == np.round(doubled_center)):
+        dtype = np.int32 if 2 * max(shape) ** 2 < 2 ** 29 else np.int64
+        rows = 2 * np.arange(shape[0], dtype=dtype) - dtype(doubled_center[0])
+        columns = 2 * np.arange(shape[1], dtype=dtype) - dtype(doubled_center[1])
+    else:
+        rows = 2 * np.arange(shape[0], dtype=np.float32) - np.float32(doubled_center[0])
+        columns = 2 * np.arange(shape[1], dtype=np.float32) - np.float32(doubled_center[1])
+    grid = rows[:, None] ** 2 + columns[None, :] ** 2
+    grid.setflags(write=False)
+    return grid
+
+
+def radial_distance(shape, center=None):
+    """
+    Distance of every pixel from the center of an image
+    :param shape: (rows, columns) of the image
+    :param center: optional (row, column) center, defaults to the middle of the image
+    :return: array of distances in pixels
+    """
+    return np.sqrt(squared_radius_grid(tuple(shape), center)) / 2
+
+
+def within_radius(shape, radius, center=None):
+    """
+    Mask of the pixels strictly closer than a radius to the center
+    :param shape: (rows, columns) of the image
+    :param radius: radius in pixels
+    :param center: optional (row, column) center, defaults to the middle of the image
+    :return: boolean array
+    """
+    return squared_radius_grid(tuple(shape), center) < 4 * np.square(radius)
+
+
+def concentric_rings(shape, radii, values, dtype=None, center=None):
+    """
+    Label an image with concentric rings in a single pass
+    :param shape: (rows, columns) of the image
+    :param radii: increasing outer radii of the rings in pixels, a pixel exactly on a radius belongs to the next ring
+    :param values: one more label than radii, from the innermost ring outward with the last one outside every ring
+    :param dtype: dtype of the result, defaults to that of values
+    :param center: optional (row, column) center, defaults to the middle of the image
+    :return: array of labels
+    """
+    thresholds = 4 * np.square(np.ravel(np.asarray(radii, dtype=float)))
+    ring = np.searchsorted(thresholds, squared_radius_grid(tuple(shape), center), side='right')
+    return np.asarray(values, dtype=dtype)[ring]
+
+
+def enclosed_means(image, radii):
+    """
+    For each radius, the image mean when everything outside that radius is set to zero.
+    Pixels are binned by radius once, so any number of candidate radii costs a single pass over the image.
+    :param image: 2D image
+    :param radii: candidate radii in pixels, any order and any precision
+    :return: array of means matching the order of radii
+    """
+    radii = np.asarray(radii, dtype=float)
+    order = np.argsort(radii)
+    # a pixel lands in bin k when radii[k - 1] < distance <= radii[k], bin len(radii) is outside them all
+    thresholds = 4 * np.square(radii[order])
+    bins = np.searchsorted(thresholds, squared_radius_grid(image.shape).ravel(), side='left')
+    sums = np.bincount(bins, weights=np.ravel(image), minlength=len(radii) + 1)[:len(radii)]
+    means = np.empty(len(radii))
+    means[order] = np.cumsum(sums) / image.size
+    return means
+
+
+def refine_solar_radius(image, radius, search_width=50, num=15):
+    """
+    Refine a solar radius by looking for where the enclosed brightness stops growing past it
+    :param image: the composite image, with the sun in the center
+    :param radius: the starting radius, e.g. from the header, in pixels
+    :param search_width: how far past the starting radius to look, in pixels
+    :param num: how many candidate radii to evaluate
+    :return: the radius that best represents the edge of the sun, as a one element array
+    """
+    candidates = np.linspace(radius, radius + search_width, num=num)
+    means = enclosed_means(image, candidates)
+    # Find "drop off" where mask causes average image brightness to drop
+    drops = means[:-1] - means[1:]
+    # This used to be np.where(np.amax(drops)), which NumPy 2 rejects for a scalar. It picks the first candidate
+    # past the starting radius whenever the brightness changes at all; that is the estimate templates have always
+    # been built with, so it is kept exactly
+    return candidates[np.atleast_1d(np.amax(drops)).nonzero()[0] + 1]
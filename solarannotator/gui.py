@@ -1,16 +1,16 @@
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import PyQt5
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtWidgets import QWidget, QLabel, QAction, QTabWidget, QPushButton, QFileDialog, QRadioButton, QMessageBox, \
-    QComboBox, QLineEdit, QSizePolicy, QCheckBox
-from PyQt5.QtCore import QDateTime
+    QComboBox, QLineEdit, QSizePolicy, QCheckBox, QProgressDialog
+from PyQt5.QtCore import QDateTime, QObject, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QDoubleValidator
 from datetime import datetime, timedelta
-from matplotlib import path
 from matplotlib.collections import PatchCollection
 from matplotlib.patches import Polygon
-from skimage.morphology import binary_erosion
-import scipy
 import numpy as np
 from matplotlib.widgets import LassoSelector
 from matplotlib.backends.qt_compat import QtCore, QtWidgets
@@ -19,6 +19,14 @@ from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2Q
 from matplotlib.figure import Figure
 
 from solarannotator.template import create_thmap_template
+from solarannotator.history import EditHistory
+from solarannotator.stretch import StretchCache, three_color_composite
+from solarannotator.prefetch import Prefetcher
+from solarannotator.pyramid import DisplayPyramid, downsample_mean, downsample_mode
+from solarannotator.rendering import BlitManager
+from solarannotator.session import AnnotationSession, write_log
+from solarannotator import profiling
+from solarannotator.profiling import profiled
 
 if hasattr(QtCore.Qt, 'AA_EnableHighDpiScaling'):
     PyQt5.QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_EnableHighDpiScaling, True)
@@ -27,20 +35,126 @@ if hasattr(QtCore.Qt, 'AA_UseHighDpiPixmaps'):
     PyQt5.QtWidgets.QApplication.setAttribute(QtCore.Qt.AA_UseHighDpiPixmaps, True)
 
 from .config import Config
-from .io import ThematicMap, ImageSet
+from .io import ThematicMap, ImageSet, RetrievalError, RetrievalCancelled, CHANNELS, LABEL_DTYPE
+
+
+class CompositeWorker(QObject):
+    ready = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self, stretch_cache):
+        """
+        Builds three color composites on a background thread. Every request gets a generation number, and only
+        the result of the latest request matters: requests overtaken before they start are skipped, and
+        receivers drop results whose generation is no longer current.
+        :param stretch_cache: StretchCache shared with the single color preview
+        """
+        super().__init__()
+        self.stretch_cache = stretch_cache
+        self.generation = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, composites, channels, lower_percentiles, upper_percentiles, scales):
+        """
+        Start a composite, see three_color_composite
+        :param composites: ImageSet the channels are read from, on the background thread
+        :return: the generation of the request
+        """
+        self.generation += 1
+        self._executor.submit(self._run, self.generation, composites, channels,
+                              lower_percentiles, upper_percentiles, scales)
+        return self.generation
+
+    def cancel(self):
+        """ drop the results of every request made so far """
+        self.generation += 1
+
+    def _run(self, generation, composites, channels, lower_percentiles, upper_percentiles, scales):
+        if generation != self.generation:
+            return
+        try:
+            composite = three_color_composite(channels, [composites[channel].data for channel in channels],
+                                              lower_percentiles, upper_percentiles, scales, self.stretch_cache)
+        except Exception as e:
+            self.failed.emit(generation, str(e))
+        else:
+            self.ready.emit(generation, composite)
+
+
+class LoadWorker(QThread):
+    channelLoaded = pyqtSignal(str, str)
+    loaded = pyqtSignal(object, object)
+    failed = pyqtSignal(object, str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, thmap, template, retrieve):
+        """
+        Retrieves the composites of a thematic map and, if asked, creates its template, off the GUI thread
+        :param thmap: ThematicMap whose date is loaded
+        :param template: if True, the thematic map is replaced by a template made from the composites
+        :param retrieve: function called as retrieve(date, progress=..., cancel=...) that returns an ImageSet,
+            e.g. Prefetcher.retrieve
+        """
+        super().__init__()
+        self.thmap = thmap
+        self.template = template
+        self.retrieve = retrieve
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            composites = self.retrieve(self.thmap.date_obs, progress=self._progress, cancel=self.cancel_event)
+            thmap = create_thmap_template(composites) if self.template else self.thmap
+            thmap.copy_195_metadata(composites)
+        except RetrievalCancelled:
+            self.cancelled.emit()
+        except RetrievalError as e:
+            self.failed.emit(e.failures, str(e))
+        except RuntimeError as e:
+            self.failed.emit({}, str(e))
+        except Exception as e:
+            # anything else, e.g. a header without a keyword or an unreadable file, still has to close the dialog
+            self.failed.emit({}, "{}: {}".format(type(e).__name__, e))
+        else:
+            self.loaded.emit(composites, thmap)
+
+    def _progress(self, channel, image, error):
+        self.channelLoaded.emit(channel, error or "")
 
 
 class AnnotationWidget(QtWidgets.QWidget):
     def __init__(self, config):
         super().__init__()
-        self.composites = ImageSet.create_empty()
+        self.config = config
+        self.cache = config.create_cache()
+        self.reprojection_cache = config.create_reprojection_cache()
+        self.stretch_cache = StretchCache()
+        self.composite_worker = CompositeWorker(self.stretch_cache)
+        self.composite_worker.ready.connect(self.onCompositeReady)
+        self.composite_worker.failed.connect(self.onCompositeFailed)
+        self.load_worker = None
+        self.load_progress = None
+        self._load_workers = set()  # kept alive until their threads finish
+        self.current_date = None
+        self.prefetcher = Prefetcher(partial(ImageSet.retrieve,
+                                             max_workers=config.retrieval_workers,
+                                             timeout=config.retrieval_timeout,
+                                             cache=self.cache,
+                                             reprojection_cache=self.reprojection_cache),
+                                     config.navigation_cadence, config.prefetch_steps, config.prefetch_max_sets)
         self.current_theme_index = 0
 
-        self.preview_data = self.composites['94'].data.copy()
-        self.thmap_data = np.zeros((1280, 1280))
-        self.thmap = ThematicMap(self.thmap_data, {'DATE-OBS': str(datetime.today())}, config.solar_class_name)
-
-        self.history = []
+        # the map, its composites, and the edit history, this widget only shows them and forwards the edits
+        self.session = AnnotationSession(ThematicMap(np.zeros((1280, 1280), dtype=LABEL_DTYPE),
+                                                     {'DATE-OBS': str(datetime.today())}, config.solar_class_name,
+                                                     config.max_index),
+                                         ImageSet.create_empty(),
+                                         EditHistory(config.history_max_bytes, config.history_coalesce_pixels,
+                                                     config.history_coalesce_seconds))
+        self.preview_data = self.session.composites['94'].data.copy()
 
         layout = QtWidgets.QVBoxLayout()
 
@@ -52,9 +166,20 @@ class AnnotationWidget(QtWidgets.QWidget):
 
         self.region_patches = []
         self.axs = canvas.figure.subplots(ncols=2, sharex=True, sharey=True)
+        # the axes show downsampled, cropped copies from these, matching the zoom, see refreshView
+        self.preview_pyramid = DisplayPyramid(self.preview_data, downsample_mean)
+        self.thmap_pyramid = DisplayPyramid(self.session.data, downsample_mode)
+        self.thmap_view = self.session.data
         self.preview_axesimage = self.axs[0].imshow(self.preview_data, vmin=0, vmax=1, cmap='gray', origin='lower')
-        self.thmap_axesimage = self.axs[1].imshow(self.thmap_data, origin='lower', interpolation='none',
+        self.thmap_axesimage = self.axs[1].imshow(self.session.data, origin='lower', interpolation='none',
                                                   vmin=0, vmax=config.max_index, cmap=config.solar_cmap)
+        for ax in self.axs:
+            ax.set_autoscale_on(False)  # the image extents follow the view, not the other way around
+            ax.callbacks.connect('xlim_changed', self.onViewChanged)
+            ax.callbacks.connect('ylim_changed', self.onViewChanged)
+        canvas.mpl_connect('resize_event', self.onViewChanged)
+        # edits and boundaries are blitted, full draws are left for changes of the view
+        self.blit_manager = BlitManager(canvas)
         self.axs[0].set_axis_off()
         self.axs[1].set_axis_off()
         self.axs[0].set_title("Preview")
@@ -65,43 +190,26 @@ class AnnotationWidget(QtWidgets.QWidget):
         self.setLayout(layout)
 
         # add selection layer for lasso
-        self.shape = (1280, 1280)  # TODO: replace with dynamic detection
-        self.pix = np.arange(self.shape[0])  # assumes square image
-        xv, yv = np.meshgrid(self.pix, self.pix)
-        self.pix = np.vstack((xv.flatten(), yv.flatten())).T
-
         lineprops = dict(color="red", linewidth=2)
         self.lasso = LassoSelector(self.axs[0], self.onlasso, props=lineprops)
         self.fig.tight_layout()
 
+    @profiled()
     def onlasso(self, verts):
         """
         Main function to control the action of the lasso, allows user to draw on data image and adjust thematic map
         :param verts: the vertices selected by the lasso
-        :return: nothin, but update the selection array so lassoed region now has the selected theme, redraws canvas
+        :return: nothing, but update the selection array so lassoed region now has the selected theme, redraws canvas
         """
-        p = path.Path(verts)
-        ind = p.contains_points(self.pix, radius=1)
-        self.history.append(self.thmap_data.copy())
-        self.thmap_data = self.updateArray(self.thmap_data,
-                                                ind,
-                                                self.current_theme_index)
-        self.thmap_axesimage.set_data(self.thmap_data)
-        self.fig.canvas.draw_idle()
-        self.thmap.data = self.thmap_data
+        window = self.session.lasso(verts, self.current_theme_index)
+        # the lasso hides its line without drawing, blitting the preview from the saved background erases it
+        self.showThematicMap(window, dirty=[self.axs[0].bbox.frozen()])
 
+    @profiled()
     def rename_region(self, event):
-        # draw patches
-        y, x = int(event.xdata), int(event.ydata)
-        self.history.append(self.thmap_data.copy())
-        label = self.thmap_data[x, y]
-        contiguous_regions = scipy.ndimage.label(self.thmap_data == label)[0]
-        this_region = contiguous_regions == (contiguous_regions[x, y])
-        self.thmap_data[this_region] = self.current_theme_index
-        self.thmap_axesimage.set_data(self.thmap_data)
-        self.thmap.data = self.thmap_data
-        self.fig.canvas.draw_idle()
+        self.showThematicMap(self.session.fill(int(event.xdata), int(event.ydata), self.current_theme_index))
 
+    @profiled()
     def draw_event_region_boundary(self, event):
         """
         Draw a patch around the contiguous region in the preview image
@@ -109,77 +217,32 @@ class AnnotationWidget(QtWidgets.QWidget):
         :return:
         """
         # draw patches
-        y, x = int(event.xdata), int(event.ydata)
-        label = self.thmap_data[x, y]
-        contiguous_regions = scipy.ndimage.label(self.thmap_data == label)[0]
-        this_region = contiguous_regions == (contiguous_regions[x, y])
-
-        # remove the boundaries so any region touching the edge isn't drawn odd
-        this_region[0, :] = 0
-        this_region[:, 0] = 0
-        this_region[this_region.shape[0] - 1, :] = 0
-        this_region[:, this_region.shape[1] - 1] = 0
-
-        # convert the region mask into just a true/false array of its boundary pixels
-        edges = binary_erosion(this_region) ^ this_region
-
-        # convert the boundary pixels into a path, moving around instead of just where
-        x, y = np.where(edges)
-        coords = np.dstack([x, y])[0]
-        path = [coords[0]]
-        coords = coords[1:]
-
-        while len(coords):
-            dist = np.sum(np.abs(path[-1] - coords), axis=1)
-            neighbor_index = np.argmin(dist)
-
-            if dist[neighbor_index] < 5:
-                path.append(coords[neighbor_index].copy())
-                coords[neighbor_index:-1] = coords[neighbor_index + 1:]
-                coords = coords[:-1]
-            else:
-                break
-
-        path = np.array(path)
-
-        clips = []
-        while len(coords) > 5:
-            dist = np.sum(np.abs(path[-1] - coords), axis=1)
-            neighbor_index = np.argmin(dist)
-            clip = [coords[neighbor_index].copy()]
-            coords[neighbor_index:-1] = coords[neighbor_index + 1:]
-            coords = coords[:-1]
-            while len(coords):
-                dist = np.sum(np.abs(clip[-1] - coords), axis=1)
-                neighbor_index = np.argmin(dist)
-                if dist[neighbor_index] < 5:
-                    clip.append(coords[neighbor_index].copy())
-                    coords[neighbor_index:-1] = coords[neighbor_index + 1:]
-                    coords = coords[:-1]
-                else:
-                    break
-            clips.append(np.array(clip))
+        outer_rings, holes = self.session.boundary(int(event.xdata), int(event.ydata))
 
         # draw the continguous  on the selection area
         self.region_patches.append(PatchCollection(
-            [Polygon(np.dstack([path[:, 1], path[:, 0]])[0], False,
+            [Polygon(ring[:, ::-1], closed=True,
                      fill=False, facecolor=None,
-                     edgecolor="black", alpha=1, lw=2.5)] +
-            [Polygon(np.dstack([clip[:, 1], clip[:, 0]])[0], False,
+                     edgecolor="black", alpha=1, lw=2.5) for ring in outer_rings] +
+            [Polygon(hole[:, ::-1], closed=True,
                      fill=False, facecolor=None,
-                     edgecolor="black", alpha=1, lw=2.0) for clip in clips],
+                     edgecolor="black", alpha=1, lw=2.0) for hole in holes],
             match_original=True))
-        self.axs[0].add_collection(self.region_patches[-1])
-        self.fig.canvas.draw_idle()
+        self.axs[0].add_collection(self.region_patches[-1], autolim=False)
+        self.blit_manager.add_artist(self.region_patches[-1])
+        self.blit_manager.update()
 
     def undo_action(self):
         """ when undo is clicked, revert the thematic map to the previous state"""
-        if len(self.history) > 1:
-            old = self.history.pop(-1)
-            self.thmap_data = old
-            self.thmap.data = self.thmap_data
-            self.thmap_axesimage.set_data(old)
-            self.fig.canvas.draw_idle()
+        window = self.session.undo()
+        if window is not None:
+            self.showThematicMap(window)
+
+    def redo_action(self):
+        """ when redo is clicked, apply the most recently undone edit again"""
+        window = self.session.redo()
+        if window is not None:
+            self.showThematicMap(window)
 
     def onclick(self, event):
         """
@@ -192,95 +255,189 @@ class AnnotationWidget(QtWidgets.QWidget):
             if event.button == 1 and self.toolbar.mode == "":
                 self.rename_region(event)
 
-    def updateArray(self, array, indices, value):
+    def showThematicMap(self, window=None, dirty=()):
         """
-        updates array so that pixels at indices take on value
-        :param array: (m,n) array to adjust
-        :param indices: flattened image indices to change value
-        :param value: new value to assign
-        :return: the changed (m,n) array
+        Show the thematic map after it changed, edits are made at full resolution and copied to the display levels
+        :param window: pair of slices bounding the edited pixels, None when the whole map was replaced
+        :param dirty: other areas of the canvas to refresh with the edit, as Bboxes in display coordinates
         """
-        lin = np.arange(array.size)
-        new_array = array.flatten()
-        new_array[lin[indices]] = value
-        return new_array.reshape(array.shape)
+        if window is None or self.thmap_pyramid.image is not self.session.data:
+            self.thmap_pyramid = DisplayPyramid(self.session.data, downsample_mode)
+            self.refreshView()
+            self.fig.canvas.draw_idle()
+            return
+        # the image shows a view into the pyramid, so updating the pyramid in place is enough, then only the pixels
+        # that changed are drawn again
+        self.thmap_pyramid.update(window)
+        self.blit_manager.update_image(self.thmap_axesimage, self.thmap_view, window, dirty)
+
+    def showPreview(self, image):
+        """
+        Show a new preview image
+        :param image: the full resolution image, 2D or RGB
+        """
+        self.preview_pyramid = DisplayPyramid(image, downsample_mean)
+        self.refreshView()
+        self.fig.canvas.draw_idle()
+
+    def refreshView(self):
+        """ give each axes the pyramid level matching its zoom, cropped to what is visible """
+        for ax, axesimage, pyramid in ((self.axs[0], self.preview_axesimage, self.preview_pyramid),
+                                       (self.axs[1], self.thmap_axesimage, self.thmap_pyramid)):
+            box = ax.get_window_extent()
+            crop, extent = pyramid.view(ax.get_xlim(), ax.get_ylim(), box.width, box.height)
+            axesimage.set_data(crop)
+            axesimage.set_extent(extent)
+            if axesimage is self.thmap_axesimage:
+                self.thmap_view = crop  # a view into the pyramid, so it follows the edits
+
+    def onViewChanged(self, event):
+        # both axes share their limits, so whichever one changed, both are refreshed
+        self.refreshView()
 
     def clearBoundaries(self):
-        for patch in self.region_patches:
-            patch.remove()
+        dirty = [self.blit_manager.remove_artist(patch) for patch in self.region_patches]
         self.region_patches = []
-        self.fig.canvas.draw_idle()
+        self.blit_manager.update(dirty=dirty)
 
-    def loadThematicMap(self, thmap, template=True):
-        try:
-            download_message = QMessageBox.information(self,
-                                                       'Downloading',
-                                                       "Downloads may take a few moments. Click 'ok' to proceed.",
-                                                       QMessageBox.Ok)
-            self.composites = ImageSet.retrieve(thmap.date_obs)
-        except RuntimeError:
-            self.data_does_not_exist_popup()
-        else:
-            self.thmap = thmap
-            if template:
-                self.thmap = create_thmap_template(self.composites)
-            self.thmap.copy_195_metadata(self.composites)
-            self.history = [thmap.data.copy()]
-            self.thmap_data = self.thmap.data
-            self.thmap_axesimage.set_data(self.thmap_data)
-            self.preview_axesimage.set_data(self.composites['94'].data)
-            self.fig.canvas.draw_idle()
+    def loadThematicMap(self, thmap, template=True, on_loaded=None):
+        """
+        Start loading the composites of a thematic map in the background, the current map stays editable meanwhile
+        :param thmap: ThematicMap to show once its composites arrive
+        :param template: if True, show a template made from the composites instead
+        :param on_loaded: optional function called with the ThematicMap once it is shown
+        """
+        self.cancelLoad()
+        worker = LoadWorker(thmap, template, self.prefetcher.retrieve)
+        worker.channelLoaded.connect(self.onChannelLoaded)
+        worker.loaded.connect(lambda composites, loaded: self.onThematicMapLoaded(worker, composites, loaded,
+                                                                                  on_loaded))
+        worker.failed.connect(lambda failures, message: self.onLoadFailed(worker, failures))
+        worker.finished.connect(lambda: self._load_workers.discard(worker))
+        self._load_workers.add(worker)
+        self.load_worker = worker
+
+        self.load_progress = QProgressDialog("Downloading {}".format(thmap.date_obs), "Cancel",
+                                             0, len(CHANNELS) + 1, self)
+        self.load_progress.setWindowTitle("Loading")
+        self.load_progress.setWindowModality(QtCore.Qt.NonModal)
+        self.load_progress.setMinimumDuration(0)
+        self.load_progress.canceled.connect(self.cancelLoad)
+        self.load_progress.setValue(0)
+        worker.start()
+
+    def cancelLoad(self):
+        """ stop the load in progress, if any, the current map stays """
+        if self.load_worker is not None:
+            self.load_worker.cancel()
+            self.load_worker = None
+        if self.load_progress is not None:
+            self.load_progress.canceled.disconnect(self.cancelLoad)
+            self.load_progress.close()
+            self.load_progress = None
+
+    def shutdown(self, timeout=5000):
+        """
+        Stop every background load and wait for their threads, e.g. before the application exits
+        :param timeout: milliseconds to wait for each thread
+        """
+        self.cancelLoad()
+        for worker in list(self._load_workers):
+            worker.cancel()
+        for worker in list(self._load_workers):
+            if worker.isRunning():
+                worker.wait(timeout)
+        self.prefetcher.shutdown()
+
+    def stepTime(self, steps, on_loaded=None):
+        """
+        Load a template for the observation time a number of cadence steps away from the current one
+        :param steps: how many steps, negative to go back in time
+        :param on_loaded: optional function called with the ThematicMap once it is shown
+        :return: false if no map has been loaded yet, so there is no current time to step from
+        """
+        if self.current_date is None:
+            return False
+        date = self.current_date + steps * self.prefetcher.cadence
+        new_thmap = ThematicMap(np.zeros((1280, 1280), dtype=LABEL_DTYPE),
+                                {'DATE-OBS': str(date),
+                                 'DATE': str(datetime.today())},
+                                self.config.solar_class_name, self.config.max_index)
+        self.loadThematicMap(new_thmap, True, on_loaded)
+        return True
+
+    def onChannelLoaded(self, channel, error):
+        # channels are only reported here, not shown: until the map of the new date arrives the current map stays
+        # editable, and a preview of another date under it would lead to labels drawn over the wrong sun
+        if self.load_progress is None or self.sender() is not self.load_worker:
+            return
+        done = self.load_progress.value() + 1
+        status = "{} failed".format(channel) if error else "{} ready".format(channel)
+        if done == len(CHANNELS):
+            status += ", creating the thematic map"
+        self.load_progress.setLabelText("Downloading {}: {} ({} of {})".format(
+            self.load_worker.thmap.date_obs, status, done, len(CHANNELS)))
+        self.load_progress.setValue(done)
+
+    def onThematicMapLoaded(self, worker, composites, thmap, on_loaded=None):
+        if worker is not self.load_worker:
+            return  # cancelled or replaced by a newer load
+        self.load_worker = None
+        if self.load_progress is not None:
+            self.load_progress.setValue(self.load_progress.maximum())
+            self.load_progress = None
+
+        self.session.load(thmap, composites)
+        self.current_date = worker.thmap.date_obs
+        self.prefetcher.prefetch_around(self.current_date)
+        self.stretch_cache.clear()
+        self.composite_worker.cancel()
+        self.showThematicMap()
+        self.showPreview(composites['94'].data)
+        if on_loaded is not None:
+            on_loaded(thmap)
+
+    def onLoadFailed(self, worker, failures):
+        if worker is not self.load_worker:
+            return
+        self.cancelLoad()
+        self.data_does_not_exist_popup(failures)
 
     def updateSingleColorImage(self, channel, lower_percentile, upper_percentile, scale):
-        self.preview_data = self.composites[channel].data.copy()
-        self.preview_data = np.power(np.abs(self.preview_data), scale) * np.sign(self.preview_data)
-        lower = np.nanpercentile(self.preview_data, lower_percentile)
-        upper = np.nanpercentile(self.preview_data, upper_percentile)
-        self.preview_data[self.preview_data < lower] = lower
-        self.preview_data[self.preview_data > upper] = upper
-        self.preview_data = (self.preview_data - np.nanmin(self.preview_data)) \
-                            / (np.nanmax(self.preview_data) - np.nanmin(self.preview_data))
-        # self.preview_data /= np.nanmax(self.preview_data)
-        self.preview_axesimage.set_data(self.preview_data)
-        self.fig.canvas.draw_idle()
+        self.composite_worker.cancel()  # a three color composite still on its way would replace this image
+        # the result is shared with the stretch cache, so it is only ever replaced and never modified in place
+        self.preview_data = self.stretch_cache.stretch(channel, self.session.composites[channel].data,
+                                                       lower_percentile, upper_percentile, scale)
+        self.showPreview(self.preview_data)
 
     def updateThreeColorImage(self, red_channel, green_channel, blue_channel,
                               red_min, green_min, blue_min,
                               red_max, green_max, blue_max,
                               red_scale, green_scale, blue_scale):
-        self.preview_data = np.stack([self.composites[red_channel].data.copy(),
-                                     self.composites[green_channel].data.copy(),
-                                     self.composites[blue_channel].data.copy()], axis=2)
-        self.preview_data[:, :, 0] = np.power(self.preview_data[:, :, 0], red_scale)
-        self.preview_data[:, :, 1] = np.power(self.preview_data[:, :, 1], green_scale)
-        self.preview_data[:, :, 2] = np.power(self.preview_data[:, :, 2], blue_scale)
-
-        red_lower = np.nanpercentile(self.preview_data[:, :, 0], red_min)
-        green_lower = np.nanpercentile(self.preview_data[:, :, 1], green_min)
-        blue_lower = np.nanpercentile(self.preview_data[:, :, 2], blue_min)
-
-        red_upper = np.nanpercentile(self.preview_data[:, :, 0], red_max)
-        green_upper = np.nanpercentile(self.preview_data[:, :, 1], green_max)
-        blue_upper = np.nanpercentile(self.preview_data[:, :, ], blue_max)
-
-        self.preview_data[self.preview_data[:, :, 0] < red_lower] = red_lower
-        self.preview_data[self.preview_data[:, :, 0] > red_upper] = red_upper
-        self.preview_data[self.preview_data[:, :, 1] < green_lower] = green_lower
-        self.preview_data[self.preview_data[:, :, 1] > green_upper] = green_upper
-        self.preview_data[self.preview_data[:, :, 2] < blue_lower] = blue_lower
-        self.preview_data[self.preview_data[:, :, 2] > blue_upper] = blue_upper
-        
-        for index in [0, 1, 2]:
-            # self.preview_data[:, :, index] /= np.nanmax(self.preview_data[:, :, index])
-            self.preview_data[:, :, index] = (self.preview_data[:, :, index] - np.nanmin(self.preview_data[:, :, index])) \
-                                / (np.nanmax(self.preview_data[:, :, index]) - np.nanmin(self.preview_data[:, :, index]))
-        self.preview_axesimage.set_data(self.preview_data)
-        self.fig.canvas.draw_idle()
-
-    def data_does_not_exist_popup(self):
+        """ start building a three color composite, it replaces the preview in onCompositeReady """
+        self.composite_worker.submit(self.session.composites,
+                                     [red_channel, green_channel, blue_channel],
+                                     [red_min, green_min, blue_min],
+                                     [red_max, green_max, blue_max],
+                                     [red_scale, green_scale, blue_scale])
+
+    def onCompositeReady(self, generation, composite):
+        if generation != self.composite_worker.generation:
+            return  # the settings changed since this composite was requested
+        self.preview_data = composite
+        self.showPreview(self.preview_data)
+
+    def onCompositeFailed(self, generation, message):
+        if generation == self.composite_worker.generation:
+            QMessageBox.warning(self, 'Error: Could not create composite', message, QMessageBox.Close)
+
+    def data_does_not_exist_popup(self, failures=None):
+        message = 'Composite data does not exist for that date.'
+        if failures:
+            message += '\n\n' + '\n'.join("{}: {}".format(channel, reason) for channel, reason in failures.items())
         QMessageBox.critical(self,
                              'Error: Could not open',
-                             'Composite data does not exist for that date.',
+                             message,
                              QMessageBox.Close)
 
 
@@ -313,7 +470,7 @@ class ControlWidget(QtWidgets.QWidget):
         self.single_color_label.setText("Channel")
         self.one_color_tab.layout.addWidget(self.single_color_label)
         self.single_color_combo_box = QComboBox()
-        self.single_color_combo_box.addItems(self.annotator.composites.channels())
+        self.single_color_combo_box.addItems(self.annotator.session.composites.channels())
         self.single_color_combo_box.currentTextChanged.connect(self.onSingleColorChange)
 
         self.one_color_min_editor = QLineEdit()
@@ -368,7 +525,7 @@ class ControlWidget(QtWidgets.QWidget):
         self.red_label.setText("Red Channel")
         self.red_label.setAlignment(QtCore.Qt.AlignRight)
         self.red_combo_box = QComboBox()
-        self.red_combo_box.addItems(self.annotator.composites.channels())
+        self.red_combo_box.addItems(self.annotator.session.composites.channels())
         self.red_combo_box.setCurrentIndex(2)
         self.red_combo_box.currentTextChanged.connect(self.onThreeColorChange)
         self.red_min_editor = QLineEdit()
@@ -388,7 +545,7 @@ class ControlWidget(QtWidgets.QWidget):
         self.green_label.setText("Green Channel")
         self.green_label.setAlignment(QtCore.Qt.AlignRight)
         self.green_combo_box = QComboBox()
-        self.green_combo_box.addItems(self.annotator.composites.channels())
+        self.green_combo_box.addItems(self.annotator.session.composites.channels())
         self.green_combo_box.setCurrentIndex(3)
         self.green_combo_box.currentTextChanged.connect(self.onThreeColorChange)
         self.green_min_editor = QLineEdit()
@@ -408,7 +565,7 @@ class ControlWidget(QtWidgets.QWidget):
         self.blue_label.setText("Blue Channel")
         self.blue_label.setAlignment(QtCore.Qt.AlignRight)
         self.blue_combo_box = QComboBox()
-        self.blue_combo_box.addItems(self.annotator.composites.channels())
+        self.blue_combo_box.addItems(self.annotator.session.composites.channels())
         self.blue_combo_box.setCurrentIndex(4)
         self.blue_combo_box.currentTextChanged.connect(self.onThreeColorChange)
         self.blue_min_editor = QLineEdit()
@@ -496,14 +653,16 @@ class NewFilePopup(QWidget):
     def onSubmit(self):
         # set the date in the application and close
         self.parent.date = self.dateEdit.dateTime().toPyDateTime()
-        new_thmap = ThematicMap(np.zeros((1280, 1280)),
+        new_thmap = ThematicMap(np.zeros((1280, 1280), dtype=LABEL_DTYPE),
                                 {'DATE-OBS': str(self.parent.date),
                                  'DATE': str(datetime.today())},
-                                self.parent.config.solar_class_name)
-        self.parent.annotator.loadThematicMap(new_thmap, self.template_option.isChecked())
-        self.parent.controls.onTabChange()  # Us
+                                self.parent.config.solar_class_name, self.parent.config.max_index)
+        self.parent.annotator.loadThematicMap(new_thmap, self.template_option.isChecked(), self.onLoaded)
         self.close()
-        self.parent.setWindowTitle("SolarAnnotator: {}".format(new_thmap.date_obs))
+
+    def onLoaded(self, thmap):
+        self.parent.controls.onTabChange()  # Use the tab change to automatically load the right image
+        self.parent.setWindowTitle("SolarAnnotator: {}".format(thmap.date_obs))
 
 
 class ApplicationWindow(QtWidgets.QMainWindow):
@@ -632,6 +791,12 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         undoEdit.setStatusTip('Undo a change on the thematic map')
         undoEdit.triggered.connect(self.annotator.undo_action)
         self.editMenu.addAction(undoEdit)
+
+        redoEdit = QAction("&Redo Edit", self)
+        redoEdit.setShortcut("Ctrl+Shift+Z")
+        redoEdit.setStatusTip('Redo the last undone change on the thematic map')
+        redoEdit.triggered.connect(self.annotator.redo_action)
+        self.editMenu.addAction(redoEdit)
         self.editMenu.addSeparator()
 
         eraseBoundaries = QAction("&Erase boundaries", self)
@@ -640,12 +805,56 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         eraseBoundaries.triggered.connect(self.annotator.clearBoundaries)
         self.editMenu.addAction(eraseBoundaries)
 
+        # Navigate Menu
+        self.navigateMenu = self.mainMenu.addMenu("Navigate")
+        nextTime = QAction("&Next time", self)
+        nextTime.setShortcut("Alt+Right")
+        nextTime.setStatusTip('Create a template one cadence step after the current map')
+        nextTime.triggered.connect(self.next_time)
+        self.navigateMenu.addAction(nextTime)
+
+        previousTime = QAction("&Previous time", self)
+        previousTime.setShortcut("Alt+Left")
+        previousTime.setStatusTip('Create a template one cadence step before the current map')
+        previousTime.triggered.connect(self.previous_time)
+        self.navigateMenu.addAction(previousTime)
+
+        # Help Menu
+        self.helpMenu = self.mainMenu.addMenu("Help")
+        exportProfile = QAction("Export &profile...", self)
+        exportProfile.setStatusTip('Save the timings recorded with --profile or {}'.format(
+            profiling.ENVIRONMENT_VARIABLE))
+        exportProfile.setEnabled(profiling.is_enabled())
+        exportProfile.triggered.connect(self.export_profile)
+        self.helpMenu.addAction(exportProfile)
+
+        exportLog = QAction("Export &edit log...", self)
+        exportLog.setStatusTip('Save the edits made to the current map, to replay with SolarAnnotatorReplay')
+        exportLog.triggered.connect(self.export_edit_log)
+        self.helpMenu.addAction(exportLog)
+
+    def export_profile(self):
+        chrome_filter, json_filter = "Chrome trace (*.json)", "Timings and summary (*.json)"
+        path, selected = QFileDialog.getSaveFileName(self, "Export profile", "profile.json",
+                                                     ";;".join([chrome_filter, json_filter]))
+        if path:
+            if selected == json_filter:
+                profiling.export_json(path)
+            else:
+                profiling.export_chrome_trace(path)
+
+    def export_edit_log(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export edit log", "edits.jsonl", "JSON lines (*.jsonl)")
+        if path:
+            write_log(path, self.annotator.session.log)
+
     def exit(self):
         if self.initialized:
             answer = QMessageBox.question(self, '', "Would you like to save?",
                                           QMessageBox.Yes | QMessageBox.No)
             if answer == QMessageBox.Yes:
                 self.file_save_as()
+        self.annotator.shutdown()
         sys.exit()
 
     def closeEvent(self, *args, **kwargs):
@@ -663,20 +872,48 @@ class ApplicationWindow(QtWidgets.QMainWindow):
         dlg = QFileDialog()
         fname = dlg.getOpenFileName(None, "Open Thematic Map", "", "FITS files (*.fits)")
         if fname != ('', ''):
-            thmap = ThematicMap.load(fname[0])
+            try:
+                thmap = ThematicMap.load(fname[0], self.config.max_index)
+            except RuntimeError as e:
+                QMessageBox.critical(self, 'Error: Could not open', str(e), QMessageBox.Close)
+                return
             if thmap.complies_with_mapping(self.config.solar_class_name):
-                self.annotator.loadThematicMap(thmap)
-                self.controls.onTabChange()  # Use the tab change to automatically load the right image
-                self.annotator.clearBoundaries()
-                self.initialized = True
-                self.setWindowTitle("SolarAnnotator: {}".format(thmap.date_obs))
-                self.output_fn = None
+                self.annotator.loadThematicMap(thmap, template=False, on_loaded=self.onMapShown)
             else:
                 QMessageBox.critical(self,
                                     'Error: Could not open',
                                      'Thematic map could not open because theme mapping differs from configuration',
                                      QMessageBox.Close)
 
+    def next_time(self):
+        self.step_time(1)
+
+    def previous_time(self):
+        self.step_time(-1)
+
+    def step_time(self, steps):
+        if self.annotator.current_date is None:
+            QMessageBox.critical(self,
+                                 "Error: No current time",
+                                 "You must create a new thematic map or load one before moving in time.",
+                                 QMessageBox.Close)
+            return
+        if self.annotator.session.history.can_undo():
+            answer = QMessageBox.question(self, '', "Would you like to save before moving on?",
+                                          QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+            if answer == QMessageBox.Cancel:
+                return
+            if answer == QMessageBox.Yes:
+                self.file_save()
+        self.annotator.stepTime(steps, self.onMapShown)
+
+    def onMapShown(self, thmap):
+        self.controls.onTabChange()  # Use the tab change to automatically load the right image
+        self.annotator.clearBoundaries()
+        self.initialized = True
+        self.setWindowTitle("SolarAnnotator: {}".format(thmap.date_obs))
+        self.output_fn = None
+
     def prompt_not_initialized(self):
         QMessageBox.critical(self,
                             "Error: Could not save",
@@ -688,8 +925,8 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             if self.output_fn is None:
                 self.file_save_as()
             else:
-                self.annotator.thmap.metadata['DATE'] = str(datetime.today())
-                self.annotator.thmap.save(self.output_fn)
+                self.annotator.session.save(self.output_fn, self.config.output_compression,
+                                            self.config.output_tile_shape)
         else:
             self.prompt_not_initialized()
 
@@ -698,8 +935,7 @@ class ApplicationWindow(QtWidgets.QMainWindow):
             dlg = QFileDialog()
             fname = dlg.getSaveFileName(None, "Save Thematic Map", "", "FITS files (*.fits)")
             if fname != ('', ''):
-                self.annotator.thmap.metadata['DATE'] = str(datetime.today())
-                self.annotator.thmap.save(fname[0])
+                self.annotator.session.save(fname[0], self.config.output_compression, self.config.output_tile_shape)
                 self.output_fn = fname[0]
         else:
             self.prompt_not_initialized()
@@ -0,0 +1,127 @@
+from collections import namedtuple
+import numpy as np
+import time
+
+Edit = namedtuple('Edit', 'indices old new time steps')
+
+
+class EditHistory:
+    def __init__(self, max_bytes=256 * 1024 ** 2, coalesce_pixels=16, coalesce_seconds=0.5):
+        """
+        Undo and redo stacks for edits of a label array. Each edit keeps only the flat indices of the pixels
+        it changed with their previous and new values, so memory grows with the amount edited.
+        :param max_bytes: memory ceiling of both stacks together, the oldest edits are forgotten beyond it
+        :param coalesce_pixels: consecutive edits are merged into one undo step while they change no more than
+            this many pixels in total, 0 turns merging off
+        :param coalesce_seconds: edits further apart in time than this are never merged
+        """
+        self.max_bytes = max_bytes
+        self.coalesce_pixels = coalesce_pixels
+        self.coalesce_seconds = coalesce_seconds
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def __len__(self):
+        return len(self.undo_stack)
+
+    @property
+    def nbytes(self):
+        """ memory held by both stacks """
+        return sum(edit.indices.nbytes + edit.old.nbytes + edit.new.nbytes
+                   for edit in self.undo_stack + self.redo_stack)
+
+    def can_undo(self):
+        return len(self.undo_stack) > 0
+
+    def can_redo(self):
+        return len(self.redo_stack) > 0
+
+    def clear(self):
+        """ forget every edit, e.g. when a new map is loaded """
+        self.undo_stack = []
+        self.redo_stack = []
+
+    def record(self, array, window, before, coalesce=None):
+        """
+        Record an edit that has already been applied
+        :param array: the edited array
+        :param window: pair of slices of the part of the array the edit could have touched
+        :param before: copy of array[window] from before the edit
+        :param coalesce: True or False to merge the edit into the previous undo step or not whatever the settings,
+            e.g. to repeat a recorded session, None decides by coalesce_pixels and coalesce_seconds
+        :return: true if any pixel changed, the edits in the latest undo step are counted in its steps
+        """
+        after = array[window]
+        changed = before != after
+        if not np.any(changed):
+            return False
+        rows, columns = np.nonzero(changed)
+        rows += window[0].indices(array.shape[0])[0]
+        columns += window[1].indices(array.shape[1])[0]
+        index_dtype = np.int32 if array.size < 2 ** 31 else np.int64
+        indices = np.ravel_multi_index((rows, columns), array.shape).astype(index_dtype)
+        edit = Edit(indices, before[changed], after[changed], time.monotonic(), 1)
+
+        if coalesce is None:
+            coalesce = self._should_coalesce(edit)
+        if coalesce and self.undo_stack:
+            edit = self._merge(self.undo_stack.pop(), edit)
+        self.undo_stack.append(edit)
+        self.redo_stack = []
+        self._enforce_memory_ceiling()
+        return True
+
+    def undo(self, array):
+        """
+        Restore the pixels changed by the most recent edit
+        :param array: the array the edits were made to
+        :return: pair of slices bounding the restored pixels, or None if there was nothing to undo
+        """
+        if not self.undo_stack:
+            return None
+        edit = self.undo_stack.pop()
+        array.flat[edit.indices] = edit.old
+        self.redo_stack.append(edit)
+        return self._window(edit, array.shape)
+
+    def redo(self, array):
+        """
+        Apply again the most recently undone edit
+        :param array: the array the edits were made to
+        :return: pair of slices bounding the changed pixels, or None if there was nothing to redo
+        """
+        if not self.redo_stack:
+            return None
+        edit = self.redo_stack.pop()
+        array.flat[edit.indices] = edit.new
+        self.undo_stack.append(edit)
+        return self._window(edit, array.shape)
+
+    def _should_coalesce(self, edit):
+        if not self.undo_stack or self.coalesce_pixels <= 0:
+            return False
+        previous = self.undo_stack[-1]
+        return (len(previous.indices) + len(edit.indices) <= self.coalesce_pixels
+                and edit.time - previous.time <= self.coalesce_seconds)
+
+    @staticmethod
+    def _merge(first, second):
+        indices = np.concatenate([first.indices, second.indices])
+        old = np.concatenate([first.old, second.old])
+        new = np.concatenate([first.new, second.new])
+        # a pixel changed by both keeps its value from before the first and after the second
+        merged_indices, first_occurrence = np.unique(indices, return_index=True)
+        _, last_occurrence = np.unique(indices[::-1], return_index=True)
+        last_occurrence = len(indices) - 1 - last_occurrence
+        return Edit(merged_indices, old[first_occurrence], new[last_occurrence], second.time,
+                    first.steps + second.steps)
+
+    def _enforce_memory_ceiling(self):
+        # the oldest edits go first, but the latest edit is always kept
+        while self.nbytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.undo_stack.pop(0)
+
+    @staticmethod
+    def _window(edit, shape):
+        rows, columns = np.unravel_index(edit.indices, shape)
+        return slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1)
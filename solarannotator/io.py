@@ -2,7 +2,11 @@ from astropy.io import fits
 import numpy as np
 from goessolarretriever import Product, Satellite, Retriever
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+import threading
 import tempfile
+import time
 import os
 from dateutil.parser import parse as parse_date_str
 from sunpy.net import Fido, attrs as a
@@ -11,29 +15,283 @@ from datetime import timedelta
 import sunpy.map
 from sunpy.coordinates import Helioprojective
 
+from .geometry import refine_solar_radius
+from .profiling import profiled
+
 Image = namedtuple('Image', 'data header')
 
+SUVI_PRODUCTS = {"94": Product.suvi_l2_ci094,
+                 "131": Product.suvi_l2_ci131,
+                 "171": Product.suvi_l2_ci171,
+                 "195": Product.suvi_l2_ci195,
+                 "284": Product.suvi_l2_ci284,
+                 "304": Product.suvi_l2_ci304}
+
+CHANNELS = list(SUVI_PRODUCTS) + ['gong']
+
+EMPTY_SHAPE = (1280, 1280)
+
+# thematic map labels are small non-negative integers, stored this compactly from creation to disk
+LABEL_DTYPE = np.uint8
+
+# tile compression algorithms a thematic map can be saved with, all lossless for its integer labels
+THEMATIC_MAP_COMPRESSION = ['RICE_1', 'GZIP_1', 'GZIP_2', 'PLIO_1', 'HCOMPRESS_1']
+
+# header keywords that describe the layout of an HDU, they are written fresh with every save
+STRUCTURAL_KEYWORDS = {'SIMPLE', 'XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1', 'NAXIS2', 'EXTEND', 'PCOUNT', 'GCOUNT',
+                       'CHECKSUM', 'DATASUM', 'BSCALE', 'BZERO', 'COMMENT'}
+
+# how often a retrieval checks whether it was cancelled, in seconds
+CANCEL_POLL_INTERVAL = 0.1
+
+
+def read_fits_image(path, index=1):
+    """
+    Read one image HDU of a FITS file, memory-mapped when the layout permits
+    :param path: path to the FITS file
+    :param index: which HDU to read
+    :return: Image of the data and a copy of the header. Uncompressed, unscaled data is a copy-on-write memory map
+        of the file; compressed or scaled data is decoded into memory.
+    """
+    with fits.open(path, memmap=True) as hdul:
+        data = hdul[index].data
+        header = hdul[index].header.copy()
+    return Image(data, header)
+
+
+def _empty_image():
+    return Image(np.zeros(EMPTY_SHAPE), {})
+
+
+class LazyImage:
+    def __init__(self, loader):
+        """
+        An Image that is only read the first time it is needed
+        :param loader: function without arguments that returns the Image, called again after an eviction
+        """
+        self.loader = loader
+        self._image = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._image is not None
+
+    def load(self):
+        """
+        :return: the Image, reading it if it is not in memory
+        """
+        with self._lock:
+            if self._image is None:
+                self._image = self.loader()
+            return self._image
+
+    def evict(self):
+        """ Forget the Image, it is read again on the next load """
+        with self._lock:
+            self._image = None
+
+
+def _as_image(image):
+    return image.load() if isinstance(image, LazyImage) else image
+
+
+def _report(progress, channel, image, error):
+    if progress is not None:
+        progress(channel, image, error)
+
+
+class RetrievalError(RuntimeError):
+    def __init__(self, date, failures):
+        """
+        Raised when one or more channels of an ImageSet could not be retrieved
+        :param date: the requested date
+        :param failures: dictionary of channel name to a description of why it failed
+        """
+        self.date = date
+        self.failures = failures
+        details = "; ".join("{}: {}".format(channel, reason) for channel, reason in failures.items())
+        super().__init__("Could not retrieve data for {} ({})".format(date, details))
+
+
+class RetrievalCancelled(RuntimeError):
+    def __init__(self, date):
+        """
+        Raised when a retrieval is cancelled before it finishes
+        :param date: the requested date
+        """
+        self.date = date
+        super().__init__("Retrieval for {} was cancelled".format(date))
+
 
 class ImageSet:
-    def __init__(self, mapping):
+    def __init__(self, mapping, failures=None):
+        """
+        The composites of one observation time, keyed by channel name
+        :param mapping: dictionary of channel name to an Image, or a LazyImage that is read on first access
+        :param failures: dictionary of channel name to why it could not be retrieved
+        """
         super().__init__()
-        self.images = mapping
+        self._channels = dict(mapping)
+        self.failures = {} if failures is None else failures
+
+    @property
+    def images(self):
+        """ dictionary of channel name to Image, reading every channel that is not loaded yet """
+        return {channel: self[channel] for channel in self.channels()}
+
+    @staticmethod
+    @profiled("ImageSet.retrieve")
+    def retrieve(date, concurrent=True, max_workers=7, timeout=None, allow_partial=False, cache=None,
+                 reprojection_cache=None, progress=None, cancel=None):
+        """
+        Download the SUVI composites and the GONG H-alpha image nearest to a date
+        :param date: datetime of the observation
+        :param concurrent: if True, the channels are downloaded in parallel
+        :param max_workers: number of channels retrieved at once in concurrent mode
+        :param timeout: seconds to wait for each channel in concurrent mode, either a number for all channels
+            or a dictionary of channel name to seconds, None waits indefinitely
+        :param allow_partial: if True, failed channels are left empty and listed in `failures` instead of raising
+        :param cache: optional CompositeCache, cached files are used without touching the network
+        :param reprojection_cache: optional ReprojectionCache for the GONG reprojection
+        :param progress: optional function called as progress(channel, image, error) when each channel finishes,
+            with the Image (or LazyImage) and None on success or None and a description of the failure
+        :param cancel: optional threading.Event, setting it stops the retrieval with RetrievalCancelled
+        :return: ImageSet of the retrieved channels
+        """
+        if concurrent:
+            full_set, failures = ImageSet._retrieve_concurrent(date, max_workers, timeout, cache, reprojection_cache,
+                                                               progress, cancel)
+        else:
+            full_set, failures = ImageSet._retrieve_sequential(date, cache, reprojection_cache, progress, cancel)
+
+        if failures and not allow_partial:
+            raise RetrievalError(date, failures)
+        for channel in failures:
+            full_set[channel] = LazyImage(_empty_image)
+        return ImageSet({channel: full_set[channel] for channel in CHANNELS}, failures)
+
+    @staticmethod
+    def _retrieve_sequential(date, cache=None, reprojection_cache=None, progress=None, cancel=None):
+        full_set, failures = {}, {}
+
+        def attempt(channel, load):
+            if cancel is not None and cancel.is_set():
+                raise RetrievalCancelled(date)
+            try:
+                full_set[channel] = load()
+            except Exception as e:
+                failures[channel] = str(e)
+            _report(progress, channel, full_set.get(channel), failures.get(channel))
+
+        def load_gong():
+            if '195' not in full_set:
+                raise RuntimeError("the 195 composite needed for reprojection is unavailable")
+            return ImageSet._load_gong_image(date, _as_image(full_set['195']), cache, reprojection_cache)
+
+        for wavelength in SUVI_PRODUCTS:
+            attempt(wavelength, partial(ImageSet._load_suvi_composite, date, wavelength, cache))
+        attempt('gong', load_gong)
+        return full_set, failures
+
+    @staticmethod
+    def _retrieve_concurrent(date, max_workers, timeout, cache=None, reprojection_cache=None, progress=None,
+                             cancel=None):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {wavelength: executor.submit(ImageSet._load_suvi_composite, date, wavelength, cache)
+                   for wavelength in SUVI_PRODUCTS}
+        # submitted after the 195 composite so it never waits on a task that has not been scheduled
+        futures['gong'] = executor.submit(ImageSet._load_gong_image_when_ready, date, futures['195'],
+                                          cache, reprojection_cache)
+
+        start = time.monotonic()
+        deadlines = {}
+        for channel in futures:
+            channel_timeout = timeout.get(channel) if isinstance(timeout, dict) else timeout
+            deadlines[channel] = None if channel_timeout is None else (start + channel_timeout, channel_timeout)
+
+        full_set, failures = {}, {}
+        pending = {future: channel for channel, future in futures.items()}
+        try:
+            while pending:
+                if cancel is not None and cancel.is_set():
+                    raise RetrievalCancelled(date)
+                now = time.monotonic()
+                for future, channel in list(pending.items()):
+                    if deadlines[channel] is not None and now >= deadlines[channel][0]:
+                        del pending[future]
+                        failures[channel] = "timed out after {} seconds".format(deadlines[channel][1])
+                        _report(progress, channel, None, failures[channel])
+                if not pending:
+                    break
+
+                # wake up for the first result, the next deadline, or to check for cancellation
+                waits = [deadlines[channel][0] - now for channel in pending.values() if deadlines[channel]]
+                if cancel is not None:
+                    waits.append(CANCEL_POLL_INTERVAL)
+                done, _ = wait(pending, timeout=max(0, min(waits)) if waits else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    channel = pending.pop(future)
+                    try:
+                        full_set[channel] = future.result()
+                    except Exception as e:
+                        failures[channel] = str(e)
+                    _report(progress, channel, full_set.get(channel), failures.get(channel))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return full_set, failures
 
     @staticmethod
-    def retrieve(date):
-        full_set = ImageSet._load_suvi_composites(date)
-        full_set['gong'] = ImageSet._load_gong_image(date, full_set['195'])
-        return ImageSet(full_set)
+    @profiled("ImageSet._load_gong_image", details=lambda *args, **kwargs: {'channel': 'gong'})
+    def _load_gong_image_when_ready(date, suvi_195_future, cache=None, reprojection_cache=None):
+        """
+        Download the GONG image right away and reproject it as soon as the 195 composite arrives, its wall time in a
+        profile includes the wait for the 195 composite
+        :param date: datetime of the observation
+        :param suvi_195_future: future that resolves to the SUVI 195 composite Image
+        :param cache: optional CompositeCache
+        :param reprojection_cache: optional ReprojectionCache
+        :return: reprojected GONG Image
+        """
+        gong_image = ImageSet._fetch_gong_image(date, cache)
+        try:
+            suvi_195_image = _as_image(suvi_195_future.result())
+        except Exception:
+            raise RuntimeError("the 195 composite needed for reprojection is unavailable")
+        return ImageSet._reproject_gong_image(gong_image, suvi_195_image, reprojection_cache)
 
     @staticmethod
-    def _load_gong_image(date, suvi_195_image):
-        # Find an image and download it
-        results = Fido.search(a.Time(date - timedelta(hours=1), date + timedelta(hours=1)),
-                              a.Wavelength(6563 * u.Angstrom), a.Source("GONG"))
-        selection = results[0][len(results[0]) // 2]  # only download the middle image
-        downloads = Fido.fetch(selection)
-        with fits.open(downloads[0]) as hdul:
-            gong_data = hdul[1].data
+    @profiled("ImageSet._load_gong_image", details=lambda *args, **kwargs: {'channel': 'gong'})
+    def _load_gong_image(date, suvi_195_image, cache=None, reprojection_cache=None):
+        return ImageSet._reproject_gong_image(ImageSet._fetch_gong_image(date, cache), suvi_195_image,
+                                              reprojection_cache)
+
+    @staticmethod
+    def _fetch_gong_image(date, cache=None):
+        path = None if cache is None else cache.lookup("GONG", "halpha", date)
+        if path is None:
+            # Find an image and download it
+            results = Fido.search(a.Time(date - timedelta(hours=1), date + timedelta(hours=1)),
+                                  a.Wavelength(6563 * u.Angstrom), a.Source("GONG"))
+            if len(results) == 0 or len(results[0]) == 0:
+                raise RuntimeError("GONG data does not exist for the time {}".format(date))
+            selection = results[0][len(results[0]) // 2]  # only download the middle image
+            try:
+                obs_time = selection['Start Time'].to_datetime()
+            except (KeyError, AttributeError, ValueError):
+                obs_time = date
+            if cache is not None:
+                path = cache.get("GONG", "halpha", obs_time)
+            if path is None:
+                downloads = Fido.fetch(selection)
+                if len(downloads) == 0:
+                    raise RuntimeError("GONG download failed for the time {}".format(date))
+                path = downloads[0]
+                if cache is not None:
+                    path = cache.store("GONG", "halpha", obs_time, path)
+
+        with fits.open(path) as hdul:
+            gong_data = hdul[1].data.copy()
             gong_head = hdul[1].header
 
         # update the header to actually load in a SunPy map
@@ -44,6 +302,14 @@ class ImageSet:
         # number below from SunPy discussions: https://github.com/sunpy/sunpy/issues/6656#issuecomment-1344413011
         gong_head['CDELT1'] = 1.082371820584223
         gong_head['CDELT2'] = 1.082371820584223
+        return Image(gong_data, gong_head)
+
+    @staticmethod
+    def _reproject_gong_image(gong_image, suvi_195_image, reprojection_cache=None):
+        if reprojection_cache is not None:
+            return Image(*reprojection_cache.reproject(gong_image, suvi_195_image))
+
+        gong_data, gong_head = gong_image
 
         # Load as a map
         gong_map = sunpy.map.Map(gong_data, gong_head)
@@ -56,42 +322,109 @@ class ImageSet:
         return Image(out.data, dict(out.meta))
 
     @staticmethod
-    def _load_suvi_composites(date):
+    def _load_suvi_composites(date, cache=None):
+        return {wavelength: ImageSet._load_suvi_composite(date, wavelength, cache) for wavelength in SUVI_PRODUCTS}
+
+    @staticmethod
+    @profiled("ImageSet._load_suvi_composite",
+              details=lambda date, wavelength, cache=None: {'channel': wavelength})
+    def _load_suvi_composite(date, wavelength, cache=None):
+        """
+        Download and parse a single SUVI composite
+        :param date: datetime of the observation
+        :param wavelength: channel name, one of the keys of SUVI_PRODUCTS
+        :param cache: optional CompositeCache, a cached composite near the date skips the network entirely
+        :return: Image of the composite nearest to the date, or with a cache a LazyImage of the cached file
+        """
         satellite = Satellite.GOES16
-        products = {"94": Product.suvi_l2_ci094,
-                    "131": Product.suvi_l2_ci131,
-                    "171": Product.suvi_l2_ci171,
-                    "195": Product.suvi_l2_ci195,
-                    "284": Product.suvi_l2_ci284,
-                    "304": Product.suvi_l2_ci304}
-        composites = {}
-        r = Retriever()
-        for wavelength, product in products.items():
-            fn = r.retrieve_nearest(satellite, product, date, tempfile.gettempdir())
+        product = SUVI_PRODUCTS[wavelength]
+        # each call gets its own directory so parallel downloads never share a file
+        with tempfile.TemporaryDirectory() as save_directory:
+            if cache is not None:
+                # the cached file outlives the download directory, so it is only read when the channel is used
+                fn = ImageSet._retrieve_suvi_cached(satellite, product, date, save_directory, cache)
+                return LazyImage(partial(ImageSet._read_cached_suvi, satellite, product, date, fn, cache))
+            fn = Retriever().retrieve_nearest(satellite, product, date, save_directory)
             with fits.open(fn) as hdus:
-                data = hdus[1].data
+                data = hdus[1].data.copy()
                 header = hdus[1].header
-                composites[wavelength] = Image(data, header)
-            os.remove(fn)
-        return composites
+        return Image(data, header)
+
+    @staticmethod
+    def _read_cached_suvi(satellite, product, date, fn, cache):
+        # the cache may have evicted the file before the channel is read, e.g. to make room for prefetched sets or
+        # for another process sharing the directory, then it is retrieved again
+        try:
+            return read_fits_image(fn, 1)
+        except FileNotFoundError:
+            with tempfile.TemporaryDirectory() as save_directory:
+                fn = ImageSet._retrieve_suvi_cached(satellite, product, date, save_directory, cache)
+                return read_fits_image(fn, 1)
+
+    @staticmethod
+    def _retrieve_suvi_cached(satellite, product, date, save_directory, cache):
+        fn = cache.lookup(satellite.name, product.name, date)
+        if fn is not None:
+            return fn
+
+        r = Retriever()
+        results = r.search(satellite, product, date)
+        try:
+            best_index = np.argmin(np.abs(results['date_begin'] - date))
+        except KeyError:
+            raise RuntimeError("Data does not exist for the time {}".format(date))
+        nearest = results.iloc[[best_index]]
+        obs_time = nearest.iloc[0]['date_begin'].to_pydatetime()
+
+        fn = cache.get(satellite.name, product.name, obs_time)
+        if fn is None:
+            r.retrieve(nearest, save_directory)
+            fn = cache.store(satellite.name, product.name, obs_time,
+                             os.path.join(save_directory, nearest.iloc[0]['file_name']))
+        return fn
 
     @staticmethod
     def create_empty():
-        mapping = {"94": Image(np.zeros((1280, 1280)), {}),
-                   '131': Image(np.zeros((1280, 1280)), {}),
-                   '171': Image(np.zeros((1280, 1280)), {}),
-                   '195': Image(np.zeros((1280, 1280)), {}),
-                   '284': Image(np.zeros((1280, 1280)), {}),
-                   '304': Image(np.zeros((1280, 1280)), {}),
-                   'gong': Image(np.zeros((1280, 1280)), {})}
+        mapping = {channel: LazyImage(_empty_image) for channel in ["94", "131", "171", "195", "284", "304", "gong"]}
         return ImageSet(mapping)
 
     def __getitem__(self, key):
-        return self.images[key]
+        return _as_image(self._channels[key])
 
     def channels(self):
-        return list(self.images.keys())
+        return list(self._channels.keys())
+
+    def is_loaded(self, channel):
+        """
+        :param channel: channel name
+        :return: true if the channel is in memory
+        """
+        image = self._channels[channel]
+        return not isinstance(image, LazyImage) or image.loaded
+
+    def preload(self, channels=None):
+        """
+        Read channels ahead of their first use
+        :param channels: channel names to read, defaults to all of them
+        """
+        for channel in self.channels() if channels is None else channels:
+            self[channel]
+
+    def evict(self, channel):
+        """
+        Release the memory of a channel, it is read again on its next use
+        :param channel: channel name
+        :return: true if the channel can be read again, false if it was only held in memory and is kept
+        """
+        if channel not in self._channels:
+            raise RuntimeError("Channel requested must be one of {}".format(self.channels()))
+        image = self._channels[channel]
+        if not isinstance(image, LazyImage):
+            return False
+        image.evict()
+        return True
 
+    @profiled()
     def get_solar_radius(self, channel="304", refine=True):
         """
         Gets the solar radius from the header of the specified channel
@@ -104,68 +437,116 @@ class ImageSet:
         if channel not in self.channels():
             raise RuntimeError("Channel requested must be one of {}".format(self.channels()))
         try:
-            solar_radius = self.images[channel].header['DIAM_SUN'] / 2
+            solar_radius = self[channel].header['DIAM_SUN'] / 2
             if refine:
-                composite_img = self.images[channel].data
-                # Determine image size
-                image_size = np.shape(composite_img)[0]
-                # Find center and radial mesh grid
-                center = (image_size / 2) - 0.5
-                xm, ym = np.meshgrid(np.linspace(0, image_size - 1, num=image_size),
-                                     np.linspace(0, image_size - 1, num=image_size))
-                xm_c = xm - center
-                ym_c = ym - center
-                rads = np.sqrt(xm_c ** 2 + ym_c ** 2)
-                # Iterate through radii within a range past the solar radius
-                accuracy = 15
-                rad_iterate = np.linspace(solar_radius, solar_radius + 50, num=accuracy)
-                img_avgs = []
-                for rad in rad_iterate:
-                    # Create a temporary solar image corresponding to the layer
-                    solar_layer = np.zeros((image_size, image_size))
-                    # Find indices in mask of the layer
-                    indx_layer = np.where(rad >= rads)
-                    # Set temporary image corresponding to indices to solar image values
-                    solar_layer[indx_layer] = composite_img[indx_layer]
-                    # Appends average to image averages
-                    img_avgs.append(np.mean(solar_layer))
-                # Find "drop off" where mask causes average image brightness to drop
-                diff_avgs = np.asarray(img_avgs[0:accuracy - 1]) - np.asarray(img_avgs[1:accuracy])
-                # Return the radius that best represents the edge of the sun
-                solar_radius = rad_iterate[np.where(np.amax(diff_avgs))[0] + 1]
+                solar_radius = refine_solar_radius(self[channel].data, solar_radius)
         except KeyError:
             raise RuntimeError("Header does not include the solar diameter or radius")
         else:
             return solar_radius
 
 
+def thematic_map_hdus(hdulist):
+    """
+    Find the parts of a thematic map FITS file in either of the layouts ThematicMap.save writes
+    :param hdulist: the opened file
+    :return: the HDU with the labels and the BINTABLE HDU with the theme mapping
+    """
+    # either the labels are in the primary HDU, or a tile-compressed HDU follows an empty primary
+    image_hdu = next((hdu for hdu in hdulist if hdu.is_image and hdu.header.get('NAXIS', 0) > 0), None)
+    table_hdu = next((hdu for hdu in hdulist if isinstance(hdu, fits.BinTableHDU)
+                      and not isinstance(hdu, fits.CompImageHDU)), None)
+    if image_hdu is None or table_hdu is None:
+        raise RuntimeError("{} is not a thematic map".format(hdulist.filename()))
+    return image_hdu, table_hdu
+
+
+def read_theme_mapping(table_hdu):
+    """
+    :param table_hdu: the BINTABLE HDU of a thematic map
+    :return: dictionary of theme indices to theme names, without the unlabeled index 0
+    """
+    theme_mapping = {int(value): str(name) for value, name in table_hdu.data}
+    theme_mapping.pop(0, None)
+    return theme_mapping
+
+
+def theme_mappings_match(theme_mapping, other_theme_mapping):
+    """
+    Checks that two theme mappings have identical entries, e.g. before stacking maps whose labels must mean the same
+    :param theme_mapping: a dictionary of theme indices to theme names, e.g. {1: 'outer_space'}
+    :param other_theme_mapping: another one
+    :return: true or false depending on the matching
+    """
+    for theme_i, theme_name in theme_mapping.items():
+        if theme_i not in other_theme_mapping or other_theme_mapping[theme_i] != theme_name:
+            return False
+    return all(theme_i in theme_mapping for theme_i in other_theme_mapping)
+
+
+def as_labels(data, max_index=None, dtype=LABEL_DTYPE):
+    """
+    Check a label image and convert it to the compact integer type thematic maps hold
+    :param data: array of labels, of any numeric type as long as it only holds whole numbers
+    :param max_index: largest label allowed, e.g. Config.max_index, defaults to the largest the type holds
+    :param dtype: small unsigned integer type of the labels
+    :return: the labels as dtype, the array itself without a copy when it already is
+    """
+    data = np.asarray(data)
+    largest = np.iinfo(dtype).max
+    if max_index is None:
+        max_index = largest
+    elif max_index > largest:
+        raise RuntimeError("Labels up to {} do not fit in {}".format(max_index, np.dtype(dtype).name))
+    if data.size:
+        if data.dtype != dtype and not np.issubdtype(data.dtype, np.integer) and data.dtype != bool:
+            if not np.array_equal(data, np.trunc(data)):  # also rejects NaN
+                raise RuntimeError("Labels must be whole numbers")
+        if data.min() < 0 or data.max() > max_index:
+            raise RuntimeError("Labels must be between 0 and {}, found {} to {}".format(
+                max_index, data.min(), data.max()))
+    return data if data.dtype == dtype else data.astype(dtype)
+
+
 class ThematicMap:
-    def __init__(self, data, metadata, theme_mapping):
+    def __init__(self, data, metadata, theme_mapping, max_index=None):
         """
         A representation of a thematic map
-        :param data: the image of numbers for the labelling
+        :param data: the image of numbers for the labelling, held as LABEL_DTYPE, see as_labels
         :param metadata: dictionary of header information
         :param theme_mapping: dictionary of theme indices to theme names, the second hdu info
+        :param max_index: largest label allowed in data, e.g. Config.max_index, defaults to what LABEL_DTYPE holds
         """
+        self.max_index = max_index
         self.data = data
         self.metadata = metadata
         self.date_obs = parse_date_str(self.metadata['DATE-OBS'])
         self.theme_mapping = theme_mapping
 
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        # an editor hands back the array it edited in place, which stays the same object
+        self._data = as_labels(data, self.max_index)
+
     @staticmethod
-    def load(path):
+    @profiled("ThematicMap.load")
+    def load(path, max_index=None):
         """
         Load a thematic map
         :param path: path to the file
+        :param max_index: largest label allowed, e.g. Config.max_index, a map with larger labels raises RuntimeError
         :return: ThematicMap object that was loaded
         """
         with fits.open(path) as hdulist:
-            data = hdulist[0].data
-            metadata = dict(hdulist[0].header)
-            theme_mapping = dict(hdulist[1].data)
-            if 0 in theme_mapping:
-                del theme_mapping[0]
-        return ThematicMap(data, metadata, theme_mapping)
+            image_hdu, table_hdu = thematic_map_hdus(hdulist)
+            data = image_hdu.data
+            metadata = dict(image_hdu.header)
+            theme_mapping = read_theme_mapping(table_hdu)
+        return ThematicMap(data, metadata, theme_mapping, max_index)
 
     def complies_with_mapping(self, other_theme_mapping):
         """
@@ -173,29 +554,31 @@ class ThematicMap:
         :param other_theme_mapping: a dictionary of another theme_mapping, e.g. {1: 'outer_space'}
         :return: true or false depending on the matching
         """
-        for theme_i, theme_name in self.theme_mapping.items():
-            if theme_i not in other_theme_mapping:
-                return False
-            if other_theme_mapping[theme_i] != self.theme_mapping[theme_i]:
-                return False
-
-        for theme_i, theme_name in other_theme_mapping.items():
-            if theme_i not in self.theme_mapping:
-                return False
-            if other_theme_mapping[theme_i] != self.theme_mapping[theme_i]:
-                return False
-        return True
+        return theme_mappings_match(self.theme_mapping, other_theme_mapping)
 
-    def save(self, path):
+    @profiled()
+    def save(self, path, compression=None, tile_shape=None):
         """
         Write out a thematic map FITS
         :param path: where to save thematic maps fits file
+        :param compression: None for an uncompressed primary HDU, or one of THEMATIC_MAP_COMPRESSION to write the
+            labels as a tile-compressed HDU after an empty primary one. GZIP_2 gives the smallest files.
+        :param tile_shape: (rows, columns) of the compression tiles, defaults to the whole map as one tile, which
+            compresses best; smaller tiles let readers decompress part of the map
         :return:
         """
-        pri_hdu = fits.PrimaryHDU(data=self.data.astype(np.uint8))
+        data = self.data
+        if compression is None:
+            pri_hdu = image_hdu = fits.PrimaryHDU(data=data)
+        elif compression in THEMATIC_MAP_COMPRESSION:
+            pri_hdu = fits.PrimaryHDU()
+            image_hdu = fits.CompImageHDU(data=data, compression_type=compression,
+                                          tile_shape=data.shape if tile_shape is None else tuple(tile_shape))
+        else:
+            raise RuntimeError("Compression must be None or one of {}".format(THEMATIC_MAP_COMPRESSION))
         for k, v in self.metadata.items():
-            if k != 'COMMENT':
-                pri_hdu.header[k] = v
+            if k not in STRUCTURAL_KEYWORDS:
+                image_hdu.header[k] = v
 
         map_val = []
         map_label = []
@@ -206,13 +589,14 @@ class ThematicMap:
         c2 = fits.Column(name="Feature Name", format="22A", array=np.array(map_label))
         bintbl_hdr = fits.Header([("XTENSION", "BINTABLE")])
         sec_hdu = fits.BinTableHDU.from_columns([c1, c2], header=bintbl_hdr)
-        hdu = fits.HDUList([pri_hdu, sec_hdu])
-        hdu.writeto(path, overwrite=True, checksum=True)
+        hdus = [pri_hdu, sec_hdu] if image_hdu is pri_hdu else [pri_hdu, image_hdu, sec_hdu]
+        fits.HDUList(hdus).writeto(path, overwrite=True, checksum=True)
 
     def copy_195_metadata(self, image_set):
         keys_to_copy = ['YAW_FLIP', 'ECLIPSE', 'WCSNAME', 'CTYPE1', 'CTYPE2', 'CUNIT1', 'CUNIT2',
                         'PC1_1', 'PC1_2', 'PC2_1', 'PC2_2', 'CDELT1', 'CDELT2', 'CRVAL1', 'CRVAL2',
                         'CRPIX1', 'CRPIX2', 'DIAM_SUN', 'LONPOLE', 'CROTA', 'SOLAR_B0', 'ORIENT', 'DSUN_OBS']
-        if image_set.images['195'].header != {}:
+        header = image_set['195'].header
+        if header != {}:
             for key in keys_to_copy:
-                self.metadata[key] = image_set.images['195'].header[key]
+                self.metadata[key] = header[key]
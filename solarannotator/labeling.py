@@ -0,0 +1,141 @@
+from matplotlib import path
+from skimage.measure import find_contours
+import numpy as np
+
+
+def lasso_mask(verts, shape, radius=1):
+    """
+    Find the pixels inside a lasso, testing only those in its bounding box
+    :param verts: (x, y) vertices of the lasso in pixel coordinates, x is the column and y the row
+    :param shape: (rows, columns) of the image
+    :param radius: passed to matplotlib's Path.contains_points, widens or narrows the lasso
+    :return: tuple of the bounding box as a pair of slices, and a boolean mask of the pixels inside it
+    """
+    verts = np.asarray(verts, dtype=float)
+    margin = abs(radius) + 1
+    row_start = max(int(np.floor(verts[:, 1].min() - margin)), 0)
+    row_stop = min(int(np.ceil(verts[:, 1].max() + margin)) + 1, shape[0])
+    column_start = max(int(np.floor(verts[:, 0].min() - margin)), 0)
+    column_stop = min(int(np.ceil(verts[:, 0].max() + margin)) + 1, shape[1])
+    row_stop, column_stop = max(row_stop, row_start), max(column_stop, column_start)
+    window = (slice(row_start, row_stop), slice(column_start, column_stop))
+
+    columns, rows = np.meshgrid(np.arange(column_start, column_stop), np.arange(row_start, row_stop))
+    points = np.column_stack([columns.ravel(), rows.ravel()])
+    if len(points) == 0:
+        return window, np.zeros(columns.shape, dtype=bool)
+    inside = path.Path(verts).contains_points(points, radius=radius)
+    return window, inside.reshape(columns.shape)
+
+
+def lasso_fill(array, verts, value, radius=1):
+    """
+    Set every pixel inside a lasso to a value, in place
+    :param array: (m,n) array to adjust
+    :param verts: (x, y) vertices of the lasso in pixel coordinates
+    :param value: new value to assign
+    :param radius: passed to matplotlib's Path.contains_points
+    :return: the bounding box that was touched, as a pair of slices
+    """
+    window, inside = lasso_mask(verts, array.shape, radius)
+    array[window][inside] = value
+    return window
+
+
+def flood_fill_mask(array, seed, connectivity=4):
+    """
+    Find the connected region of equal values around a seed pixel, visiting only that region row span by row span
+    :param array: 2D label array
+    :param seed: (row, column) of the clicked pixel
+    :param connectivity: 4 to connect pixels sharing an edge, 8 to also connect diagonal neighbors
+    :return: tuple of the region's bounding box as a pair of slices, and a boolean mask of the region inside it
+    """
+    if connectivity not in (4, 8):
+        raise RuntimeError("Connectivity must be 4 or 8, not {}".format(connectivity))
+    n_rows, n_columns = array.shape
+    seed_row, seed_column = seed
+    target = array[seed_row, seed_column]
+    reach = 1 if connectivity == 8 else 0
+
+    spans = {}  # row -> list of filled (start, stop) column spans
+    stack = [(seed_row, seed_column)]
+    while stack:
+        row, column = stack.pop()
+        if _span_containing(spans.get(row, ()), column) is not None:
+            continue
+        start, stop = _run_around(array[row], column, target)
+        spans.setdefault(row, []).append((start, stop))
+
+        # queue one seed for every run of the target value next to this span in the rows above and below
+        for neighbor in (row - 1, row + 1):
+            if not 0 <= neighbor < n_rows:
+                continue
+            low, high = max(start - reach, 0), min(stop + reach, n_columns)
+            matches = np.flatnonzero(array[neighbor, low:high] == target)
+            if len(matches) == 0:
+                continue
+            run_starts = matches[np.insert(np.diff(matches) > 1, 0, True)] + low
+            filled = spans.get(neighbor, ())
+            for run_start in run_starts:
+                if _span_containing(filled, run_start) is None:
+                    stack.append((neighbor, run_start))
+
+    rows = sorted(spans)
+    column_start = min(start for row in rows for start, _ in spans[row])
+    column_stop = max(stop for row in rows for _, stop in spans[row])
+    window = (slice(rows[0], rows[-1] + 1), slice(column_start, column_stop))
+    mask = np.zeros((rows[-1] + 1 - rows[0], column_stop - column_start), dtype=bool)
+    for row in rows:
+        for start, stop in spans[row]:
+            mask[row - rows[0], start - column_start:stop - column_start] = True
+    return window, mask
+
+
+def flood_fill(array, seed, value, connectivity=4):
+    """
+    Relabel the connected region of equal values around a seed pixel, in place
+    :param array: 2D label array
+    :param seed: (row, column) of the clicked pixel
+    :param value: new value to assign
+    :param connectivity: 4 to connect pixels sharing an edge, 8 to also connect diagonal neighbors
+    :return: the bounding box of the region, as a pair of slices
+    """
+    window, mask = flood_fill_mask(array, seed, connectivity)
+    array[window][mask] = value
+    return window
+
+
+def region_contours(window, mask):
+    """
+    Trace the boundary of a region with marching squares, looking only at its bounding box
+    :param window: bounding box of the region in the image, as a pair of slices
+    :param mask: boolean mask of the region inside the window, e.g. from flood_fill_mask
+    :return: tuple of outer rings and holes, each a list of closed (N, 2) arrays of (row, column) image coordinates
+        running along the pixel edges between the region and its surroundings
+    """
+    # the padding closes rings of regions that touch the bounding box, and so the image border
+    padded = np.pad(mask, 1).astype(np.uint8)
+    outer_rings, holes = [], []
+    for contour in find_contours(padded, 0.5, fully_connected='low', positive_orientation='low'):
+        contour += (window[0].start - 1, window[1].start - 1)
+        rows, columns = contour[:, 0], contour[:, 1]
+        signed_area = np.sum(rows[:-1] * columns[1:] - rows[1:] * columns[:-1]) / 2
+        # with the region as the high side, outer rings wind one way in (row, column) and holes the other
+        (outer_rings if signed_area < 0 else holes).append(contour)
+    return outer_rings, holes
+
+
+def _run_around(values, column, target):
+    # the run of target values containing a column, found by vectorized searches to either side
+    different = values[column:] != target
+    stop = column + int(np.argmax(different)) if different.any() else len(values)
+    different = values[column::-1] != target
+    start = column - int(np.argmax(different)) + 1 if different.any() else 0
+    return start, stop
+
+
+def _span_containing(spans, column):
+    for start, stop in spans:
+        if start <= column < stop:
+            return start, stop
+    return None
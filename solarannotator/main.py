@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from solarannotator.gui import ApplicationWindow
+from solarannotator import profiling
 from PyQt5 import QtWidgets
 import argparse
 import os
@@ -11,7 +12,15 @@ def main():
     parser = argparse.ArgumentParser(description='Annotate solar images with labels')
     parser.add_argument('--config', help='a configuration file to load',
                         default=os.path.join(sys.prefix, 'solarannotator/default.json'))
+    parser.add_argument('--profile', nargs='?', const='', metavar='TRACE',
+                        help='record the timing of slow operations, exported from the Help menu or, when a '
+                             '.json path is given, written there as a Chrome trace on exit (also enabled by the '
+                             '{} environment variable)'.format(profiling.ENVIRONMENT_VARIABLE))
     args = parser.parse_args()
+    if args.profile is not None:
+        profiling.enable_from_environment({profiling.ENVIRONMENT_VARIABLE: args.profile or "1"})
+    else:
+        profiling.enable_from_environment()
 
     # Check whether there is already a running QApplication (e.g., if running
     # from an IDE).
@@ -0,0 +1,130 @@
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, CancelledError, wait
+from datetime import timedelta
+import threading
+
+from .io import RetrievalCancelled, CANCEL_POLL_INTERVAL
+
+Prefetch = namedtuple('Prefetch', 'future cancel')
+
+
+class Prefetcher:
+    def __init__(self, retrieve, cadence=timedelta(hours=6), steps=1, max_sets=None, max_workers=1):
+        """
+        Retrieves the ImageSets of the observation times around the current one in the background, so stepping to
+        the next or previous time finds its composites ready.
+        :param retrieve: function called as retrieve(date, progress=None, cancel=None) that returns an ImageSet,
+            e.g. ImageSet.retrieve with the cache arguments bound
+        :param cadence: time between neighboring observation times
+        :param steps: how many cadence steps to prefetch in each direction, 0 turns prefetching off
+        :param max_sets: how many ImageSets are kept in memory, defaults to the prefetched ones plus the current one
+        :param max_workers: number of dates retrieved at once
+        """
+        self.retrieve_function = retrieve
+        self.cadence = cadence
+        self.steps = steps
+        self.max_sets = 2 * steps + 1 if max_sets is None else max(max_sets, 1)
+        self._entries = OrderedDict()
+        self._center = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __contains__(self, date):
+        with self._lock:
+            return date in self._entries
+
+    def neighbors(self, date):
+        """
+        :param date: the current observation time
+        :return: the times to prefetch, nearest first and the next one before the previous one at each distance
+        """
+        return [date + sign * step * self.cadence for step in range(1, self.steps + 1) for sign in (1, -1)]
+
+    def prefetch_around(self, date):
+        """
+        Start retrieving the neighbors of a date that are not stored yet
+        :param date: the current observation time
+        """
+        with self._lock:
+            self._center = date
+            for neighbor in self.neighbors(date):
+                if neighbor not in self._entries:
+                    cancel = threading.Event()
+                    future = self._executor.submit(self._prefetch, neighbor, cancel)
+                    self._entries[neighbor] = Prefetch(future, cancel)
+            self._trim()
+
+    def remember(self, date, image_set):
+        """
+        Store an ImageSet retrieved elsewhere, e.g. the one being shown, so returning to it costs nothing
+        :param date: the requested observation time
+        :param image_set: its ImageSet
+        """
+        future = Future()
+        future.set_result(image_set)
+        with self._lock:
+            self._entries[date] = Prefetch(future, threading.Event())
+            self._entries.move_to_end(date)
+            self._trim()
+
+    def retrieve(self, date, progress=None, cancel=None):
+        """
+        Get the ImageSet of a date, from the store when it was prefetched, waiting for it if it is on its way
+        :param date: the requested observation time
+        :param progress: optional function called as progress(channel, image, error), see ImageSet.retrieve
+        :param cancel: optional threading.Event, setting it stops the wait with RetrievalCancelled
+        :return: ImageSet of the date
+        """
+        with self._lock:
+            entry = self._entries.get(date)
+            if entry is not None:
+                self._entries.move_to_end(date)
+
+        if entry is not None:
+            while not entry.future.done():
+                if cancel is not None and cancel.is_set():
+                    raise RetrievalCancelled(date)
+                wait([entry.future], timeout=CANCEL_POLL_INTERVAL if cancel is not None else None)
+            try:
+                image_set = entry.future.result()
+            except (CancelledError, Exception):
+                pass  # a failed or abandoned prefetch, retried below
+            else:
+                if progress is not None:
+                    for channel in image_set.channels():
+                        progress(channel, image_set[channel], image_set.failures.get(channel))
+                return image_set
+
+        image_set = self.retrieve_function(date, progress=progress, cancel=cancel)
+        self.remember(date, image_set)
+        return image_set
+
+    def clear(self):
+        """ cancel every prefetch and forget every stored ImageSet """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.cancel.set()
+                entry.future.cancel()
+            self._entries = OrderedDict()
+
+    def shutdown(self):
+        """ stop the background retrievals, e.g. when the application closes """
+        self.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _prefetch(self, date, cancel):
+        image_set = self.retrieve_function(date, cancel=cancel)
+        image_set.preload()
+        return image_set
+
+    def _trim(self):
+        # called with the lock held, the least recently used sets outside the prefetch window go first
+        window = set(self.neighbors(self._center)) if self._center is not None else set()
+        for date in list(self._entries):
+            if len(self._entries) <= self.max_sets:
+                break
+            if date in window or date == self._center:
+                continue
+            entry = self._entries.pop(date)
+            entry.cancel.set()
+            entry.future.cancel()
@@ -0,0 +1,246 @@
+from collections import deque, namedtuple
+from functools import wraps
+import atexit
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+ENVIRONMENT_VARIABLE = "SOLARANNOTATOR_PROFILE"
+DEFAULT_CAPACITY = 10000
+
+Record = namedtuple('Record', 'name start wall cpu peak thread details')
+
+# None while profiling is off, so an instrumented function only pays for one global lookup
+_recorder = None
+
+
+class Recorder:
+    def __init__(self, capacity=DEFAULT_CAPACITY, trace_memory=True):
+        """
+        Keeps the most recent timings of instrumented functions
+        :param capacity: number of records kept, the oldest are dropped beyond it
+        :param trace_memory: if True, the peak allocation of every call is measured with tracemalloc, which slows
+            down allocation heavy code while profiling. tracemalloc counts the whole process, so calls that overlap
+            a measured call of another thread, e.g. the channels of a concurrent retrieval, get no peak.
+        """
+        self.records = deque(maxlen=capacity)
+        self.trace_memory = trace_memory
+        self.origin = time.perf_counter()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.open = set()  # measurements in progress in every thread
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def close(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def measure(self, name, details=None):
+        return _Measurement(self, name, details)
+
+
+class _Measurement:
+    def __init__(self, recorder, name, details):
+        self.recorder = recorder
+        self.name = name
+        self.details = details
+
+    def __enter__(self):
+        stack = getattr(self.recorder.local, 'stack', None)
+        if stack is None:
+            stack = self.recorder.local.stack = []
+        self.stack = stack
+        self.thread = threading.get_ident()
+        self.overlapped = False
+        self.highest = 0
+        with self.recorder.lock:
+            # the peak of one thread cannot be told apart from the allocations of another
+            for other in self.recorder.open:
+                if other.thread != self.thread:
+                    other.overlapped = self.overlapped = True
+            self.recorder.open.add(self)
+        self.memory = self.recorder.trace_memory and tracemalloc.is_tracing()
+        if self.memory and not self.overlapped:
+            # tracemalloc has one peak for the whole process, the peak of an enclosing call is kept by hand
+            self.current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].highest = max(stack[-1].highest, peak)
+            self.highest = self.current
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        self.stack.pop()
+        with self.recorder.lock:
+            self.recorder.open.discard(self)
+        peak = None
+        if self.memory and not self.overlapped and tracemalloc.is_tracing():
+            highest = max(self.highest, tracemalloc.get_traced_memory()[1])
+            peak = highest - self.current
+            if self.stack:
+                self.stack[-1].highest = max(self.stack[-1].highest, highest)
+        details = dict(self.details or {})
+        if exc_type is not None:
+            details['error'] = exc_type.__name__
+        self.recorder.records.append(Record(self.name, self.start - self.recorder.origin, wall, cpu, peak,
+                                            threading.current_thread().name, details))
+        return False
+
+
+def enable(capacity=DEFAULT_CAPACITY, trace_memory=True):
+    """
+    Start recording the instrumented functions, records made before are dropped
+    :param capacity: number of records kept in the ring buffer
+    :param trace_memory: if True, the peak allocation of every call is measured too
+    """
+    global _recorder
+    disable()
+    _recorder = Recorder(capacity, trace_memory)
+
+
+def disable():
+    """ stop recording and drop the records """
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def is_enabled():
+    return _recorder is not None
+
+
+def enable_from_environment(environ=None):
+    """
+    Enable profiling when SOLARANNOTATOR_PROFILE is set to something other than 0. If its value is a path ending in
+    .json, the records are written there as a Chrome trace when the program exits.
+    :param environ: mapping of environment variables, defaults to os.environ
+    :return: whether profiling is enabled
+    """
+    value = (os.environ if environ is None else environ).get(ENVIRONMENT_VARIABLE, "")
+    if value in ("", "0"):
+        return is_enabled()
+    enable()
+    if value.endswith(".json"):
+        atexit.register(export_chrome_trace, value)
+    return True
+
+
+def records():
+    """
+    :return: list of the Record kept, oldest first, each with the start in seconds since profiling was enabled,
+        the wall and CPU time in seconds, the peak allocation in bytes (None without memory tracing or when another
+        thread was measured meanwhile), the thread, and a dictionary of details such as the channel
+    """
+    return list(_recorder.records) if _recorder is not None else []
+
+
+def clear():
+    """ drop the records kept so far """
+    if _recorder is not None:
+        _recorder.records.clear()
+
+
+def profiled(name=None, details=None):
+    """
+    Decorator that records every call of a function while profiling is enabled
+    :param name: name of the records, defaults to the qualified name of the function
+    :param details: optional function called with the arguments of the call, returning a dictionary recorded with
+        it, e.g. the channel being retrieved
+    :return: the decorator
+    """
+    def decorator(func):
+        record_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if recorder is None:
+                return func(*args, **kwargs)
+            with recorder.measure(record_name, details(*args, **kwargs) if details is not None else None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def measure(name, **details):
+    """
+    Context manager that records a block of code while profiling is enabled, see profiled
+    :param name: name of the record
+    :param details: recorded with it
+    :return: the context manager
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NOT_MEASURED
+    return recorder.measure(name, details)
+
+
+class _NotMeasured:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOT_MEASURED = _NotMeasured()
+
+
+def summary(kept=None):
+    """
+    :param kept: list of Record, defaults to all kept
+    :return: dictionary of record name to its 'calls' and the 'total', 'mean', and 'max' wall time, the total CPU
+        time, and the largest peak allocation
+    """
+    totals = {}
+    for record in records() if kept is None else kept:
+        entry = totals.setdefault(record.name, {'calls': 0, 'total_wall': 0.0, 'max_wall': 0.0, 'total_cpu': 0.0,
+                                                'max_peak': None})
+        entry['calls'] += 1
+        entry['total_wall'] += record.wall
+        entry['max_wall'] = max(entry['max_wall'], record.wall)
+        entry['total_cpu'] += record.cpu
+        if record.peak is not None:
+            entry['max_peak'] = max(entry['max_peak'] or 0, record.peak)
+    for entry in totals.values():
+        entry['mean_wall'] = entry['total_wall'] / entry['calls']
+    return totals
+
+
+def export_json(path):
+    """
+    Write the records and their summary to a JSON file
+    :param path: the JSON file
+    """
+    kept = records()
+    with open(path, "w") as f:
+        json.dump({'records': [record._asdict() for record in kept], 'summary': summary(kept)}, f, indent=1)
+
+
+def export_chrome_trace(path):
+    """
+    Write the records as a Chrome trace, to open in chrome://tracing or Perfetto
+    :param path: the JSON file
+    """
+    threads = {}
+    events = []
+    for record in records():
+        tid = threads.setdefault(record.thread, len(threads) + 1)
+        args = dict(record.details, cpu_ms=record.cpu * 1000)
+        if record.peak is not None:
+            args['peak_bytes'] = record.peak
+        events.append({'name': record.name, 'cat': record.name.split('.')[0], 'ph': 'X', 'pid': os.getpid(),
+                       'tid': tid, 'ts': record.start * 1e6, 'dur': record.wall * 1e6, 'args': args})
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': thread}}
+               for thread, tid in threads.items()]
+    with open(path, "w") as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,111 @@
+import numpy as np
+
+DEFAULT_FACTORS = (2, 4, 8)
+
+
+def _blocks(image, factor):
+    # pad the image with its edge to whole blocks, then put the pixels of every block on the last axis
+    rows, columns = image.shape[:2]
+    padding = ((0, -rows % factor), (0, -columns % factor)) + ((0, 0),) * (image.ndim - 2)
+    if any(after for _, after in padding):
+        image = np.pad(image, padding, mode='edge')
+    rows, columns = image.shape[:2]
+    blocks = image.reshape((rows // factor, factor, columns // factor, factor) + image.shape[2:])
+    blocks = np.moveaxis(blocks, 2, 1)
+    return blocks.reshape((rows // factor, columns // factor, factor * factor) + image.shape[2:])
+
+
+def downsample_mean(image, factor):
+    """
+    Shrink an image by averaging blocks of pixels, e.g. for the preview
+    :param image: 2D image, or 3D with colors on the last axis
+    :param factor: side of the blocks in pixels, the edges are padded when the image does not divide evenly
+    :return: float32 image, a block with a NaN is NaN
+    """
+    return _blocks(np.asarray(image, dtype=np.float32), factor).mean(axis=2, dtype=np.float32)
+
+
+def downsample_mode(labels, factor):
+    """
+    Shrink a label image by keeping the most common label of every block, so no label is made up by averaging
+    :param labels: 2D array of non-negative integer labels
+    :param factor: side of the blocks in pixels, the edges are padded when the image does not divide evenly
+    :return: array of the same dtype, ties go to the smaller label
+    """
+    labels = np.asarray(labels)
+    blocks = _blocks(labels, factor)
+    count = blocks.shape[0] * blocks.shape[1]
+    values = blocks.reshape(count, -1).astype(np.intp)
+    length = int(values.max(initial=0)) + 1
+    # one bincount counts every label of every block at once
+    counts = np.bincount((np.arange(count)[:, None] * length + values).ravel(), minlength=count * length)
+    return counts.reshape(count, length).argmax(axis=1).astype(labels.dtype).reshape(blocks.shape[:2])
+
+
+class DisplayPyramid:
+    def __init__(self, image, reduce, factors=DEFAULT_FACTORS):
+        """
+        Downsampled copies of an image, so a view only ever hands as many pixels to matplotlib as the screen shows
+        :param image: the full resolution image, it is referenced, not copied, so edits show after update
+        :param reduce: downsample_mean for images, downsample_mode for labels
+        :param factors: the downsampling factors of the levels, increasing
+        """
+        self.image = image
+        self.reduce = reduce
+        self.factors = (1,) + tuple(factors)
+        self.levels = [image] + [reduce(image, factor) for factor in factors]
+
+    @property
+    def shape(self):
+        return self.image.shape[:2]
+
+    def update(self, window):
+        """
+        Redo the downsampled levels where the full resolution image was edited
+        :param window: pair of slices bounding the edited pixels
+        """
+        rows, columns = window
+        for index, factor in enumerate(self.factors[1:], start=1):
+            first_row, last_row = rows.start // factor, -(-rows.stop // factor)
+            first_column, last_column = columns.start // factor, -(-columns.stop // factor)
+            self.levels[index][first_row:last_row, first_column:last_column] = self.reduce(
+                self.image[first_row * factor:last_row * factor, first_column * factor:last_column * factor], factor)
+
+    def level_for(self, pixels_per_screen_pixel):
+        """
+        :param pixels_per_screen_pixel: how many full resolution pixels one screen pixel covers in the view
+        :return: index of the coarsest level that still has at least one pixel per screen pixel
+        """
+        index = 0
+        for candidate, factor in enumerate(self.factors):
+            if factor <= pixels_per_screen_pixel:
+                index = candidate
+        return index
+
+    def view(self, xlim, ylim, screen_width, screen_height):
+        """
+        The part of the image to show in a view
+        :param xlim: horizontal limits of the view in full resolution pixel coordinates
+        :param ylim: vertical limits of the view in full resolution pixel coordinates
+        :param screen_width: width of the view on screen in pixels
+        :param screen_height: height of the view on screen in pixels
+        :return: the visible crop of the level matching the zoom, and its extent (left, right, bottom, top) in full
+            resolution pixel coordinates for imshow with origin='lower'
+        """
+        (left, right), (bottom, top) = sorted(xlim), sorted(ylim)
+        scale = max((right - left) / max(screen_width, 1), (top - bottom) / max(screen_height, 1))
+        index = self.level_for(scale)
+        factor, level = self.factors[index], self.levels[index]
+
+        # pixel i covers [i - 0.5, i + 0.5) at full resolution, keep one more level pixel on every side
+        def visible(low, high, size):
+            first = min(max(int(np.floor((low + 0.5) / factor)) - 1, 0), size - 1)
+            last = min(max(int(np.ceil((high + 0.5) / factor)) + 1, first + 1), size)
+            return first, last
+
+        first_row, last_row = visible(bottom, top, level.shape[0])
+        first_column, last_column = visible(left, right, level.shape[1])
+        crop = level[first_row:last_row, first_column:last_column]
+        extent = (first_column * factor - 0.5, last_column * factor - 0.5,
+                  first_row * factor - 0.5, last_row * factor - 0.5)
+        return crop, extent
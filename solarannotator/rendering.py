@@ -0,0 +1,145 @@
+from matplotlib.transforms import Bbox
+import numpy as np
+
+
+def image_window(data, extent, window):
+    """
+    The part of an image array that covers a block of full resolution pixels, e.g. the pixels an edit changed.
+    The array may be cropped or downsampled, see DisplayPyramid.view.
+    :param data: the array shown with origin='lower'
+    :param extent: (left, right, bottom, top) of the array in full resolution pixel coordinates
+    :param window: pair of slices of the full resolution rows and columns
+    :return: the covering part of the array and its extent, or None when the block is not in the array
+    """
+    left, right, bottom, top = extent
+    row_size, column_size = (top - bottom) / data.shape[0], (right - left) / data.shape[1]
+    rows, columns = window
+
+    def covering(start, stop, origin, size, length):
+        first = max(int(np.floor((start - 0.5 - origin) / size)), 0)
+        last = min(int(np.ceil((stop - 0.5 - origin) / size)), length)
+        return first, last
+
+    first_row, last_row = covering(rows.start, rows.stop, bottom, row_size, data.shape[0])
+    first_column, last_column = covering(columns.start, columns.stop, left, column_size, data.shape[1])
+    if first_row >= last_row or first_column >= last_column:
+        return None
+    return data[first_row:last_row, first_column:last_column], (left + first_column * column_size,
+                                                                left + last_column * column_size,
+                                                                bottom + first_row * row_size,
+                                                                bottom + last_row * row_size)
+
+
+def display_extent(ax, extent):
+    """
+    :param ax: axes
+    :param extent: (left, right, bottom, top) in data coordinates
+    :return: Bbox of that area on the canvas, rounded outward to whole pixels and clipped to the axes, or None when
+        it is out of view
+    """
+    corners = ax.transData.transform([(extent[0], extent[2]), (extent[1], extent[3])])
+    area = Bbox.from_extents(np.floor(corners[:, 0].min()) - 1, np.floor(corners[:, 1].min()) - 1,
+                             np.ceil(corners[:, 0].max()) + 1, np.ceil(corners[:, 1].max()) + 1)
+    return Bbox.intersection(area, ax.bbox)
+
+
+class BlitManager:
+    def __init__(self, canvas):
+        """
+        Redraws parts of a figure without drawing all of it. After every full draw the canvas is saved without the
+        animated artists, then an update restores it, draws a changed artist only inside its dirty rectangle,
+        draws the animated artists on top, and blits only the area that changed.
+        :param canvas: an Agg based canvas, e.g. FigureCanvasQTAgg
+        """
+        self.canvas = canvas
+        self.figure = canvas.figure
+        self.background = None
+        self.artists = []
+        canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist):
+        """
+        Draw an artist with blitting from now on, a full draw leaves it out
+        :param artist: an artist already added to an axes
+        """
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def remove_artist(self, artist):
+        """
+        Take an animated artist off the figure, the area it covered is blitted on the next update
+        :param artist: an artist given to add_artist
+        :return: its extent on the canvas, to pass to update
+        """
+        extent = self._extent(artist)
+        self.artists.remove(artist)
+        artist.remove()
+        return extent
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_animated()
+
+    def update(self, artist=None, extent=None, dirty=()):
+        """
+        Show changes without a full draw
+        :param artist: optional artist that changed, e.g. an AxesImage whose data was edited in place
+        :param extent: Bbox in display coordinates that the artist changed in, see window_extent
+        :param dirty: other Bboxes to blit, e.g. the extents of removed artists
+        """
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        dirty = list(dirty)
+        if artist is not None and extent is not None:
+            clip_box = artist.get_clip_box()
+            artist.set_clip_box(extent)
+            self.figure.draw_artist(artist)
+            artist.set_clip_box(clip_box)
+            # the saved canvas has to show the change too, or the next update would undo it
+            self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+            dirty.append(extent)
+        dirty += self._draw_animated()
+        if dirty:
+            area = Bbox.intersection(Bbox.union(dirty), self.figure.bbox)
+            if area is not None:
+                self.canvas.blit(area)
+
+    def update_image(self, axesimage, data, window, dirty=()):
+        """
+        Show an edit of the array behind an AxesImage by colormapping and drawing only the pixels that changed
+        :param axesimage: the AxesImage, with origin='lower' and its extent in full resolution pixel coordinates
+        :param data: the array the image shows, changed in place, the image itself only holds a copy of it
+        :param window: pair of slices of the full resolution rows and columns that changed, on a downsampled
+            level every block that overlaps them is drawn
+        :param dirty: other Bboxes to blit, see update
+        """
+        full_extent = axesimage.get_extent()
+        covered = image_window(data, full_extent, window)
+        extent = display_extent(axesimage.axes, covered[1]) if covered is not None else None
+        if extent is not None:
+            # with nearest neighbor sampling the part lands on exactly the same canvas pixels as the whole array does
+            axesimage.set_data(covered[0])
+            axesimage.set_extent(covered[1])
+            try:
+                self.update(axesimage, extent, dirty)
+            finally:
+                axesimage.set_extent(full_extent)
+        elif dirty:
+            self.update(dirty=dirty)
+        # the copy the image holds has to catch up with the edit even where it is out of view
+        axesimage.set_data(data)
+
+    def _draw_animated(self):
+        extents = []
+        for artist in sorted(self.artists, key=lambda a: a.get_zorder()):
+            self.figure.draw_artist(artist)
+            extents.append(self._extent(artist))
+        return extents
+
+    def _extent(self, artist):
+        # collections do not report a usable window extent, and an artist in an axes is clipped to it anyway
+        if artist.axes is not None:
+            return artist.axes.bbox.frozen()
+        return artist.get_window_extent(self.canvas.get_renderer())
@@ -0,0 +1,215 @@
+from astropy.wcs import WCS
+from astropy.wcs.utils import pixel_to_pixel
+from collections import OrderedDict
+from dateutil.parser import parse as parse_date_str
+from scipy.ndimage import map_coordinates
+import numpy as np
+import threading
+import hashlib
+import sunpy.map
+from sunpy.coordinates import Helioprojective
+import os
+
+from .cache import evict_least_recently_used
+
+DEFAULT_REPROJECTION_DIRECTORY = os.path.join(os.path.expanduser("~"), ".solarannotator", "reprojection")
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+# keywords that determine where a pixel lands on the sky, including the observer location
+WCS_KEYWORDS = ['NAXIS1', 'NAXIS2', 'CTYPE1', 'CTYPE2', 'CUNIT1', 'CUNIT2', 'CRPIX1', 'CRPIX2',
+                'CRVAL1', 'CRVAL2', 'CDELT1', 'CDELT2', 'PC1_1', 'PC1_2', 'PC2_1', 'PC2_2',
+                'CROTA', 'CROTA1', 'CROTA2', 'LONPOLE', 'RSUN_REF', 'DSUN_OBS', 'HGLN_OBS', 'HGLT_OBS',
+                'CRLN_OBS', 'CRLT_OBS', 'HEEQ_X', 'HEEQ_Y', 'HEEQ_Z', 'OBSGEO-X', 'OBSGEO-Y', 'OBSGEO-Z']
+
+# together with the WCS keywords these identify a single source observation
+OBSERVATION_KEYWORDS = ['DATE-OBS', 'TIME-OBS', 'DATE_OBS', 'TELESCOP', 'INSTRUME', 'SITE', 'OBS-SITE']
+
+
+def header_digest(header, keywords=WCS_KEYWORDS, exclude=(), digits=12):
+    """
+    Hash a selection of header keywords
+    :param header: FITS header or dictionary
+    :param keywords: the keywords to include, missing ones are hashed as absent
+    :param exclude: keywords to leave out, e.g. the reference pixel
+    :param digits: floating point values are rounded to this many significant figures first,
+        so headers that agree to that precision hash identically
+    :return: hexadecimal digest
+    """
+    values = []
+    for key in keywords:
+        if key in exclude:
+            continue
+        value = header.get(key)
+        if isinstance(value, float):
+            value = float("{:.{}g}".format(value, digits))
+        values.append((key, value))
+    return hashlib.sha1(repr(values).encode()).hexdigest()
+
+
+def observation_time(header):
+    """
+    Read the observation time of a header, combining DATE-OBS and TIME-OBS when the time is split
+    :param header: FITS header or dictionary
+    :return: datetime or None if the header has no usable date
+    """
+    date = header.get('DATE-OBS', header.get('DATE_OBS'))
+    if not date:
+        return None
+    if 'T' not in str(date) and header.get('TIME-OBS'):
+        date = "{}T{}".format(date, header['TIME-OBS'])
+    try:
+        return parse_date_str(str(date)).replace(tzinfo=None)
+    except (ValueError, OverflowError):
+        return None
+
+
+def compute_pixel_mapping(source_map, target_wcs, shape):
+    """
+    Find where each target pixel falls in the source image, the costly part of a reprojection
+    :param source_map: sunpy Map being reprojected
+    :param target_wcs: astropy WCS of the output
+    :param shape: (rows, columns) of the output
+    :return: float32 array of shape (2, rows, columns) with the source row and column of every output pixel,
+        NaN where the coordinates do not round trip
+    """
+    rows, columns = np.meshgrid(np.arange(shape[0], dtype=float), np.arange(shape[1], dtype=float), indexing="ij")
+    source_x, source_y = pixel_to_pixel(target_wcs, source_map.wcs, columns.ravel(), rows.ravel())
+
+    # like reproject, drop coordinates that do not convert back to the pixel they came from
+    check_x, check_y = pixel_to_pixel(source_map.wcs, target_wcs, source_x, source_y)
+    reset = (np.abs(check_x - columns.ravel()) > 1) | (np.abs(check_y - rows.ravel()) > 1)
+    mapping = np.stack([source_y, source_x]).astype(np.float32)
+    mapping[:, reset] = np.nan
+    return mapping.reshape((2,) + tuple(shape))
+
+
+def apply_pixel_mapping(data, mapping, offset=(0, 0)):
+    """
+    Bilinearly sample an image at precomputed pixel coordinates
+    :param data: the source image
+    :param mapping: output of compute_pixel_mapping
+    :param offset: (row, column) shift added to the mapping, e.g. the change of the source reference pixel
+    :return: float64 image with the shape of the mapping, NaN outside the source
+    """
+    coordinates = mapping.reshape(2, -1).astype(float)
+    coordinates[0] += offset[0]
+    coordinates[1] += offset[1]
+    for axis in range(2):
+        # values are defined at pixel centers, so the outer half of the border pixels takes the border value
+        size = data.shape[axis]
+        coordinates[axis][(coordinates[axis] < 0) & (coordinates[axis] >= -0.5)] = 0
+        coordinates[axis][(coordinates[axis] < size - 0.5) & (coordinates[axis] >= size - 1)] = size - 1
+    data = np.asarray(data, dtype=float)  # native byte order, FITS data is big-endian
+    out = map_coordinates(data, coordinates, order=1, mode="constant", cval=np.nan, output=np.float64)
+    return out.reshape(mapping.shape[1:])
+
+
+class ReprojectionCache:
+    def __init__(self, directory=DEFAULT_REPROJECTION_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES,
+                 max_mappings_in_memory=2, digits=6, time_resolution=5):
+        """
+        Caches GONG images reprojected onto the SUVI 195 grid, plus the pixel mappings behind them.
+        Results are keyed by the GONG observation and the exact SUVI WCS. Mappings are keyed by both WCS with the
+        floating point keywords rounded and the GONG reference pixel left out, plus the time between the two
+        observations (the absolute time does not change the geometry), so a new date whose geometry is effectively
+        unchanged is reprojected with a single gather instead of a full coordinate transformation.
+        :param directory: where the results and mappings are stored
+        :param max_bytes: size budget of the directory, least recently used files are removed beyond it
+        :param max_mappings_in_memory: how many mappings are also held in memory
+        :param digits: significant figures two WCS have to agree to for a mapping to be reused
+        :param time_resolution: seconds the time between the GONG and SUVI observations is rounded to
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_mappings_in_memory = max_mappings_in_memory
+        self.digits = digits
+        self.time_resolution = time_resolution
+        self._mappings = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _result_path(self, gong_header, suvi_header):
+        key = header_digest(gong_header, WCS_KEYWORDS + OBSERVATION_KEYWORDS) + header_digest(suvi_header)
+        return os.path.join(self.directory, "result-{}.npy".format(hashlib.sha1(key.encode()).hexdigest()))
+
+    def _mapping_path(self, gong_header, suvi_header):
+        gong_time, suvi_time = observation_time(gong_header), observation_time(suvi_header)
+        if gong_time is None or suvi_time is None:
+            separation = None
+        else:
+            separation = round((gong_time - suvi_time).total_seconds() / self.time_resolution)
+        key = (header_digest(gong_header, exclude=('CRPIX1', 'CRPIX2'), digits=self.digits)
+               + header_digest(suvi_header, digits=self.digits) + repr(separation))
+        return os.path.join(self.directory, "mapping-{}.npz".format(hashlib.sha1(key.encode()).hexdigest()))
+
+    def reproject(self, gong_image, suvi_195_image):
+        """
+        Reproject a GONG image onto the SUVI 195 composite grid, reusing earlier work where possible
+        :param gong_image: Image of GONG data and its corrected header
+        :param suvi_195_image: Image of the SUVI 195 composite
+        :return: tuple of reprojected data and its metadata
+        """
+        gong_data, gong_head = gong_image
+        suvi_head = suvi_195_image.header
+        target_wcs = WCS(suvi_head)
+        shape = (suvi_head['NAXIS2'], suvi_head['NAXIS1'])
+
+        result_path = self._result_path(gong_head, suvi_head)
+        try:
+            out = np.load(result_path, mmap_mode='c')
+            os.utime(result_path)
+            return out, self._metadata(out, target_wcs)
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+
+        mapping_path = self._mapping_path(gong_head, suvi_head)
+        mapping, crpix = self._load_mapping(mapping_path)
+        if mapping is None:
+            gong_map = sunpy.map.Map(gong_data, gong_head)
+            suvi_map = sunpy.map.Map(suvi_195_image.data, suvi_head)
+            with Helioprojective.assume_spherical_screen(suvi_map.observer_coordinate, only_off_disk=True):
+                mapping = compute_pixel_mapping(gong_map, target_wcs, shape)
+            crpix = np.array([gong_head['CRPIX2'], gong_head['CRPIX1']], dtype=float)
+            self._save_mapping(mapping_path, mapping, crpix)
+
+        offset = (gong_head['CRPIX2'] - crpix[0], gong_head['CRPIX1'] - crpix[1])
+        out = apply_pixel_mapping(gong_data, mapping, offset)
+        self._save(result_path, lambda f: np.save(f, out))
+        return out, self._metadata(out, target_wcs)
+
+    @staticmethod
+    def _metadata(data, target_wcs):
+        # the same metadata sunpy gives a reprojected map
+        return dict(sunpy.map.Map(data, target_wcs.to_header()).meta)
+
+    def _load_mapping(self, path):
+        with self._lock:
+            if path in self._mappings:
+                self._mappings.move_to_end(path)
+                return self._mappings[path]
+        try:
+            with np.load(path) as stored:
+                entry = stored['mapping'], stored['crpix']
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError, KeyError):
+            return None, None
+        self._remember(path, entry)
+        return entry
+
+    def _save_mapping(self, path, mapping, crpix):
+        self._remember(path, (mapping, crpix))
+        self._save(path, lambda f: np.savez(f, mapping=mapping, crpix=crpix))
+
+    def _remember(self, path, entry):
+        with self._lock:
+            self._mappings[path] = entry
+            self._mappings.move_to_end(path)
+            while len(self._mappings) > self.max_mappings_in_memory:
+                self._mappings.popitem(last=False)
+
+    def _save(self, path, write):
+        staging = path + ".partial"
+        with open(staging, "wb") as f:
+            write(f)
+        os.replace(staging, path)
+        evict_least_recently_used(self.directory, self.max_bytes, keep=path)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+from datetime import datetime
+import argparse
+import glob
+import json
+import numpy as np
+import os
+import sys
+import time
+
+from .history import EditHistory
+from .io import ImageSet, ThematicMap, THEMATIC_MAP_COMPRESSION, LABEL_DTYPE
+from .labeling import lasso_mask, flood_fill_mask, region_contours
+from .template import create_thmap_template
+
+# one step of a session, time is in seconds since the map was loaded
+Operation = namedtuple('Operation', 'name arguments time')
+OPERATIONS = ('lasso', 'fill', 'undo', 'redo')
+
+
+class AnnotationSession:
+    def __init__(self, thmap, composites=None, history=None, record=True):
+        """
+        The state of an annotation without any display: a thematic map, the composites it was made from, and the
+        edit history. AnnotationWidget is a view over one, and scripts can drive one directly.
+        :param thmap: ThematicMap being annotated
+        :param composites: optional ImageSet of the composites, an empty one by default
+        :param history: optional EditHistory, with its default settings otherwise
+        :param record: if True, every edit is kept in log so it can be written out and replayed
+        """
+        self.composites = composites if composites is not None else ImageSet.create_empty()
+        self.history = history if history is not None else EditHistory()
+        self.record = record
+        self.load(thmap, self.composites)
+
+    @property
+    def data(self):
+        """ the labels of the map, edited in place """
+        return self.thmap.data
+
+    @property
+    def max_index(self):
+        return self.thmap.max_index if self.thmap.max_index is not None else np.iinfo(LABEL_DTYPE).max
+
+    def load(self, thmap, composites=None):
+        """
+        Annotate another map, the edit history and the log start over
+        :param thmap: ThematicMap to annotate
+        :param composites: optional ImageSet of its composites, the current ones are kept otherwise
+        """
+        self.thmap = thmap
+        if composites is not None:
+            self.composites = composites
+        self.history.clear()
+        self.log = []
+        self.started = time.monotonic()
+
+    def load_template(self, composites):
+        """
+        Annotate a new template made from composites, see create_thmap_template
+        :param composites: ImageSet of the composites
+        :return: the template
+        """
+        thmap = create_thmap_template(composites)
+        thmap.copy_195_metadata(composites)
+        self.load(thmap, composites)
+        return thmap
+
+    def lasso(self, verts, theme, coalesce=None):
+        """
+        Label every pixel inside a lasso
+        :param verts: (x, y) vertices of the lasso in pixel coordinates, x is the column and y the row
+        :param theme: index of the theme
+        :param coalesce: see EditHistory.record
+        :return: pair of slices bounding the pixels that could have changed
+        """
+        self._check_theme(theme)
+        window, inside = lasso_mask(verts, self.data.shape)
+        coalesce = self._edit(window, inside, theme, coalesce)
+        self._log('lasso', {'verts': np.asarray(verts, dtype=float).tolist(), 'theme': int(theme),
+                            'coalesce': coalesce})
+        return window
+
+    def fill(self, x, y, theme, coalesce=None):
+        """
+        Relabel the connected region of equal labels around a pixel
+        :param x: column of the pixel
+        :param y: row of the pixel
+        :param theme: index of the theme
+        :param coalesce: see EditHistory.record
+        :return: pair of slices bounding the region
+        """
+        self._check_theme(theme)
+        window, region = flood_fill_mask(self.data, (int(y), int(x)))
+        coalesce = self._edit(window, region, theme, coalesce)
+        self._log('fill', {'x': int(x), 'y': int(y), 'theme': int(theme), 'coalesce': coalesce})
+        return window
+
+    def boundary(self, x, y):
+        """
+        The outline of the connected region of equal labels around a pixel, the map is not changed
+        :param x: column of the pixel
+        :param y: row of the pixel
+        :return: lists of the outer rings and of the holes of the region, as (row, column) arrays
+        """
+        window, region = flood_fill_mask(self.data, (int(y), int(x)))
+        return region_contours(window, region)
+
+    def undo(self):
+        """
+        :return: pair of slices bounding the restored pixels, or None if there was nothing to undo
+        """
+        window = self.history.undo(self.data)
+        if window is not None:
+            self._log('undo', {})
+        return window
+
+    def redo(self):
+        """
+        :return: pair of slices bounding the changed pixels, or None if there was nothing to redo
+        """
+        window = self.history.redo(self.data)
+        if window is not None:
+            self._log('redo', {})
+        return window
+
+    def save(self, path, compression=None, tile_shape=None):
+        """
+        Save the map, stamped with the time of saving, see ThematicMap.save
+        :param path: where to save the FITS file
+        :param compression: optional tile compression algorithm
+        :param tile_shape: optional shape of the compression tiles
+        """
+        self.thmap.metadata['DATE'] = str(datetime.today())
+        self.thmap.save(path, compression, tile_shape)
+
+    def apply(self, operation):
+        """
+        Repeat one logged operation, with the same undo steps as when it was recorded
+        :param operation: Operation from log or read_log
+        :return: pair of slices bounding the pixels that could have changed, or None
+        """
+        arguments = operation.arguments
+        if operation.name == 'lasso':
+            return self.lasso(arguments['verts'], arguments['theme'], arguments.get('coalesce'))
+        if operation.name == 'fill':
+            return self.fill(arguments['x'], arguments['y'], arguments['theme'], arguments.get('coalesce'))
+        if operation.name == 'undo':
+            return self.undo()
+        if operation.name == 'redo':
+            return self.redo()
+        raise RuntimeError("Unknown operation {}, must be one of {}".format(operation.name, OPERATIONS))
+
+    def replay(self, operations):
+        """
+        Repeat logged operations as fast as they can be applied
+        :param operations: iterable of Operation
+        :return: number of operations applied
+        """
+        count = 0
+        for operation in operations:
+            self.apply(operation)
+            count += 1
+        return count
+
+    def _check_theme(self, theme):
+        if not 0 <= theme <= self.max_index:
+            raise RuntimeError("Theme {} must be between 0 and {}".format(theme, self.max_index))
+
+    def _edit(self, window, mask, theme, coalesce):
+        data = self.data
+        before = data[window].copy()
+        data[window][mask] = theme
+        if self.history.record(data, window, before, coalesce):
+            # remember whether it became its own undo step, so a replay undoes exactly the same steps
+            return self.history.undo_stack[-1].steps > 1
+        return False
+
+    def _log(self, name, arguments):
+        if self.record:
+            self.log.append(Operation(name, arguments, time.monotonic() - self.started))
+
+
+def write_log(path, operations):
+    """
+    Write operations as JSON lines
+    :param path: the log file
+    :param operations: iterable of Operation, e.g. AnnotationSession.log
+    """
+    with open(path, "w") as f:
+        for operation in operations:
+            f.write(json.dumps(operation._asdict()) + "\n")
+
+
+def read_log(path):
+    """
+    :param path: a log written by write_log
+    :return: list of Operation
+    """
+    with open(path) as f:
+        return [Operation(**json.loads(line)) for line in f if line.strip()]
+
+
+def replay_maps(operations, paths, output_directory, max_index=None, compression=None, report=print):
+    """
+    Apply the same operations to many thematic maps, e.g. a scripted correction
+    :param operations: list of Operation
+    :param paths: thematic map FITS files
+    :param output_directory: where the corrected maps are written, under their own names
+    :param max_index: largest label allowed, e.g. Config.max_index
+    :param compression: optional tile compression algorithm of the corrected maps
+    :param report: function called with a line for every map that could not be corrected
+    :return: dictionary with the lists of 'replayed' and 'failed' paths, and the 'operations' applied and the
+        'seconds' spent applying them
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    summary = {'replayed': [], 'failed': [], 'operations': 0, 'seconds': 0.0}
+    session = None
+    for path in paths:
+        try:
+            thmap = ThematicMap.load(path, max_index)
+            if session is None:
+                session = AnnotationSession(thmap, record=False)
+            else:
+                session.load(thmap)
+            start = time.perf_counter()
+            summary['operations'] += session.replay(operations)
+            summary['seconds'] += time.perf_counter() - start
+            session.save(os.path.join(output_directory, os.path.basename(path)), compression)
+        except Exception as e:
+            # e.g. a logged click outside a smaller map, one bad map must not stop the others
+            summary['failed'].append(path)
+            report("{} could not be corrected: {}: {}".format(path, type(e).__name__, e))
+        else:
+            summary['replayed'].append(path)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a log of annotation operations to thematic maps')
+    parser.add_argument('log', help='JSON lines log of operations, e.g. exported from the annotator')
+    parser.add_argument('maps', nargs='+', help='thematic map FITS files or glob patterns')
+    parser.add_argument('--output', required=True, help='directory the corrected maps are written to')
+    parser.add_argument('--max-index', type=int, help='largest theme index allowed')
+    parser.add_argument('--compression', choices=THEMATIC_MAP_COMPRESSION,
+                        help='tile compression of the corrected maps')
+    args = parser.parse_args()
+
+    paths = sorted(path for pattern in args.maps for path in (glob.glob(pattern) or [pattern]))
+    summary = replay_maps(read_log(args.log), paths, args.output, args.max_index, args.compression)
+    rate = summary['operations'] / summary['seconds'] if summary['seconds'] else 0
+    print("{} replayed, {} failed, {} operations at {:.0f} per second".format(
+        len(summary['replayed']), len(summary['failed']), summary['operations'], rate))
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
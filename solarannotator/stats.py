@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+from astropy.io import fits
+from concurrent.futures import ProcessPoolExecutor
+from skimage.measure import label
+import argparse
+import csv
+import glob
+import numpy as np
+import os
+import sys
+import tempfile
+import zipfile
+
+from .geometry import concentric_rings
+from .io import thematic_map_hdus, read_theme_mapping, as_labels
+from .reprojection import observation_time
+
+# zones of a map, split by the same disk and limb radii as create_thmap_template
+DISK, LIMB, OFF_DISK = 0, 1, 2
+DEFAULT_LIMB_THICKNESS = 10
+
+COLUMNS = ['path', 'date_obs', 'value', 'theme', 'pixels', 'disk_pixels', 'limb_pixels', 'off_disk_pixels',
+           'disk_fraction', 'regions', 'smallest_region', 'median_region', 'mean_region', 'largest_region']
+TEXT_COLUMNS = ('path', 'date_obs', 'theme')
+# rows of a .npz output kept in memory before they are written out, about a hundred maps
+CHUNK_ROWS = 1000
+
+
+def solar_geometry(metadata, solar_radius=None, limb_thickness=None):
+    """
+    The radii a map was made with: those recorded by create_thmap_template, otherwise half the solar diameter
+    :param metadata: header of the thematic map
+    :param solar_radius: optional radius in pixels that overrides the header
+    :param limb_thickness: optional limb thickness in pixels that overrides the header
+    :return: solar radius and limb thickness in pixels
+    """
+    if solar_radius is None:
+        if 'RSUN_PIX' in metadata:
+            solar_radius = metadata['RSUN_PIX']
+        elif 'DIAM_SUN' in metadata:
+            solar_radius = metadata['DIAM_SUN'] / 2
+        else:
+            raise RuntimeError("Header does not include the solar diameter or radius")
+    if limb_thickness is None:
+        limb_thickness = metadata.get('LIMB_PIX', DEFAULT_LIMB_THICKNESS)
+    return float(solar_radius), float(limb_thickness)
+
+
+def map_statistics(data, theme_mapping, solar_radius, limb_thickness=DEFAULT_LIMB_THICKNESS, connectivity=1):
+    """
+    Area and connected regions of every theme of a thematic map. The areas of all themes in all zones come from
+    one bincount, and the regions of all themes from one labeling of the map, since neighboring pixels of
+    different themes are never connected.
+    :param data: the labels of the map
+    :param theme_mapping: dictionary of theme indices to theme names, every theme gets a row even when absent
+    :param solar_radius: radius of the sun in pixels
+    :param limb_thickness: width of the limb in pixels, centered on the solar radius
+    :param connectivity: 1 connects pixels sharing an edge, like the flood fill of the annotator and
+        scipy.ndimage.label, 2 also those sharing a corner
+    :return: list of dictionaries with the columns of COLUMNS except path and date_obs, ordered by theme index
+    """
+    data = as_labels(data)
+    zones = concentric_rings(data.shape, [solar_radius - limb_thickness / 2, solar_radius + limb_thickness / 2],
+                             [DISK, LIMB, OFF_DISK], dtype=np.intp)
+    values = np.ravel(data).astype(np.intp)
+    length = max(int(values.max(initial=0)), max(theme_mapping, default=0)) + 1
+    areas = np.bincount(values * 3 + zones.ravel(), minlength=3 * length).reshape(length, 3)
+    disk_area = areas[:, DISK].sum()
+
+    # background=-1 keeps the unlabeled 0 pixels as regions too, so every region has a theme
+    regions, count = label(data, background=-1, connectivity=connectivity, return_num=True)
+    regions = regions.ravel()
+    region_sizes = np.bincount(regions, minlength=count + 1)[1:]
+    region_themes = np.empty(count + 1, dtype=np.intp)
+    region_themes[regions] = values
+    region_themes = region_themes[1:]
+    order = np.argsort(region_themes, kind='stable')
+    bounds = np.searchsorted(region_themes[order], np.arange(length + 1))
+
+    rows = []
+    for value in sorted(theme_mapping):
+        sizes = region_sizes[order[bounds[value]:bounds[value + 1]]]
+        disk, limb, off_disk = (int(area) for area in areas[value])
+        rows.append({'value': value,
+                     'theme': theme_mapping[value],
+                     'pixels': disk + limb + off_disk,
+                     'disk_pixels': disk,
+                     'limb_pixels': limb,
+                     'off_disk_pixels': off_disk,
+                     'disk_fraction': disk / disk_area if disk_area else np.nan,
+                     'regions': len(sizes),
+                     'smallest_region': int(sizes.min()) if len(sizes) else 0,
+                     'median_region': float(np.median(sizes)) if len(sizes) else 0.0,
+                     'mean_region': float(sizes.mean()) if len(sizes) else 0.0,
+                     'largest_region': int(sizes.max()) if len(sizes) else 0})
+    return rows
+
+
+def file_statistics(path, solar_radius=None, limb_thickness=None, connectivity=1):
+    """
+    Open a thematic map and compute its statistics, see map_statistics
+    :param path: path to the FITS file
+    :param solar_radius: optional radius in pixels that overrides the header
+    :param limb_thickness: optional limb thickness in pixels that overrides the header
+    :param connectivity: 1 connects pixels sharing an edge, 2 also those sharing a corner
+    :return: list of dictionaries with the columns of COLUMNS
+    """
+    with fits.open(path) as hdulist:
+        image_hdu, table_hdu = thematic_map_hdus(hdulist)
+        header = image_hdu.header
+        radius, thickness = solar_geometry(header, solar_radius, limb_thickness)
+        date_obs = observation_time(header)
+        rows = map_statistics(image_hdu.data, read_theme_mapping(table_hdu), radius, thickness, connectivity)
+    for row in rows:
+        row['path'] = path
+        row['date_obs'] = date_obs.isoformat() if date_obs is not None else ''
+    return rows
+
+
+def _file_statistics_or_error(path, solar_radius, limb_thickness, connectivity):
+    """ errors are returned instead of raised so one bad file cannot stop a summary """
+    try:
+        return path, file_statistics(path, solar_radius, limb_thickness, connectivity), None
+    except Exception as e:
+        return path, [], "{}: {}".format(type(e).__name__, e)
+
+
+class CSVWriter:
+    def __init__(self, path):
+        """
+        Writes statistics rows to a CSV file as they arrive
+        :param path: the CSV file
+        """
+        self.file = open(path, "w", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+        self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarWriter:
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        """
+        Writes statistics rows into one typed array per column, saved together as a .npz file, e.g. for
+        np.load(path)['disk_fraction']. Rows are written to temporary files in chunks as they arrive, and only
+        copied into the .npz file one chunk at a time when it is closed.
+        :param path: the .npz file
+        :param chunk_rows: number of rows kept in memory before they are written out
+        """
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.rows = []
+        self.length = 0
+        self.dtypes = {}
+        self.directory = tempfile.TemporaryDirectory(prefix="solarannotator_stats_")
+        self.files = {column: open(os.path.join(self.directory.name, column + ".npy"), "w+b") for column in COLUMNS}
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        for column in COLUMNS:
+            chunk = np.asarray([row[column] for row in self.rows], dtype=str if column in TEXT_COLUMNS else None)
+            self.dtypes[column] = np.result_type(self.dtypes[column], chunk) if column in self.dtypes else chunk.dtype
+            np.save(self.files[column], chunk)
+        self.length += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        try:
+            self.flush()
+            with zipfile.ZipFile(self.path, "w", allowZip64=True) as archive:
+                for column in COLUMNS:
+                    self._copy_column(archive, column)
+        finally:
+            for f in self.files.values():
+                f.close()
+            self.directory.cleanup()
+
+    def _copy_column(self, archive, column):
+        # the same layout as np.savez, written without holding the whole column in memory
+        dtype = self.dtypes.get(column, np.dtype(str if column in TEXT_COLUMNS else float))
+        source = self.files[column]
+        source.seek(0)
+        with archive.open(column + ".npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                     'fortran_order': False, 'shape': (self.length,)})
+            read = 0
+            while read < self.length:
+                chunk = np.load(source)
+                f.write(chunk.astype(dtype).tobytes())
+                read += len(chunk)
+
+
+def summarize(paths, output, processes=4, solar_radius=None, limb_thickness=None, connectivity=1, report=print):
+    """
+    Compute the statistics of many thematic maps with a pool of worker processes
+    :param paths: paths of the FITS files
+    :param output: a .csv file, written row by row, or a .npz file with one array per column, written in chunks
+    :param processes: number of worker processes, 1 computes everything in this process
+    :param solar_radius: optional radius in pixels that overrides the headers
+    :param limb_thickness: optional limb thickness in pixels that overrides the headers
+    :param connectivity: 1 connects pixels sharing an edge, 2 also those sharing a corner
+    :param report: function called with a line for every file that could not be read
+    :return: dictionary with the lists of 'summarized' and 'failed' paths
+    """
+    writer = ColumnarWriter(output) if output.endswith(".npz") else CSVWriter(output)
+    summary = {'summarized': [], 'failed': []}
+    paths = list(paths)
+    arguments = (paths, [solar_radius] * len(paths), [limb_thickness] * len(paths), [connectivity] * len(paths))
+    try:
+        if processes <= 1:
+            for path, rows, error in map(_file_statistics_or_error, *arguments):
+                _record(writer, summary, path, rows, error, report)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                # results come back in order, a few maps per task keeps the workers busy without much overhead
+                chunksize = max(1, min(16, len(paths) // (4 * processes)))
+                for path, rows, error in executor.map(_file_statistics_or_error, *arguments, chunksize=chunksize):
+                    _record(writer, summary, path, rows, error, report)
+    finally:
+        writer.close()
+    return summary
+
+
+def _record(writer, summary, path, rows, error, report):
+    if error is None:
+        writer.write(rows)
+        summary['summarized'].append(path)
+    else:
+        summary['failed'].append(path)
+        report("{} could not be summarized: {}".format(path, error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the area and regions of every theme of thematic maps')
+    parser.add_argument('directory', help='directory of thematic map FITS files')
+    parser.add_argument('--pattern', default='*.fits', help='glob pattern of the files to include')
+    parser.add_argument('--output', default='statistics.csv',
+                        help='a .csv file, or a .npz file with one array per column (default statistics.csv)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--solar-radius', type=float, help='solar radius in pixels, overrides the headers')
+    parser.add_argument('--limb-thickness', type=float, help='limb thickness in pixels, overrides the headers')
+    parser.add_argument('--connectivity', type=int, choices=[1, 2], default=1,
+                        help='1 connects regions through edges only, like the flood fill of the annotator '
+                             '(default), 2 also through corners')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, args.pattern)))
+    summary = summarize(paths, args.output, args.processes, args.solar_radius, args.limb_thickness,
+                        args.connectivity)
+    print("{} summarized, {} failed".format(len(summary['summarized']), len(summary['failed'])))
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+
+from .profiling import profiled
+
+
+def power_scale(values, scale, out=None):
+    """
+    Raise the magnitude of values to a power while keeping their sign, the preview's contrast transform
+    :param values: array or number
+    :param scale: the power, at least 0 keeps the order of the values
+    :param out: optional array to write into
+    :return: sign(values) * |values| ** scale
+    """
+    if scale == 0:
+        return np.sign(values, out=out)
+    out = np.abs(values, out=out)
+    np.power(out, scale, out=out)
+    return np.copysign(out, values, out=out)
+
+
+@profiled()
+def sorted_finite(data):
+    """
+    :param data: image
+    :return: the values of the image that are not NaN, sorted, as float64
+    """
+    values = np.asarray(data, dtype=float).ravel()
+    return np.sort(values[~np.isnan(values)])
+
+
+def percentile_from_sorted(sorted_values, percentile, scale=1.0):
+    """
+    Look up a percentile of power_scale(image, scale) from the sorted values of the image, with the linear
+    interpolation of np.nanpercentile. The transform keeps the order of the values, so the neighbors around the
+    percentile are the same before and after it and only those two need transforming.
+    :param sorted_values: output of sorted_finite
+    :param percentile: percentile between 0 and 100
+    :param scale: the power of power_scale, at least 0
+    :return: the percentile, NaN if the image has no finite values
+    """
+    if len(sorted_values) == 0:
+        return np.nan
+    position = percentile / 100 * (len(sorted_values) - 1)
+    below = min(int(np.floor(position)), len(sorted_values) - 1)
+    above = min(below + 1, len(sorted_values) - 1)
+    fraction = position - below
+    low, high = power_scale(sorted_values[[below, above]], scale)
+    # numpy interpolates from whichever neighbor is closer
+    if fraction >= 0.5:
+        return high - (high - low) * (1 - fraction)
+    return low + (high - low) * fraction
+
+
+@profiled()
+def stretch_image(data, lower_percentile, upper_percentile, scale, sorted_values=None, out=None):
+    """
+    Prepare an image for display: power scale it, clip it to two percentiles, and normalize it to [0, 1]
+    :param data: image
+    :param lower_percentile: percentile mapped to 0
+    :param upper_percentile: percentile mapped to 1
+    :param scale: the power of power_scale
+    :param sorted_values: optional output of sorted_finite for the image, computed when missing
+    :param out: optional float32 array with the shape of the image to write into
+    :return: float32 image, NaN where the input is NaN
+    """
+    if out is None:
+        out = np.empty(np.shape(data), dtype=np.float32)
+    power_scale(data, scale, out=out)
+    if scale >= 0:
+        if sorted_values is None:
+            sorted_values = sorted_finite(data)
+        lower = percentile_from_sorted(sorted_values, lower_percentile, scale)
+        upper = percentile_from_sorted(sorted_values, upper_percentile, scale)
+    else:  # the order of the values is not kept, so the percentiles need the transformed image
+        lower, upper = np.nanpercentile(out, [lower_percentile, upper_percentile])
+
+    # raising to the lower percentile first and then lowering to the upper one leaves these as the extremes
+    np.maximum(out, lower, out=out)
+    np.minimum(out, upper, out=out)
+    smallest, largest = min(lower, upper), upper
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.subtract(out, smallest, out=out)
+        np.divide(out, largest - smallest, out=out)
+    return out
+
+
+class StretchCache:
+    def __init__(self, max_results=8):
+        """
+        Remembers the sorted values of every channel shown, so new percentile bounds are looked up instead of
+        sorted again, and the most recent stretched images, so returning to earlier settings costs nothing.
+        Images that fall out of the memo are reused as output buffers.
+        :param max_results: how many stretched images to keep, at least 2
+        """
+        self.max_results = max(max_results, 2)
+        self._sorted = {}
+        self._results = OrderedDict()
+        self._spare = []
+        # previews are stretched both on and off the GUI thread, hold the lock while reading a result on another
+        # thread so its buffer cannot be reused in the meantime
+        self.lock = threading.RLock()
+
+    def clear(self):
+        """ forget every channel, e.g. when new composites are loaded """
+        with self.lock:
+            self._sorted = {}
+            self._results = OrderedDict()
+            self._spare = []
+
+    def sorted_values(self, channel, data):
+        """
+        :param channel: channel name
+        :param data: image of the channel
+        :return: the sorted finite values of the image, sorted only the first time the image is seen
+        """
+        with self.lock:
+            entry = self._sorted.get(channel)
+            if entry is None or entry[0] is not data:
+                entry = data, sorted_finite(data)
+                self._sorted[channel] = entry
+            return entry[1]
+
+    def stretch(self, channel, data, lower_percentile, upper_percentile, scale):
+        """
+        Stretch a channel for display, see stretch_image
+        :param channel: channel name
+        :param data: image of the channel
+        :param lower_percentile: percentile mapped to 0
+        :param upper_percentile: percentile mapped to 1
+        :param scale: the power of power_scale
+        :return: float32 image, shared with the cache so it must not be modified
+        """
+        key = (channel, float(lower_percentile), float(upper_percentile), float(scale))
+        with self.lock:
+            if key in self._results and self._results[key][0] is data:
+                self._results.move_to_end(key)
+                return self._results[key][1]
+
+            out = self._buffer(np.shape(data))
+            sorted_values = self.sorted_values(channel, data) if scale >= 0 else None
+            stretch_image(data, lower_percentile, upper_percentile, scale, sorted_values, out)
+            self._results[key] = data, out
+            while len(self._results) > self.max_results:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self._spare.append(evicted)
+            return out
+
+    def _buffer(self, shape):
+        while self._spare:
+            buffer = self._spare.pop()
+            if buffer.shape == shape:
+                return buffer
+        return np.empty(shape, dtype=np.float32)
+
+
+@profiled()
+def three_color_composite(channels, images, lower_percentiles, upper_percentiles, scales, stretch_cache=None):
+    """
+    Stack three stretched channels into an RGB image
+    :param channels: names of the red, green, and blue channels, the same channel may appear more than once
+    :param images: the three images, in the same order
+    :param lower_percentiles: percentile mapped to 0 for each channel
+    :param upper_percentiles: percentile mapped to 1 for each channel
+    :param scales: power of power_scale for each channel
+    :param stretch_cache: optional StretchCache, so only channels whose settings changed are stretched again
+    :return: float32 array of shape (rows, columns, 3)
+    """
+    if len(channels) != 3 or len(images) != 3:
+        raise RuntimeError("A three color composite needs exactly three channels")
+    composite = np.empty(np.shape(images[0]) + (3,), dtype=np.float32)
+    for index, (channel, data, lower, upper, scale) in enumerate(zip(channels, images, lower_percentiles,
+                                                                    upper_percentiles, scales)):
+        if stretch_cache is None:
+            composite[:, :, index] = stretch_image(data, lower, upper, scale)
+        else:
+            with stretch_cache.lock:
+                composite[:, :, index] = stretch_cache.stretch(channel, data, lower, upper, scale)
+    return composite
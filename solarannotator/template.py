@@ -1,7 +1,10 @@
-from solarannotator.io import ImageSet, ThematicMap
+from solarannotator.io import ImageSet, ThematicMap, LABEL_DTYPE
+from solarannotator.profiling import profiled
 from datetime import datetime, timedelta
 import numpy as np
 
+from solarannotator.geometry import within_radius, concentric_rings
+
 
 def create_mask(radius, image_size):
     """
@@ -9,31 +12,11 @@ def create_mask(radius, image_size):
         - Radius: Radius (pixels) within which a certain theme should be assigned
         - Image size: tuple of (x, y) size (pixels) that represents size of image
     """
-    # Define image center
-    center_x = (image_size[0] / 2) - 0.5
-    center_y = (image_size[1] / 2) - 0.5
-
-    # Create mesh grid of image coordinates
-    xm, ym = np.meshgrid(np.linspace(0, image_size[0] - 1, num=image_size[0]),
-                         np.linspace(0, image_size[1] - 1, num=image_size[1]))
-
-    # Center each mesh grid (zero at the center)
-    xm_c = xm - center_x
-    ym_c = ym - center_y
-
-    # Create array of radii
-    rad = np.sqrt(xm_c ** 2 + ym_c ** 2)
-
-    # Create empty mask of same size as the image
-    mask = np.zeros((image_size[0], image_size[1]))
-
-    # Apply the mask as true for anything within a radius
-    mask[(rad < radius)] = 1
-
-    # Return the mask
-    return mask.astype('bool')
+    # True for anything within a radius of the image center, using the shared radius grid
+    return within_radius(tuple(image_size), radius)
 
 
+@profiled()
 def create_thmap_template(image_set, limb_thickness=10):
     """
     Input: Image set object as input, and limb thickness in pixels
@@ -54,21 +37,18 @@ def create_thmap_template(image_set, limb_thickness=10):
     disk_radius = solar_radius - (limb_thickness / 2)
     limb_radius = solar_radius + (limb_thickness / 2)
 
-    # Create concentric layers for disk, limb, and outer space
-    # First template layer, outer space (value 1) with same size as composites
+    # Create concentric layers for disk (quiet sun, value 7), limb (value 8), and outer space (value 1)
+    # with same size as composites, in one pass
     imagesize = np.shape(image_set['171'].data)
-    thmap_data = np.ones(imagesize)
-    # Mask out the limb (value 8)
-    limb_mask = create_mask(limb_radius, imagesize)
-    thmap_data[limb_mask] = 8
-    # Mask out the disk with quiet sun (value 7)
-    qs_mask = create_mask(disk_radius, imagesize)
-    thmap_data[qs_mask] = 7
+    thmap_data = concentric_rings(imagesize, [disk_radius, limb_radius], [7, 8, 1], dtype=LABEL_DTYPE)
 
     # Create a thematic map object with this data and return it
     theme_mapping = {1: 'outer_space', 3: 'bright_region', 4: 'filament', 5: 'prominence', 6: 'coronal_hole',
                      7: 'quiet_sun', 8: 'limb', 9: 'flare'}
-    thmap_template = ThematicMap(thmap_data, {'DATE-OBS': image_set['171'].header['DATE-OBS']}, theme_mapping)
+    # the radii are recorded so statistics can later split the map into disk, limb, and off disk the same way
+    thmap_template = ThematicMap(thmap_data, {'DATE-OBS': image_set['171'].header['DATE-OBS'],
+                                              'RSUN_PIX': float(np.squeeze(solar_radius)),
+                                              'LIMB_PIX': float(limb_thickness)}, theme_mapping)
 
     # Return the thematic map object
     return thmap_template
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+import json
+import numpy as np
+import os
+import pytest
+
+from solarannotator import batch
+from solarannotator.io import ImageSet, Image, RetrievalError, ThematicMap
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "..", "cfg", "default.json")
+
+HEADER = {'DIAM_SUN': 200.0, 'YAW_FLIP': 0, 'ECLIPSE': 0, 'WCSNAME': 'HPLN-TAN', 'CTYPE1': 'HPLN-TAN',
+          'CTYPE2': 'HPLT-TAN', 'CUNIT1': 'arcsec', 'CUNIT2': 'arcsec', 'PC1_1': 1.0, 'PC1_2': 0.0, 'PC2_1': 0.0,
+          'PC2_2': 1.0, 'CDELT1': 2.5, 'CDELT2': 2.5, 'CRVAL1': 0.0, 'CRVAL2': 0.0, 'CRPIX1': 128.5,
+          'CRPIX2': 128.5, 'LONPOLE': 180.0, 'CROTA': 0.0, 'SOLAR_B0': 0.0, 'ORIENT': 'UP', 'DSUN_OBS': 1.5e11}
+
+
+@pytest.fixture
+def fake_retrieve(monkeypatch):
+    def retrieve(date, **kwargs):
+        if date.hour == 6:
+            raise RetrievalError(date, {"131": "no data"})
+        header = dict(HEADER, **{'DATE-OBS': date.isoformat()})
+        return ImageSet({channel: Image(np.ones((256, 256)), header) for channel in ['171', '195', '304']})
+
+    monkeypatch.setattr(ImageSet, "retrieve", staticmethod(retrieve))
+    monkeypatch.setattr(batch.Config, "create_cache", lambda self: None)
+    monkeypatch.setattr(batch.Config, "create_reprojection_cache", lambda self: None)
+
+
+def test_template_dates():
+    dates = batch.template_dates(datetime(2023, 1, 1), datetime(2023, 1, 1, 12), timedelta(hours=6))
+    assert dates == [datetime(2023, 1, 1, hour) for hour in (0, 6, 12)]
+    with pytest.raises(RuntimeError):
+        batch.template_dates(datetime(2023, 1, 1), datetime(2023, 1, 2), timedelta(0))
+
+
+def test_parse_cadence():
+    assert batch.parse_cadence("90s") == timedelta(seconds=90)
+    assert batch.parse_cadence("6h") == timedelta(hours=6)
+    assert batch.parse_cadence("15") == timedelta(minutes=15)
+
+
+def test_batch_writes_logs_and_resumes(fake_retrieve, tmp_path):
+    dates = batch.template_dates(datetime(2023, 1, 1), datetime(2023, 1, 1, 12), timedelta(hours=6))
+    summary = batch.run_batch(dates, str(tmp_path), CONFIG_PATH, processes=1, report=lambda line: None)
+    assert summary['written'] == [dates[0], dates[2]]
+    assert summary['failed'] == [dates[1]]
+    assert sorted(os.listdir(tmp_path)) == ["failures.jsonl", "thmap_20230101T000000.fits",
+                                            "thmap_20230101T120000.fits"]
+
+    thmap = ThematicMap.load(batch.output_path(str(tmp_path), dates[0]))
+    assert thmap.data[128, 128] == 7 and thmap.data[0, 0] == 1
+    assert thmap.metadata['CRPIX1'] == 128.5
+
+    with open(tmp_path / "failures.jsonl") as f:
+        entry = json.loads(f.readline())
+    assert entry['date'] == dates[1].isoformat()
+    assert entry['failures'] == {"131": "no data"}
+
+    # a second run only retries the failure, or nothing when failures are skipped
+    summary = batch.run_batch(dates, str(tmp_path), CONFIG_PATH, processes=1, report=lambda line: None)
+    assert summary['skipped'] == [dates[0], dates[2]] and summary['failed'] == [dates[1]]
+    summary = batch.run_batch(dates, str(tmp_path), CONFIG_PATH, processes=1, skip_failed=True,
+                              report=lambda line: None)
+    assert summary['skipped'] == dates
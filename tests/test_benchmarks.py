@@ -0,0 +1,45 @@
+import gc
+import glob
+import numpy as np
+import os
+import tempfile
+
+from benchmarks.run import BENCHMARKS, run_benchmarks, compare, time_call
+from benchmarks.synthetic import limb_darkened_disk, synthetic_labels, solar_radius
+
+
+def test_disk_is_limb_darkened():
+    image = limb_darkened_disk(256, noise=0, seed=1)
+    center, radius = 128, solar_radius(256)
+    assert image[center, center + int(0.95 * radius)] < image[center, center + int(0.2 * radius)]
+    assert image[center, center + int(1.2 * radius)] < image[center, center + int(0.95 * radius)]
+
+
+def test_every_benchmark_runs():
+    results = run_benchmarks([128], repeat=1, min_time=0, report=lambda line: None)
+    assert sorted(results) == sorted("{}/128".format(name) for name in BENCHMARKS)
+    assert all(timing['min'] > 0 for timing in results.values())
+
+
+def test_round_trip_benchmarks_remove_their_files():
+    pattern = os.path.join(tempfile.gettempdir(), "solarannotator_benchmark_*")
+    before = set(glob.glob(pattern))
+    for name in ("save_load", "save_load_compressed"):
+        time_call(BENCHMARKS[name](64), repeat=1, min_time=0)
+    gc.collect()
+    assert set(glob.glob(pattern)) == before
+
+
+def test_synthetic_labels_hold_only_template_and_region_themes():
+    labels = synthetic_labels(128)
+    assert labels.dtype == np.uint8
+    assert set(np.unique(labels)) <= {1, 4, 6, 7, 8}
+
+
+def test_compare_flags_only_large_slowdowns():
+    baseline = {'threshold': 1.3, 'results': {'fast/1280': {'min': 0.0001}, 'slow/1280': {'min': 0.1},
+                                              'steady/1280': {'min': 0.1}}}
+    results = {'fast/1280': {'min': 0.0002}, 'slow/1280': {'min': 0.2}, 'steady/1280': {'min': 0.12},
+               'new/1280': {'min': 1.0}}
+    assert [key for key, _, _, _ in compare(results, baseline)] == ['slow/1280']
+    assert [key for key, _, _, _ in compare(results, baseline, threshold=1.1)] == ['slow/1280', 'steady/1280']
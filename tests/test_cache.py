@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+from astropy.io import fits
+import numpy as np
+import pytest
+
+from solarannotator.cache import CompositeCache, verify_checksums
+
+
+def write_fits(path, shape=(32, 32)):
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(np.random.random(shape))]).writeto(path, checksum=True)
+    return str(path)
+
+
+def test_lookup_within_tolerance(tmp_path):
+    cache = CompositeCache(str(tmp_path / "cache"))
+    obs_time = datetime(2023, 1, 1, 12, 1, 30)
+    stored = cache.store("GOES16", "suvi_l2_ci195", obs_time, write_fits(tmp_path / "a.fits"))
+    assert cache.lookup("GOES16", "suvi_l2_ci195", datetime(2023, 1, 1, 12)) == stored
+    assert cache.get("GOES16", "suvi_l2_ci195", obs_time) == stored
+    assert cache.lookup("GOES16", "suvi_l2_ci195", datetime(2023, 1, 1, 13)) is None
+    assert cache.lookup("GOES16", "suvi_l2_ci171", datetime(2023, 1, 1, 12)) is None
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    first = write_fits(tmp_path / "first.fits")
+    cache = CompositeCache(str(tmp_path / "cache"), max_bytes=2.5 * (tmp_path / "first.fits").stat().st_size)
+    start = datetime(2023, 1, 1)
+    for i, name in enumerate(["first", "second", "third"]):
+        path = first if name == "first" else write_fits(tmp_path / "{}.fits".format(name))
+        cache.store("GOES16", "suvi_l2_ci195", start + timedelta(hours=i), path)
+    assert cache.get("GOES16", "suvi_l2_ci195", start) is None
+    assert cache.get("GOES16", "suvi_l2_ci195", start + timedelta(hours=2)) is not None
+
+
+def test_corrupt_download_is_rejected(tmp_path):
+    path = write_fits(tmp_path / "a.fits")
+    contents = bytearray(open(path, "rb").read())
+    contents[-10] ^= 0xFF
+    open(path, "wb").write(contents)
+    assert not verify_checksums(path)
+
+    cache = CompositeCache(str(tmp_path / "cache"))
+    with pytest.raises(RuntimeError):
+        cache.store("GOES16", "suvi_l2_ci195", datetime(2023, 1, 1), path)
+    assert cache.size() == 0
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+import os
+import time
+import numpy as np
+import pytest
+
+from solarannotator.catalog import Catalog, read_catalog_entry
+from solarannotator.io import ThematicMap
+
+START = datetime(2023, 1, 1)
+THEME_MAPPING = {1: 'outer_space', 2: 'quiet_sun', 3: 'flare'}
+
+
+def write_map(directory, index, flare_pixels=0):
+    data = np.full((32, 32), 2, dtype=np.uint8)
+    data[:4] = 1
+    data.ravel()[-flare_pixels:] = 3 if flare_pixels else 2
+    path = str(directory / "map_{:02d}.fits".format(index))
+    ThematicMap(data, {'DATE-OBS': (START + index * timedelta(hours=6)).isoformat(),
+                       'DATE': (START + timedelta(days=30 + index)).isoformat()},
+                THEME_MAPPING).save(path, compression="GZIP_2" if index % 2 else None)
+    return path
+
+
+@pytest.fixture
+def archive(tmp_path):
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    for index in range(6):
+        write_map(directory, index, flare_pixels=10 * index if index in (2, 4) else 0)
+    return directory
+
+
+def test_entry_counts_every_label(archive):
+    entry = read_catalog_entry(str(archive / "map_02.fits"))
+    assert entry['counts'] == {1: 128, 2: 1024 - 128 - 20, 3: 20}
+    assert entry['date_obs'] == (START + timedelta(hours=12)).isoformat()
+    assert entry['theme_mapping'] == THEME_MAPPING
+
+
+def test_find_by_date_and_content(archive, tmp_path):
+    with Catalog(str(tmp_path / "catalog.sqlite")) as catalog:
+        assert len(catalog.update(str(archive))['added']) == 6
+        paths = [str(archive / "map_{:02d}.fits".format(i)) for i in range(6)]
+        assert catalog.find() == paths
+        assert catalog.find(start=START + timedelta(hours=6), end=START + timedelta(hours=12)) == paths[1:3]
+        assert catalog.find(saved_after=START + timedelta(days=34)) == paths[4:]
+        assert catalog.find(containing='flare') == [paths[2], paths[4]]
+        assert catalog.find(containing=3, min_pixels=30) == [paths[4]]
+        assert catalog.find(containing='flare', end=START + timedelta(hours=18)) == [paths[2]]
+        assert catalog.pixel_counts(paths[4]) == {'outer_space': 128, 'quiet_sun': 856, 'flare': 40}
+
+
+def test_update_skips_unchanged_files(archive, tmp_path, monkeypatch):
+    with Catalog(str(tmp_path / "catalog.sqlite")) as catalog:
+        catalog.update(str(archive))
+        os.remove(str(archive / "map_05.fits"))
+        time.sleep(0.01)
+        changed = write_map(archive, 0, flare_pixels=5)
+
+        opened = []
+        monkeypatch.setattr("solarannotator.catalog.read_catalog_entry",
+                            lambda path: opened.append(path) or read_catalog_entry(path))
+        summary = catalog.update(str(archive))
+        assert opened == [changed]
+        assert summary['updated'] == [changed]
+        assert len(summary['unchanged']) == 4
+        assert summary['removed'] == [str(archive / "map_05.fits")]
+        assert len(catalog) == 5
+        assert changed in catalog.find(containing='flare')
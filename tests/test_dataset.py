@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+
+from solarannotator.dataset import ThematicMapDataset, scan_archive
+from solarannotator.io import ThematicMap
+
+START = datetime(2023, 1, 1)
+THEME_MAPPING = {1: 'outer_space', 2: 'quiet_sun', 3: 'filament'}
+
+
+def write_map(directory, index, theme_mapping=THEME_MAPPING, shape=(16, 16), compression=None):
+    date = START + index * timedelta(hours=6)
+    data = np.full(shape, index % 4, dtype=np.uint8)
+    # named out of date order, so the scan has to sort by the header
+    path = str(directory / "map_{:02d}.fits".format((7 * index) % 10))
+    ThematicMap(data, {'DATE-OBS': date.isoformat()}, theme_mapping).save(path, compression=compression)
+    return date
+
+
+@pytest.fixture
+def archive(tmp_path):
+    directory = tmp_path / "archive"
+    directory.mkdir()
+    for index in range(10):
+        write_map(directory, index, compression="GZIP_2" if index % 2 else None)
+    return directory
+
+
+def test_scan_sorts_by_observation_time(archive):
+    entries = scan_archive(str(archive))
+    assert [entry['date'] for entry in entries] == [START + i * timedelta(hours=6) for i in range(10)]
+    assert all(entry['shape'] == (16, 16) for entry in entries)
+
+
+def test_build_stacks_maps_into_a_memory_mapped_cube(archive, tmp_path):
+    dataset = ThematicMapDataset.build(str(archive), str(tmp_path / "dataset"))
+    assert len(dataset) == 10
+    assert dataset.labels.dtype == np.uint8
+    assert isinstance(dataset.labels, np.memmap)
+    assert dataset.theme_mapping == THEME_MAPPING
+    for i in range(10):
+        assert np.all(dataset[i] == i % 4)
+        np.testing.assert_array_equal(dataset.thematic_map(i).data, ThematicMap.load(dataset.paths[i]).data)
+
+    reopened = ThematicMapDataset.load(str(tmp_path / "dataset"))
+    assert reopened.dates == dataset.dates
+    assert reopened.paths == dataset.paths
+
+
+def test_select_by_date_range(archive, tmp_path):
+    dataset = ThematicMapDataset.build(str(archive), str(tmp_path / "dataset"))
+    batch = dataset.select(START + timedelta(hours=6), START + timedelta(hours=18))
+    assert batch.dates == [START + i * timedelta(hours=6) for i in (1, 2, 3)]
+    assert [labels[0, 0] for labels in batch.labels] == [1, 2, 3]
+    assert len(dataset.select(START - timedelta(days=2), START - timedelta(days=1)).labels) == 0
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_batches_cover_the_range_once(archive, tmp_path, shuffle):
+    dataset = ThematicMapDataset.build(str(archive), str(tmp_path / "dataset"))
+    batches = list(dataset.batches(4, start=START + timedelta(hours=6), shuffle=shuffle, seed=3))
+    assert [len(batch.dates) for batch in batches] == [4, 4, 1]
+    dates = [date for batch in batches for date in batch.dates]
+    assert sorted(dates) == dataset.dates[1:]
+    for batch in batches:
+        for labels, date in zip(batch.labels, batch.dates):
+            assert np.all(labels == dataset.dates.index(date) % 4)
+
+
+def test_incompatible_maps_are_rejected_or_skipped(archive, tmp_path):
+    write_map(archive, 10, theme_mapping={1: 'outer_space', 2: 'bright_region'})
+    with pytest.raises(RuntimeError):
+        ThematicMapDataset.build(str(archive), str(tmp_path / "dataset"), theme_mapping=THEME_MAPPING)
+    dataset = ThematicMapDataset.build(str(archive), str(tmp_path / "dataset"), theme_mapping=THEME_MAPPING,
+                                       skip_incompatible=True)
+    assert len(dataset) == 9
@@ -0,0 +1,29 @@
+import numpy as np
+
+from solarannotator.geometry import radial_distance, enclosed_means, refine_solar_radius
+
+
+def limb_darkened_disk(size, radius):
+    distance = radial_distance((size, size))
+    mu = np.sqrt(np.clip(1 - (distance / radius) ** 2, 0, 1))
+    return np.where(distance < radius, 0.4 + 0.6 * mu, 0.05 * np.exp(-(distance - radius) / 20))
+
+
+def test_enclosed_means_match_masked_means():
+    image = np.random.default_rng(0).random((64, 64))
+    radii = [30.2, 3.5, 17.0, 12.75]
+    expected = [np.mean(np.where(radial_distance(image.shape) <= r, image, 0)) for r in radii]
+    assert np.allclose(enclosed_means(image, radii), expected)
+
+
+def test_refined_radius_matches_layered_estimate():
+    image = limb_darkened_disk(256, 80)
+    radius = 70.0
+
+    # the layer by layer computation get_solar_radius used to do
+    rad_iterate = np.linspace(radius, radius + 50, num=15)
+    img_avgs = [np.mean(np.where(rad >= radial_distance(image.shape), image, 0)) for rad in rad_iterate]
+    diff_avgs = np.asarray(img_avgs[0:14]) - np.asarray(img_avgs[1:15])
+    expected = rad_iterate[np.atleast_1d(np.amax(diff_avgs)).nonzero()[0] + 1]
+
+    assert np.array_equal(refine_solar_radius(image, radius), expected)
@@ -0,0 +1,65 @@
+import numpy as np
+
+from solarannotator.history import EditHistory
+
+
+def edit(history, array, window, value):
+    before = array[window].copy()
+    array[window] = value
+    history.record(array, window, before)
+
+
+def test_undo_and_redo_restore_states():
+    history = EditHistory(coalesce_pixels=0)
+    array = np.zeros((32, 32), dtype=np.uint8)
+    states = [array.copy()]
+    for i, window in enumerate([np.s_[2:10, 3:7], np.s_[5:20, 5:20], np.s_[0:1, :]]):
+        edit(history, array, window, i + 1)
+        states.append(array.copy())
+
+    for state in states[-2::-1]:
+        history.undo(array)
+        assert np.array_equal(array, state)
+    assert history.undo(array) is None
+    for state in states[1:]:
+        history.redo(array)
+        assert np.array_equal(array, state)
+
+
+def test_memory_grows_with_edited_pixels():
+    history = EditHistory(coalesce_pixels=0)
+    array = np.zeros((1280, 1280))
+    edit(history, array, np.s_[10:20, 10:20], 3)
+    assert history.nbytes == 100 * (4 + 8 + 8)
+
+
+def test_memory_ceiling_drops_oldest_edits():
+    history = EditHistory(max_bytes=1000, coalesce_pixels=0)
+    array = np.zeros((64, 64), dtype=np.uint8)
+    for i in range(10):
+        edit(history, array, np.s_[i:i + 1, :], i + 1)
+    assert history.nbytes <= 1000
+    assert len(history) < 10
+    history.undo(array)
+    assert not np.any(array[9])
+
+
+def test_small_consecutive_edits_coalesce():
+    history = EditHistory(coalesce_pixels=16, coalesce_seconds=60)
+    array = np.zeros((8, 8), dtype=np.uint8)
+    edit(history, array, np.s_[0:1, 0:2], 1)
+    edit(history, array, np.s_[0:1, 1:3], 2)
+    assert len(history) == 1
+    history.undo(array)
+    assert not np.any(array)
+    history.redo(array)
+    assert list(array[0, :4]) == [1, 2, 2, 0]
+
+
+def test_new_edit_clears_redo():
+    history = EditHistory(coalesce_pixels=0)
+    array = np.zeros((8, 8), dtype=np.uint8)
+    edit(history, array, np.s_[0:1, :], 1)
+    history.undo(array)
+    edit(history, array, np.s_[1:2, :], 2)
+    assert history.redo(array) is None
@@ -0,0 +1,229 @@
+from astropy.io import fits
+from datetime import datetime
+from functools import partial
+import mmap
+import os
+import threading
+import time
+import numpy as np
+import pytest
+
+from solarannotator import profiling
+from solarannotator.cache import verify_checksums
+from solarannotator.io import ImageSet, Image, LazyImage, RetrievalError, RetrievalCancelled, SUVI_PRODUCTS, CHANNELS, \
+    ThematicMap, read_fits_image, as_labels, theme_mappings_match, LABEL_DTYPE
+
+
+@pytest.fixture
+def fake_network(monkeypatch):
+    def load_suvi_composite(date, wavelength, cache=None):
+        if wavelength == "131":
+            raise RuntimeError("Data does not exist for the time {}".format(date))
+        return Image(np.full((4, 4), float(wavelength)), {'WAVELNTH': wavelength})
+
+    def fetch_gong_image(date, cache=None):
+        return Image(np.ones((4, 4)), {})
+
+    def reproject_gong_image(gong_image, suvi_195_image, reprojection_cache=None):
+        return Image(gong_image.data * suvi_195_image.data, {})
+
+    monkeypatch.setattr(ImageSet, "_load_suvi_composite", staticmethod(load_suvi_composite))
+    monkeypatch.setattr(ImageSet, "_fetch_gong_image", staticmethod(fetch_gong_image))
+    monkeypatch.setattr(ImageSet, "_reproject_gong_image", staticmethod(reproject_gong_image))
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_retrieve_reports_failed_channels(fake_network, concurrent):
+    with pytest.raises(RetrievalError) as error:
+        ImageSet.retrieve(datetime(2023, 1, 1), concurrent=concurrent)
+    assert list(error.value.failures) == ["131"]
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_retrieve_allows_partial(fake_network, concurrent):
+    image_set = ImageSet.retrieve(datetime(2023, 1, 1), concurrent=concurrent, allow_partial=True)
+    assert set(image_set.channels()) == set(SUVI_PRODUCTS) | {"gong"}
+    assert list(image_set.failures) == ["131"]
+    assert np.all(image_set["gong"].data == 195)
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_retrieve_profiles_gong(fake_network, concurrent):
+    profiling.enable(trace_memory=False)
+    try:
+        ImageSet.retrieve(datetime(2023, 1, 1), concurrent=concurrent, allow_partial=True)
+        gong = [record for record in profiling.records() if record.name == "ImageSet._load_gong_image"]
+    finally:
+        profiling.disable()
+    assert len(gong) == 1
+    assert gong[0].details == {'channel': 'gong'}
+
+
+def test_channels_are_read_on_first_access():
+    reads = []
+
+    def loader(channel):
+        reads.append(channel)
+        return Image(np.full((4, 4), float(channel)), {'WAVELNTH': channel})
+
+    image_set = ImageSet({channel: LazyImage(partial(loader, channel)) for channel in ["171", "195", "304"]})
+    assert image_set.channels() == ["171", "195", "304"]
+    assert reads == [] and not image_set.is_loaded("195")
+    assert np.all(image_set["195"].data == 195)
+    image_set["195"]
+    assert reads == ["195"]
+
+    assert image_set.evict("195")
+    assert not image_set.is_loaded("195")
+    image_set.preload()
+    assert sorted(reads) == ["171", "195", "195", "304"]
+
+
+def test_in_memory_channels_are_not_evicted():
+    image_set = ImageSet({"171": Image(np.ones((4, 4)), {})})
+    assert not image_set.evict("171")
+    assert image_set.is_loaded("171")
+    with pytest.raises(RuntimeError):
+        image_set.evict("gong")
+
+
+def test_empty_set_allocates_nothing_up_front():
+    image_set = ImageSet.create_empty()
+    assert len(image_set.channels()) == 7
+    assert not any(image_set.is_loaded(channel) for channel in image_set.channels())
+    assert image_set["94"].data.shape == (1280, 1280)
+
+
+@pytest.mark.parametrize("hdu_class, memory_mapped", [(fits.ImageHDU, True), (fits.CompImageHDU, False)])
+def test_read_fits_image_maps_uncompressed_data(tmp_path, hdu_class, memory_mapped):
+    path = str(tmp_path / "image.fits")
+    data = np.arange(64, dtype=np.float32).reshape(8, 8)
+    fits.HDUList([fits.PrimaryHDU(), hdu_class(data)]).writeto(path)
+    image = read_fits_image(path)
+    assert np.array_equal(image.data, data)
+    base = image.data
+    while getattr(base, "base", None) is not None and not isinstance(base, mmap.mmap):
+        base = base.base
+    assert isinstance(base, mmap.mmap) == memory_mapped
+    # writing to the image never changes the file
+    image.data[0, 0] = -1
+    assert read_fits_image(path).data[0, 0] == 0
+
+
+def test_evicted_cached_composite_is_retrieved_again(tmp_path, monkeypatch):
+    def write(name, value):
+        path = str(tmp_path / name)
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(np.full((4, 4), value, dtype=np.float32))]).writeto(path)
+        return path
+
+    evicted = write("evicted.fits", 1)
+    retrieved = []
+
+    def retrieve_suvi_cached(satellite, product, date, save_directory, cache):
+        retrieved.append(date)
+        return write("retrieved.fits", 2)
+
+    monkeypatch.setattr(ImageSet, "_retrieve_suvi_cached", staticmethod(retrieve_suvi_cached))
+    os.remove(evicted)
+    image = ImageSet._read_cached_suvi(None, None, datetime(2023, 1, 1), evicted, None)
+    assert np.all(image.data == 2)
+    assert retrieved == [datetime(2023, 1, 1)]
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_retrieve_reports_progress(fake_network, concurrent):
+    reports = []
+    image_set = ImageSet.retrieve(datetime(2023, 1, 1), concurrent=concurrent, allow_partial=True,
+                                  progress=lambda channel, image, error: reports.append((channel, error)))
+    assert sorted(channel for channel, _ in reports) == sorted(CHANNELS)
+    assert [channel for channel, error in reports if error] == ["131"]
+    assert image_set.channels() == CHANNELS
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_retrieve_can_be_cancelled(fake_network, monkeypatch, concurrent):
+    cancel = threading.Event()
+    load_suvi_composite = ImageSet._load_suvi_composite
+
+    def slow_load_suvi_composite(date, wavelength, cache=None):
+        if wavelength != "94":
+            time.sleep(0.5)
+        return load_suvi_composite(date, wavelength, cache)
+
+    monkeypatch.setattr(ImageSet, "_load_suvi_composite", staticmethod(slow_load_suvi_composite))
+
+    def progress(channel, image, error):
+        cancel.set()
+
+    with pytest.raises(RetrievalCancelled):
+        ImageSet.retrieve(datetime(2023, 1, 1), concurrent=concurrent, progress=progress, cancel=cancel)
+
+
+def make_thematic_map():
+    data = np.zeros((1280, 1280), dtype=np.uint8)
+    data[200:600, 300:900] = 4
+    data[700:1000, 100:400] = 7
+    return ThematicMap(data, {'DATE-OBS': '2023-01-01T00:00:00', 'DIAM_SUN': 200.0},
+                       {4: 'filament', 7: 'coronal_hole'})
+
+
+@pytest.mark.parametrize("compression", [None, "RICE_1", "GZIP_2"])
+def test_thematic_map_round_trip(tmp_path, compression):
+    thmap = make_thematic_map()
+    path = str(tmp_path / "thmap.fits")
+    thmap.save(path, compression=compression)
+    loaded = ThematicMap.load(path)
+    np.testing.assert_array_equal(loaded.data, thmap.data)
+    assert loaded.theme_mapping == thmap.theme_mapping
+    assert loaded.metadata['DATE-OBS'] == '2023-01-01T00:00:00'
+    assert loaded.metadata['DIAM_SUN'] == 200.0
+    assert verify_checksums(path)
+
+
+def test_compressed_thematic_map_is_smaller(tmp_path):
+    thmap = make_thematic_map()
+    plain, compressed = str(tmp_path / "plain.fits"), str(tmp_path / "compressed.fits")
+    thmap.save(plain)
+    thmap.save(compressed, compression="GZIP_2")
+    assert os.path.getsize(compressed) * 10 < os.path.getsize(plain)
+
+
+def test_thematic_map_rejects_unknown_compression(tmp_path):
+    with pytest.raises(RuntimeError):
+        make_thematic_map().save(str(tmp_path / "thmap.fits"), compression="LZMA")
+
+
+def test_thematic_map_holds_uint8_labels():
+    thmap = ThematicMap(np.full((4, 4), 7.0), {'DATE-OBS': '2023-01-01T00:00:00'}, {7: 'coronal_hole'}, 9)
+    assert thmap.data.dtype == LABEL_DTYPE
+    labels = np.zeros((4, 4), dtype=LABEL_DTYPE)
+    thmap.data = labels
+    assert thmap.data is labels
+
+
+@pytest.mark.parametrize("data", [np.full((4, 4), 10), np.full((4, 4), -1), np.full((4, 4), 2.5),
+                                  np.full((4, 4), np.nan)])
+def test_thematic_map_rejects_invalid_labels(data):
+    with pytest.raises(RuntimeError):
+        ThematicMap(data, {'DATE-OBS': '2023-01-01T00:00:00'}, {7: 'coronal_hole'}, 9)
+
+
+def test_load_rejects_labels_above_max_index(tmp_path):
+    path = str(tmp_path / "thmap.fits")
+    make_thematic_map().save(path)
+    assert ThematicMap.load(path, 7).data.dtype == LABEL_DTYPE
+    with pytest.raises(RuntimeError):
+        ThematicMap.load(path, 5)
+
+
+def test_as_labels_rejects_max_index_beyond_dtype():
+    with pytest.raises(RuntimeError):
+        as_labels(np.zeros((2, 2)), 300)
+
+
+def test_theme_mappings_match():
+    assert theme_mappings_match({1: 'outer_space', 4: 'filament'}, {4: 'filament', 1: 'outer_space'})
+    assert not theme_mappings_match({1: 'outer_space'}, {1: 'outer_space', 4: 'filament'})
+    assert not theme_mappings_match({1: 'outer_space', 4: 'filament'}, {1: 'outer_space'})
+    assert not theme_mappings_match({4: 'filament'}, {4: 'flare'})
+    assert make_thematic_map().complies_with_mapping({4: 'filament', 7: 'coronal_hole'})
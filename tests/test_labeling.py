@@ -0,0 +1,90 @@
+from matplotlib import path
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from solarannotator.labeling import lasso_fill, flood_fill_mask, flood_fill, region_contours
+
+
+def full_image_lasso(array, verts, value):
+    rows, columns = np.indices(array.shape)
+    inside = path.Path(verts).contains_points(np.column_stack([columns.ravel(), rows.ravel()]), radius=1)
+    array = array.copy()
+    array.ravel()[inside] = value
+    return array
+
+
+@pytest.mark.parametrize("verts", [
+    [(10.2, 12.7), (40.5, 15.1), (33.3, 48.9), (12.0, 30.0)],
+    [(12.0, 30.0), (33.3, 48.9), (40.5, 15.1), (10.2, 12.7)],  # opposite winding
+    [(-20.0, -5.0), (30.0, -10.0), (25.5, 25.5)],  # partly off the image
+    [(60.0, 60.0), (63.5, 61.0), (62.0, 63.9)],  # in the corner
+])
+def test_lasso_matches_full_image_test(verts):
+    array = np.random.default_rng(0).integers(0, 9, (64, 64)).astype(np.uint8)
+    expected = full_image_lasso(array, verts, 5)
+    window = lasso_fill(array, verts, 5)
+    assert np.array_equal(array, expected)
+    assert window[0].stop - window[0].start < 64 or window[1].stop - window[1].start < 64
+
+
+def test_lasso_off_image():
+    array = np.zeros((16, 16))
+    lasso_fill(array, [(100, 100), (120, 100), (110, 130)], 3)
+    assert not np.any(array)
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+def test_flood_fill_matches_ndimage_label(connectivity):
+    array = np.random.default_rng(1).integers(0, 3, (48, 48)).astype(np.uint8)
+    structure = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    for seed in [(0, 0), (17, 30), (47, 47), (24, 5)]:
+        components = ndimage.label(array == array[seed], structure=structure)[0]
+        expected = components == components[seed]
+        window, mask = flood_fill_mask(array, seed, connectivity)
+        region = np.zeros(array.shape, dtype=bool)
+        region[window] = mask
+        assert np.array_equal(region, expected)
+        assert np.array_equal(np.argwhere(region).min(axis=0), [window[0].start, window[1].start])
+        assert np.array_equal(np.argwhere(region).max(axis=0), [window[0].stop - 1, window[1].stop - 1])
+
+
+def test_flood_fill_spiral():
+    # a region that doubles back on itself needs spans to be revisited from both sides
+    array = np.zeros((9, 9), dtype=np.uint8)
+    array[1, 1:8] = array[1:8, 7] = array[7, 1:8] = array[3:8, 1] = array[3, 1:6] = array[3:6, 5] = 1
+    spiral = array == 1
+    window = flood_fill(array, (5, 5), 2)
+    assert window == (slice(1, 8), slice(1, 8))
+    assert np.array_equal(array == 2, spiral)
+
+
+def test_flood_fill_rejects_connectivity():
+    with pytest.raises(RuntimeError):
+        flood_fill_mask(np.zeros((4, 4)), (0, 0), connectivity=6)
+
+
+def test_region_contours_outer_ring_and_holes():
+    array = np.zeros((40, 40), dtype=np.uint8)
+    array[10:30, 5:25] = 1
+    array[14:17, 9:12] = 0
+    array[20:25, 15:20] = 0
+    window, mask = flood_fill_mask(array, (10, 5))
+    outer_rings, holes = region_contours(window, mask)
+    assert len(outer_rings) == 1 and len(holes) == 2
+    ring = outer_rings[0]
+    assert np.array_equal(ring[0], ring[-1])
+    # the ring runs along the pixel edges, half a pixel outside the region
+    assert np.allclose(ring.min(axis=0), [9.5, 4.5]) and np.allclose(ring.max(axis=0), [29.5, 24.5])
+    hole_extents = sorted((tuple(hole.min(axis=0)), tuple(hole.max(axis=0))) for hole in holes)
+    assert np.allclose(hole_extents, [((13.5, 8.5), (16.5, 11.5)), ((19.5, 14.5), (24.5, 19.5))])
+
+
+def test_region_contours_closes_at_image_border():
+    array = np.zeros((20, 20), dtype=np.uint8)
+    array[8:12, 8:12] = 1
+    window, mask = flood_fill_mask(array, (0, 0))
+    outer_rings, holes = region_contours(window, mask)
+    assert len(outer_rings) == 1 and len(holes) == 1
+    assert np.allclose(outer_rings[0].min(axis=0), [-0.5, -0.5])
+    assert np.allclose(outer_rings[0].max(axis=0), [19.5, 19.5])
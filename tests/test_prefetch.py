@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+import threading
+import numpy as np
+import pytest
+
+from solarannotator.io import ImageSet, Image, RetrievalCancelled
+from solarannotator.prefetch import Prefetcher
+
+START = datetime(2023, 1, 1, 12)
+CADENCE = timedelta(hours=6)
+
+
+class FakeRetrieve:
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, date, progress=None, cancel=None):
+        self.requests.append(date)
+        self.release.wait()
+        image_set = ImageSet({"171": Image(np.full((4, 4), date.hour), {})})
+        if progress is not None:
+            progress("171", image_set["171"], None)
+        return image_set
+
+
+def wait_for_prefetches(prefetcher, dates):
+    for date in dates:
+        prefetcher._entries[date].future.result(timeout=5)
+
+
+def test_neighbors_are_prefetched_and_reused():
+    retrieve = FakeRetrieve()
+    prefetcher = Prefetcher(retrieve, CADENCE, steps=1)
+    prefetcher.prefetch_around(START)
+    wait_for_prefetches(prefetcher, [START + CADENCE, START - CADENCE])
+    assert sorted(retrieve.requests) == [START - CADENCE, START + CADENCE]
+
+    reports = []
+    image_set = prefetcher.retrieve(START + CADENCE, progress=lambda *args: reports.append(args[0]))
+    assert image_set["171"].data[0, 0] == 18
+    assert reports == ["171"]
+    assert len(retrieve.requests) == 2
+    prefetcher.shutdown()
+
+
+def test_store_is_bounded_and_keeps_the_window():
+    retrieve = FakeRetrieve()
+    prefetcher = Prefetcher(retrieve, CADENCE, steps=1, max_sets=3)
+    date = START
+    for _ in range(4):
+        prefetcher.retrieve(date)
+        prefetcher.prefetch_around(date)
+        wait_for_prefetches(prefetcher, prefetcher.neighbors(date))
+        date += CADENCE
+    last = date - CADENCE
+    assert len(prefetcher._entries) == 3
+    assert all(neighbor in prefetcher for neighbor in prefetcher.neighbors(last))
+    assert last in prefetcher
+    # every date was retrieved once, stepping forward found the next one ready
+    assert len(retrieve.requests) == len(set(retrieve.requests))
+    prefetcher.shutdown()
+
+
+def test_waiting_on_a_prefetch_can_be_cancelled():
+    retrieve = FakeRetrieve()
+    retrieve.release.clear()
+    prefetcher = Prefetcher(retrieve, CADENCE, steps=1)
+    prefetcher.prefetch_around(START)
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(RetrievalCancelled):
+        prefetcher.retrieve(START + CADENCE, cancel=cancel)
+    retrieve.release.set()
+    prefetcher.shutdown()
@@ -0,0 +1,107 @@
+import json
+import numpy as np
+import pytest
+import threading
+
+from solarannotator import profiling
+from solarannotator.profiling import profiled, measure
+
+
+@pytest.fixture(autouse=True)
+def profiling_off():
+    yield
+    profiling.disable()
+
+
+@profiled(details=lambda size: {'size': size})
+def allocate(size):
+    return np.ones(size, dtype=np.uint8).sum()
+
+
+def test_disabled_records_nothing():
+    assert allocate(10) == 10
+    with measure("block"):
+        pass
+    assert not profiling.is_enabled()
+    assert profiling.records() == []
+
+
+def test_records_wall_cpu_and_peak_allocation():
+    profiling.enable()
+    allocate(4 * 1024 ** 2)
+    record, = profiling.records()
+    assert record.name == "allocate"
+    assert record.details == {'size': 4 * 1024 ** 2}
+    assert record.wall >= 0 and record.cpu >= 0
+    assert record.peak >= 4 * 1024 ** 2
+
+
+def test_nested_peak_includes_inner_calls():
+    profiling.enable()
+    with measure("outer"):
+        allocate(4 * 1024 ** 2)
+        allocate(1024)
+    inner, small, outer = profiling.records()
+    assert outer.name == "outer"
+    assert outer.peak >= inner.peak > small.peak
+
+
+def test_ring_buffer_keeps_latest_records():
+    profiling.enable(capacity=3, trace_memory=False)
+    for size in range(5):
+        allocate(size)
+    assert [record.details['size'] for record in profiling.records()] == [2, 3, 4]
+    assert profiling.records()[0].peak is None
+
+
+def test_errors_are_recorded():
+    profiling.enable(trace_memory=False)
+    with pytest.raises(ValueError):
+        with measure("failing"):
+            raise ValueError("no")
+    assert profiling.records()[0].details == {'error': 'ValueError'}
+
+
+def test_enable_from_environment():
+    assert not profiling.enable_from_environment({profiling.ENVIRONMENT_VARIABLE: "0"})
+    assert profiling.enable_from_environment({profiling.ENVIRONMENT_VARIABLE: "1"})
+
+
+def test_exports(tmp_path):
+    profiling.enable()
+    allocate(100)
+    allocate(200)
+    profiling.export_json(str(tmp_path / "profile.json"))
+    profiling.export_chrome_trace(str(tmp_path / "trace.json"))
+
+    with open(tmp_path / "profile.json") as f:
+        exported = json.load(f)
+    assert len(exported['records']) == 2
+    assert exported['summary']['allocate']['calls'] == 2
+
+    with open(tmp_path / "trace.json") as f:
+        events = [event for event in json.load(f)['traceEvents'] if event['ph'] == 'X']
+    assert [event['args']['size'] for event in events] == [100, 200]
+    assert all(event['dur'] >= 0 and 'peak_bytes' in event['args'] for event in events)
+
+
+def test_overlapping_threads_get_no_peak():
+    profiling.enable()
+    started, release = threading.Event(), threading.Event()
+
+    def background():
+        with measure("background"):
+            started.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=background)
+    thread.start()
+    started.wait(5)
+    with measure("outer"):
+        allocate(1024)
+    release.set()
+    thread.join()
+    allocate(1024)
+    peaks = {record.name: record.peak for record in profiling.records()[:-1]}
+    assert peaks == {'allocate': None, 'outer': None, 'background': None}
+    assert profiling.records()[-1].peak is not None
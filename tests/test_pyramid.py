@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from solarannotator.pyramid import DisplayPyramid, downsample_mean, downsample_mode
+
+
+def block_mode(labels, factor):
+    rows, columns = labels.shape[0] // factor, labels.shape[1] // factor
+    expected = np.empty((rows, columns), dtype=labels.dtype)
+    for row in range(rows):
+        for column in range(columns):
+            block = labels[row * factor:(row + 1) * factor, column * factor:(column + 1) * factor]
+            expected[row, column] = np.bincount(block.ravel()).argmax()
+    return expected
+
+
+@pytest.mark.parametrize("factor", [2, 4, 8])
+def test_mode_keeps_the_most_common_label(factor):
+    labels = np.random.default_rng(factor).integers(0, 10, size=(64, 48)).astype(np.uint8)
+    result = downsample_mode(labels, factor)
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(result, block_mode(labels, factor))
+
+
+def test_mean_averages_blocks_and_pads_edges():
+    image = np.arange(5 * 6 * 3, dtype=float).reshape(5, 6, 3)
+    result = downsample_mean(image, 2)
+    assert result.shape == (3, 3, 3) and result.dtype == np.float32
+    np.testing.assert_allclose(result[0, 0], image[:2, :2].mean(axis=(0, 1)))
+    np.testing.assert_allclose(result[2, 1], image[4, 2:4].mean(axis=0))
+
+
+def test_update_matches_a_rebuild():
+    labels = np.zeros((100, 100), dtype=np.uint8)
+    pyramid = DisplayPyramid(labels, downsample_mode)
+    labels[13:37, 50:61] = 4
+    pyramid.update((slice(13, 37), slice(50, 61)))
+    rebuilt = DisplayPyramid(labels, downsample_mode)
+    for level, expected in zip(pyramid.levels, rebuilt.levels):
+        np.testing.assert_array_equal(level, expected)
+
+
+def test_view_picks_the_level_of_the_zoom_and_crops_it():
+    image = np.random.default_rng(0).random((1280, 1280))
+    pyramid = DisplayPyramid(image, downsample_mean)
+
+    crop, extent = pyramid.view((-0.5, 1279.5), (-0.5, 1279.5), 300, 300)
+    assert crop.shape == (320, 320)  # four image pixels per screen pixel
+    assert extent == (-0.5, 1279.5, -0.5, 1279.5)
+
+    crop, extent = pyramid.view((100, 200), (300, 350), 600, 300)
+    assert crop is not image and crop.base is image
+    np.testing.assert_array_equal(crop, image[299:352, 99:202])
+    assert extent == (98.5, 201.5, 298.5, 351.5)
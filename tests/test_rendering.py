@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+
+from solarannotator.pyramid import DisplayPyramid, downsample_mode
+from solarannotator.rendering import BlitManager, image_window
+
+
+def make_canvas(labels, factor=1):
+    figure = Figure(figsize=(4, 3), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    pyramid = DisplayPyramid(labels, downsample_mode)
+    level = pyramid.factors.index(factor)
+    image = ax.imshow(pyramid.levels[level], origin='lower', interpolation='none', vmin=0, vmax=9,
+                      extent=(-0.5, labels.shape[1] - 0.5, -0.5, labels.shape[0] - 0.5))
+    ax.set_autoscale_on(False)
+    blit_manager = BlitManager(canvas)
+    canvas.draw()
+    return canvas, pyramid, pyramid.levels[level], image, blit_manager
+
+
+def rendered(canvas):
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def full_draw(canvas):
+    canvas.draw()
+    return rendered(canvas)
+
+
+def test_image_window_covers_the_blocks_of_a_level():
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    _, _, shown, image, _ = make_canvas(labels, factor=4)
+    part, extent = image_window(shown, image.get_extent(), (slice(5, 10), slice(30, 33)))
+    assert part.shape == (2, 2)
+    assert extent == (27.5, 35.5, 3.5, 11.5)
+    assert image_window(shown, image.get_extent(), (slice(70, 80), slice(0, 4))) is None
+
+
+@pytest.mark.parametrize("factor", [1, 4])
+def test_blitted_edit_matches_a_full_draw(factor):
+    labels = np.zeros((128, 128), dtype=np.uint8)
+    canvas, pyramid, shown, image, blit_manager = make_canvas(labels, factor)
+    before = rendered(canvas)
+    window = (slice(20, 47), slice(61, 90))
+    labels[window] = 6
+    pyramid.update(window)
+    blit_manager.update_image(image, shown, window)
+    blitted = rendered(canvas)
+    assert not np.array_equal(blitted, before)
+    np.testing.assert_array_equal(blitted, full_draw(canvas))
+
+
+def test_animated_artists_survive_edits_and_removal():
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    canvas, pyramid, shown, image, blit_manager = make_canvas(labels)
+    patch = image.axes.add_patch(Rectangle((10, 10), 20, 20, fill=False, edgecolor='black', lw=2))
+    blit_manager.add_artist(patch)
+    blit_manager.update()
+    with_patch = rendered(canvas)
+
+    window = (slice(40, 50), slice(40, 50))
+    labels[window] = 3
+    pyramid.update(window)
+    blit_manager.update_image(image, shown, window)
+    # a full draw leaves animated artists to the blit manager, which draws them after it
+    np.testing.assert_array_equal(rendered(canvas), full_draw(canvas))
+    assert not np.array_equal(rendered(canvas)[..., :3], with_patch[..., :3])
+
+    dirty = blit_manager.remove_artist(patch)
+    blit_manager.update(dirty=[dirty])
+    np.testing.assert_array_equal(rendered(canvas), full_draw(canvas))
+
+
+def test_dirty_areas_are_blitted_with_an_edit():
+    # a selector that hides its line without drawing leaves it on screen until its area is blitted again
+    labels = np.zeros((64, 64), dtype=np.uint8)
+    canvas, pyramid, shown, image, blit_manager = make_canvas(labels)
+    blitted = []
+    canvas.blit = blitted.append
+    labels[10:12, 10:12] = 3
+    blit_manager.update_image(image, shown, (slice(10, 12), slice(10, 12)))
+    assert blitted[-1].width < image.axes.bbox.width / 2
+    blit_manager.update_image(image, shown, (slice(10, 12), slice(10, 12)), dirty=[image.axes.bbox.frozen()])
+    assert np.allclose(blitted[-1].bounds, image.axes.bbox.bounds)
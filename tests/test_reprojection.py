@@ -0,0 +1,59 @@
+from astropy.io import fits
+import numpy as np
+import pytest
+
+from solarannotator.io import ImageSet, Image
+from solarannotator.reprojection import ReprojectionCache
+
+
+def make_header(size, cdelt, crpix, date_obs):
+    header = fits.Header()
+    header['NAXIS'] = 2
+    header['NAXIS1'] = header['NAXIS2'] = size
+    header['CTYPE1'], header['CTYPE2'] = 'HPLN-TAN', 'HPLT-TAN'
+    header['CUNIT1'] = header['CUNIT2'] = 'arcsec'
+    header['CDELT1'] = header['CDELT2'] = cdelt
+    header['CRPIX1'], header['CRPIX2'] = crpix
+    header['CRVAL1'] = header['CRVAL2'] = 0.0
+    header['DATE-OBS'] = date_obs
+    header['DSUN_OBS'] = 1.47e11
+    header['HGLN_OBS'] = 0.0
+    header['HGLT_OBS'] = -3.0
+    return header
+
+
+@pytest.fixture
+def images():
+    gong = Image(np.random.default_rng(0).random((64, 64)).astype('>f4'),
+                 make_header(64, 37.5, (32.3, 31.8), '2023-01-01T00:00:00'))
+    suvi = Image(np.zeros((32, 32)), make_header(32, 93.75, (16.5, 16.5), '2023-01-01T00:00:10'))
+    return gong, suvi
+
+
+def test_cached_reprojection_matches_sunpy(tmp_path, images):
+    gong, suvi = images
+    cache = ReprojectionCache(str(tmp_path))
+    expected = ImageSet._reproject_gong_image(gong, suvi)
+    for _ in range(2):  # computed, then read back
+        result = ImageSet._reproject_gong_image(gong, suvi, cache)
+        assert np.array_equal(np.isnan(result.data), np.isnan(expected.data))
+        assert np.allclose(result.data, expected.data, equal_nan=True, atol=1e-4)
+        assert result.header == expected.header
+
+
+def test_mapping_is_reused_for_a_shifted_later_observation(tmp_path, images):
+    gong, suvi = images
+    cache = ReprojectionCache(str(tmp_path))
+    ImageSet._reproject_gong_image(gong, suvi, cache)
+
+    gong_header = gong.header.copy()
+    gong_header['CRPIX1'] += 1.3
+    gong_header['DATE-OBS'] = '2023-01-02T00:00:00'
+    suvi_header = suvi.header.copy()
+    suvi_header['DATE-OBS'] = '2023-01-02T00:00:10'
+    later_gong, later_suvi = Image(gong.data, gong_header), Image(suvi.data, suvi_header)
+
+    result = ImageSet._reproject_gong_image(later_gong, later_suvi, cache)
+    expected = ImageSet._reproject_gong_image(later_gong, later_suvi)
+    assert len(list(tmp_path.glob("mapping-*"))) == 1
+    assert np.allclose(result.data, expected.data, equal_nan=True, atol=1e-4)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from solarannotator.history import EditHistory
+from solarannotator.io import ThematicMap, LABEL_DTYPE
+from solarannotator.session import AnnotationSession, Operation, write_log, read_log, replay_maps
+
+SQUARE = [(10, 10), (30, 10), (30, 30), (10, 30)]
+
+
+def make_session(history=None):
+    data = np.ones((64, 64), dtype=LABEL_DTYPE)
+    data[40:50, 40:50] = 7
+    thmap = ThematicMap(data, {'DATE-OBS': '2023-01-01T00:00:00'}, {1: 'outer_space', 4: 'filament', 7: 'quiet_sun'},
+                        9)
+    return AnnotationSession(thmap, history=history)
+
+
+def test_lasso_fill_and_undo():
+    session = make_session(EditHistory(coalesce_pixels=0))
+    original = session.data.copy()
+    session.lasso(SQUARE, 4)
+    assert session.data[20, 20] == 4 and session.data[5, 5] == 1
+    session.fill(45, 45, 4)
+    assert np.all(session.data[40:50, 40:50] == 4)
+    assert session.thmap.data is session.data
+    session.undo()
+    session.undo()
+    np.testing.assert_array_equal(session.data, original)
+    assert [operation.name for operation in session.log] == ['lasso', 'fill', 'undo', 'undo']
+
+
+def test_rejects_themes_beyond_max_index():
+    with pytest.raises(RuntimeError):
+        make_session().lasso(SQUARE, 10)
+
+
+def test_boundary_leaves_map_unchanged():
+    session = make_session()
+    outer_rings, holes = session.boundary(45, 45)
+    assert len(outer_rings) == 1 and holes == []
+    assert not session.log
+
+
+def test_replay_repeats_undo_steps(tmp_path):
+    # the two small edits merge into one undo step while recording, the replay has to merge them too
+    recorded = make_session(EditHistory(coalesce_pixels=1000, coalesce_seconds=60))
+    recorded.lasso(SQUARE, 4)
+    recorded.fill(45, 45, 4)
+    recorded.undo()
+    recorded.fill(5, 5, 7)
+    path = str(tmp_path / "edits.jsonl")
+    write_log(path, recorded.log)
+
+    replayed = make_session(EditHistory(coalesce_pixels=0))
+    assert replayed.replay(read_log(path)) == 4
+    np.testing.assert_array_equal(replayed.data, recorded.data)
+
+
+def test_unknown_operation():
+    with pytest.raises(RuntimeError):
+        make_session().apply(Operation('erase', {}, 0.0))
+
+
+def test_replay_maps(tmp_path):
+    for name in ("a.fits", "b.fits"):
+        make_session().thmap.save(str(tmp_path / name))
+    small = np.ones((16, 16), dtype=LABEL_DTYPE)
+    ThematicMap(small, {'DATE-OBS': '2023-01-01T00:00:00'}, {1: 'outer_space'}).save(str(tmp_path / "small.fits"))
+    operations = [Operation('lasso', {'verts': SQUARE, 'theme': 4}, 0.0),
+                  Operation('fill', {'x': 45, 'y': 45, 'theme': 4}, 0.0)]
+    paths = [str(tmp_path / name) for name in ("missing.fits", "small.fits", "a.fits", "b.fits")]
+    summary = replay_maps(operations, paths, str(tmp_path / "corrected"), report=lambda line: None)
+    assert summary['operations'] == 4
+    # the click outside the small map fails it, the maps after it are still corrected
+    assert summary['failed'] == paths[:2]
+    corrected = ThematicMap.load(str(tmp_path / "corrected" / "b.fits"))
+    assert corrected.data[20, 20] == 4
+    assert 'DATE' in corrected.metadata
@@ -0,0 +1,115 @@
+import csv
+import os
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from solarannotator.geometry import within_radius
+from solarannotator.io import ThematicMap
+from solarannotator.stats import map_statistics, solar_geometry, summarize, ColumnarWriter, COLUMNS
+
+THEME_MAPPING = {1: 'outer_space', 4: 'filament', 6: 'coronal_hole', 7: 'quiet_sun', 9: 'flare'}
+
+
+def make_map(seed=0, shape=(200, 200)):
+    rng = np.random.default_rng(seed)
+    data = np.where(within_radius(shape, 80), 7, 1).astype(np.uint8)
+    for value in (4, 6, 9):
+        for _ in range(6):
+            row, column = rng.integers(10, shape[0] - 20, size=2)
+            height, width = rng.integers(2, 15, size=2)
+            data[row:row + height, column:column + width] = value
+    return data
+
+
+@pytest.mark.parametrize("connectivity", [1, 2])
+def test_matches_labeling_every_theme_separately(connectivity):
+    data = make_map()
+    rows = {row['value']: row for row in map_statistics(data, THEME_MAPPING, 80, connectivity=connectivity)}
+    structure = ndimage.generate_binary_structure(2, connectivity)
+    for value in THEME_MAPPING:
+        regions, count = ndimage.label(data == value, structure=structure)
+        sizes = np.bincount(regions.ravel())[1:]
+        assert rows[value]['pixels'] == np.sum(data == value)
+        assert rows[value]['regions'] == count
+        if count:
+            assert rows[value]['largest_region'] == sizes.max()
+            assert rows[value]['smallest_region'] == sizes.min()
+            assert rows[value]['median_region'] == np.median(sizes)
+
+
+def test_regions_touching_at_a_corner_are_separate_by_default():
+    data = np.ones((10, 10), dtype=np.uint8)
+    data[2:4, 2:4] = 4
+    data[4:6, 4:6] = 4
+    assert {row['value']: row for row in map_statistics(data, THEME_MAPPING, 3)}[4]['regions'] == 2
+    assert {row['value']: row for row in map_statistics(data, THEME_MAPPING, 3, connectivity=2)}[4]['regions'] == 1
+
+
+def test_areas_are_split_by_the_template_radii():
+    data = np.full((100, 100), 7, dtype=np.uint8)
+    rows = {row['value']: row for row in map_statistics(data, THEME_MAPPING, 30, limb_thickness=10)}
+    disk = np.sum(within_radius(data.shape, 25))
+    limb = np.sum(within_radius(data.shape, 35)) - disk
+    assert rows[7]['disk_pixels'] == disk
+    assert rows[7]['limb_pixels'] == limb
+    assert rows[7]['off_disk_pixels'] == data.size - disk - limb
+    assert rows[7]['disk_fraction'] == 1
+    assert rows[9]['pixels'] == 0 and rows[9]['regions'] == 0
+
+
+def test_geometry_prefers_the_recorded_template_radius():
+    assert solar_geometry({'RSUN_PIX': 390.5, 'DIAM_SUN': 770.0, 'LIMB_PIX': 12.0}) == (390.5, 12.0)
+    assert solar_geometry({'DIAM_SUN': 770.0}) == (385.0, 10.0)
+    with pytest.raises(RuntimeError):
+        solar_geometry({})
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_summarize_writes_csv_and_columns(tmp_path, processes):
+    paths = []
+    for seed in range(4):
+        path = str(tmp_path / "map_{}.fits".format(seed))
+        ThematicMap(make_map(seed), {'DATE-OBS': '2023-01-0{}T00:00:00'.format(seed + 1), 'DIAM_SUN': 160.0},
+                    THEME_MAPPING).save(path)
+        paths.append(path)
+    paths.append(str(tmp_path / "missing.fits"))
+
+    reports = []
+    summary = summarize(paths, str(tmp_path / "statistics.csv"), processes=processes, report=reports.append)
+    assert summary['summarized'] == paths[:4]
+    assert summary['failed'] == paths[4:] and len(reports) == 1
+    with open(str(tmp_path / "statistics.csv")) as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 4 * len(THEME_MAPPING)
+    assert list(rows[0]) == COLUMNS
+
+    summarize(paths[:4], str(tmp_path / "statistics.npz"), processes=processes, report=reports.append)
+    columns = np.load(str(tmp_path / "statistics.npz"))
+    assert [int(value) for value in columns['pixels']] == [int(row['pixels']) for row in rows]
+    assert list(columns['theme'][:len(THEME_MAPPING)]) == list(THEME_MAPPING.values())
+
+
+def test_columns_are_written_in_chunks(tmp_path):
+    rows = [dict(row, path="map_{}.fits".format(index), date_obs='2023-01-01T00:00:00')
+            for index in range(5) for row in map_statistics(make_map(index), THEME_MAPPING, 80)]
+    rows[-1]['path'] = "a_much_longer_name_than_the_others.fits"
+    writer = ColumnarWriter(str(tmp_path / "statistics.npz"), chunk_rows=2 * len(THEME_MAPPING))
+    for index in range(5):
+        writer.write(rows[index * len(THEME_MAPPING):(index + 1) * len(THEME_MAPPING)])
+    assert writer.length == 4 * len(THEME_MAPPING) and len(writer.rows) == len(THEME_MAPPING)
+    directory = writer.directory.name
+    writer.close()
+    assert not os.path.exists(directory)
+
+    columns = np.load(str(tmp_path / "statistics.npz"))
+    assert sorted(columns.files) == sorted(COLUMNS)
+    for column in COLUMNS:
+        assert list(columns[column]) == [row[column] for row in rows]
+    assert columns['regions'].dtype.kind == 'i' and columns['disk_fraction'].dtype.kind == 'f'
+
+
+def test_empty_columns(tmp_path):
+    ColumnarWriter(str(tmp_path / "statistics.npz")).close()
+    columns = np.load(str(tmp_path / "statistics.npz"))
+    assert all(len(columns[column]) == 0 for column in COLUMNS)
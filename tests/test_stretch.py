@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from solarannotator.stretch import StretchCache, percentile_from_sorted, sorted_finite, stretch_image, \
+    three_color_composite
+
+
+def legacy_stretch(data, lower_percentile, upper_percentile, scale):
+    preview = data.copy()
+    preview = np.power(np.abs(preview), scale) * np.sign(preview)
+    lower = np.nanpercentile(preview, lower_percentile)
+    upper = np.nanpercentile(preview, upper_percentile)
+    preview[preview < lower] = lower
+    preview[preview > upper] = upper
+    return (preview - np.nanmin(preview)) / (np.nanmax(preview) - np.nanmin(preview))
+
+
+@pytest.fixture
+def image():
+    data = np.random.default_rng(0).standard_normal((96, 96)) * 50 + 20
+    data[:5, :5] = np.nan
+    data[10, 10] = 0
+    return data
+
+
+@pytest.mark.parametrize("scale", [0, 0.25, 1, 2.5])
+@pytest.mark.parametrize("percentile", [0, 3.0, 37.3, 50, 99.9, 100])
+def test_percentile_from_sorted_matches_nanpercentile(image, scale, percentile):
+    expected = np.nanpercentile(np.power(np.abs(image), scale) * np.sign(image), percentile)
+    assert percentile_from_sorted(sorted_finite(image), percentile, scale) == pytest.approx(expected, rel=1e-12)
+
+
+@pytest.mark.parametrize("lower, upper, scale", [(3.0, 99.9, 0.25), (0, 100, 1), (10, 90, 0), (5, 95, 2)])
+def test_stretch_matches_legacy(image, lower, upper, scale):
+    expected = legacy_stretch(image, lower, upper, scale)
+    stretched = stretch_image(image, lower, upper, scale)
+    assert stretched.dtype == np.float32
+    assert np.array_equal(np.isnan(stretched), np.isnan(expected))
+    assert np.allclose(stretched, expected, atol=1e-6, equal_nan=True)
+
+
+def test_cache_memoizes_and_reuses_buffers(image):
+    cache = StretchCache(max_results=2)
+    first = cache.stretch("171", image, 3.0, 99.9, 0.25)
+    assert cache.stretch("171", image, 3.0, 99.9, 0.25) is first
+    sorted_values = cache.sorted_values("171", image)
+
+    second = cache.stretch("171", image, 5.0, 99.9, 0.25)
+    third = cache.stretch("171", image, 7.0, 99.9, 0.25)
+    assert cache.sorted_values("171", image) is sorted_values
+    assert np.allclose(third, legacy_stretch(image, 7.0, 99.9, 0.25), atol=1e-6, equal_nan=True)
+
+    # the first result fell out of the memo, so its array is written over by the next new one
+    fourth = cache.stretch("171", image, 9.0, 99.9, 0.25)
+    assert fourth is first and second is not fourth
+
+    # new data for a channel is sorted again
+    doubled = image * 2
+    cache.stretch("171", doubled, 3.0, 99.9, 0.25)
+    assert cache.sorted_values("171", doubled) is not sorted_values
+    assert np.array_equal(cache.sorted_values("171", doubled), 2 * sorted_values)
+
+
+def test_three_color_composite_stretches_each_channel(image):
+    cache = StretchCache()
+    channels, images = ["171", "195", "171"], [image, image[::-1], image]
+    composite = three_color_composite(channels, images, [3.0, 5.0, 10.0], [99.9, 99.0, 90.0],
+                                      [0.25, 0.5, 1.0], cache)
+    assert composite.shape == (96, 96, 3) and composite.dtype == np.float32
+    for index, (data, lower, upper, scale) in enumerate(zip(images, [3.0, 5.0, 10.0], [99.9, 99.0, 90.0],
+                                                            [0.25, 0.5, 1.0])):
+        assert np.allclose(composite[:, :, index], legacy_stretch(data, lower, upper, scale),
+                           atol=1e-6, equal_nan=True)
+
+    # changing one channel leaves the stretched images of the others untouched
+    green = cache.stretch("195", images[1], 5.0, 99.0, 0.5)
+    three_color_composite(channels, images, [4.0, 5.0, 10.0], [99.9, 99.0, 90.0], [0.25, 0.5, 1.0], cache)
+    assert cache.stretch("195", images[1], 5.0, 99.0, 0.5) is green
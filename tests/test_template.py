@@ -1,7 +1,42 @@
-from solarannotator.template import create_mask
+import numpy as np
+import pytest
+
+from solarannotator.io import ImageSet, Image
+from solarannotator.template import create_mask, create_thmap_template
+from solarannotator.geometry import concentric_rings
+
+
+def legacy_mask(radius, image_size):
+    center = (image_size[0] / 2) - 0.5
+    xm, ym = np.meshgrid(np.linspace(0, image_size[0] - 1, num=image_size[0]),
+                         np.linspace(0, image_size[1] - 1, num=image_size[1]))
+    return np.sqrt((xm - center) ** 2 + (ym - center) ** 2) < radius
 
 
 def test_mask_creation():
     mask = create_mask(500, (2048, 2048))
     assert not mask[0, 0]
-    assert mask[1024, 1024]
\ No newline at end of file
+    assert mask[1024, 1024]
+
+
+@pytest.mark.parametrize("radius", [10, 99.5, 100.0, 123.456, np.array([250.3])])
+def test_mask_matches_meshgrid_mask(radius):
+    assert np.array_equal(create_mask(radius, (512, 512)), legacy_mask(radius, (512, 512)))
+
+
+def test_rings_match_layered_masks():
+    radii = [50.5, 80.25, 120.0]
+    rings = concentric_rings((300, 300), radii, [4, 3, 2, 1])
+    layered = np.ones((300, 300))
+    for radius, value in zip(radii[::-1], [2, 3, 4]):
+        layered[legacy_mask(radius, (300, 300))] = value
+    assert np.array_equal(rings, layered)
+
+
+def test_template_layers():
+    header = {'DIAM_SUN': 400.0, 'DATE-OBS': '2023-01-01T00:00:00'}
+    image_set = ImageSet({channel: Image(np.ones((512, 512)), header) for channel in ['171', '304']})
+    thmap = create_thmap_template(image_set)
+    assert thmap.data[256, 256] == 7
+    assert thmap.data[0, 0] == 1
+    assert np.any(thmap.data == 8)